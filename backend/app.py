@@ -1,55 +1,135 @@
+from dotenv import load_dotenv
+
+# Before any local import, since modules read their settings at import time
+load_dotenv()
+
 from fastapi import FastAPI, HTTPException, Depends, WebSocket, WebSocketDisconnect, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
-from sqlalchemy.orm import Session
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
+from sqlalchemy import delete, insert, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
 from datetime import datetime, timedelta
 import logging
-import json
 import asyncio
-import traceback
+import time
 from contextlib import asynccontextmanager
-from collections import defaultdict
 from typing import List, Dict, Optional
 
-from models.database import get_db, Session as DBSession, SessionLocal
-from models.session import SessionCreate, SessionResponse, SessionExtend, SessionStatus
+from models.database import get_db, init_db, engine, Session as DBSession, SessionLocal, DB_SCHEMA_INIT
+from models.session import (
+    SessionCreate, SessionResponse, SessionExtend, SessionStatus,
+    SessionCreateBatch, SessionResponseBatch, SessionStatusBatchRequest, SessionStatusBatch,
+    SessionTerminateBatch
+)
 from utils.tokens import generate_session_id
 from utils.expiry import ExpiryService
-from utils.websocket_manager import ConnectionManager
-from utils.code_generator import CodeGenerator
+from utils.websocket_manager import ConnectionManager, CLOSE
+from utils.broker import create_broker
+from utils.code_store import create_code_store
+from utils.session_cache import SessionCache, CachedSession
+from utils.metrics import REGISTRY, RELAY_LATENCY, db_endpoint
+from utils.logging_setup import setup_logging, Sampler, RELAY_LOG_SAMPLE
+from utils.serialization import FastJSONResponse, control_frame
+from utils.protocol import BINARY_SUBPROTOCOL
+from utils.admission import AdmissionControl, AdmissionMiddleware
+from utils.snapshot import load_runtime_state, save_runtime_state
 
 # Try to import stream router, but don't fail if not available
 try:
-    from routes.stream import router as stream_router
+    from routes.stream import router as stream_router, executor as stream_executor
     STREAM_ROUTER_AVAILABLE = True
 except ImportError:
     STREAM_ROUTER_AVAILABLE = False
     print("Stream router not available")
 
-logging.basicConfig(level=logging.INFO)
+setup_logging()
 logger = logging.getLogger(__name__)
 
+relay_log_sampler = Sampler(RELAY_LOG_SAMPLE)
+
 BASE_URL = "https://driflly.vercel.app/"
 MAX_DURATION = 24 * 60
-
-message_queue: Dict[str, List[dict]] = defaultdict(list)
+# Keeps a batch's IN (...) list under SQLite's bound-parameter limit
+MAX_BATCH_SIZE = 500
+# Comment line sent on an idle event stream so proxies keep it open
+SSE_KEEPALIVE = 15
+
+
+def register_runtime_metrics(app: FastAPI):
+    """Gauges read straight from the live services at scrape time"""
+    state = app.state
+    REGISTRY.gauge("dispozhe_live_sessions", "Sessions with at least one socket on this worker",
+                   lambda: state.manager.get_active_sessions())
+    REGISTRY.gauge("dispozhe_live_sockets", "Open sockets on this worker",
+                   lambda: len(state.manager.connections))
+    REGISTRY.gauge("dispozhe_scheduled_expiries", "Live sessions waiting for their expiry deadline",
+                   lambda: len(state.expiry_service.scheduler))
+    REGISTRY.gauge("dispozhe_join_codes", "Join codes held in this worker's code table",
+                   lambda: state.code_store.size())
+    REGISTRY.gauge("dispozhe_session_cache_entries", "Sessions in the snapshot cache",
+                   lambda: len(state.session_cache))
+    REGISTRY.gauge("dispozhe_replay_bytes", "Bytes held in replay buffers",
+                   lambda: state.manager.replay.bytes)
+    REGISTRY.counter_from("dispozhe_replay_evicted_frames_total", "Replay frames evicted by the caps",
+                          lambda: state.manager.replay.evicted_frames)
+    REGISTRY.counter_from("dispozhe_send_failures_total", "Socket writes that raised",
+                          lambda: state.manager.send_failures)
+    REGISTRY.counter_from("dispozhe_dropped_frames_total", "Frames dropped on full send queues",
+                          lambda: state.manager.dropped_count)
+    REGISTRY.counter_from("dispozhe_evicted_sockets_total", "Slow consumers disconnected",
+                          lambda: state.manager.evicted_count)
+    REGISTRY.counter_from("dispozhe_reaped_sockets_total", "Sockets reaped after missing heartbeats",
+                          lambda: state.manager.heartbeat.reaped_count)
+    REGISTRY.gauge("dispozhe_http_in_flight", "HTTP requests being handled",
+                   lambda: admission.in_flight)
+    REGISTRY.counter_from("dispozhe_rate_limited_total", "Requests rejected with 429 by the rate limits",
+                          lambda: sum(admission.rate_limited.values()))
+    REGISTRY.counter_from("dispozhe_overloaded_total", "Requests rejected with 503 by the concurrency limit",
+                          lambda: admission.overloaded)
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     logger.info("Starting backend...")
+    if DB_SCHEMA_INIT != "skip":
+        await init_db()
+    app.state.session_cache = SessionCache()
     app.state.expiry_service = ExpiryService()
-    app.state.expiry_service.start()
+    app.state.expiry_service.set_session_cache(app.state.session_cache)
     app.state.manager = ConnectionManager()
     app.state.manager.set_expiry_service(app.state.expiry_service)
-    app.state.code_generator = CodeGenerator()
+    app.state.manager.set_session_cache(app.state.session_cache)
+    await app.state.manager.start_broker(create_broker())
+    app.state.manager.heartbeat.start()
+    app.state.expiry_service.set_connection_manager(app.state.manager)
+    await app.state.expiry_service.start()
+    app.state.code_store = create_code_store()
+    await app.state.code_store.start()
+    # Join codes and replay buffers left by the previous process
+    load_runtime_state(app.state)
+    app.state.background_tasks = set()
+    register_runtime_metrics(app)
     logger.info("Backend started successfully")
     yield
     logger.info("Shutting down backend...")
+    # Let in-flight terminations finish notifying their sockets
+    if app.state.background_tasks:
+        await asyncio.wait(app.state.background_tasks, timeout=app.state.manager.drain_timeout + 1)
+    save_runtime_state(app.state)
     app.state.expiry_service.stop()
+    app.state.manager.heartbeat.stop()
+    await app.state.code_store.close()
+    await app.state.manager.stop_broker()
+    await engine.dispose()
+    if STREAM_ROUTER_AVAILABLE:
+        stream_executor.shutdown(wait=False)
     logger.info("Backend stopped")
 
 app = FastAPI(title="dispozhe API", version="1.0.0", lifespan=lifespan)
 
+# Added before CORS so rejections still carry CORS headers
+admission = AdmissionControl()
+app.add_middleware(AdmissionMiddleware, control=admission)
+
 # Conditionally include stream router if available
 if STREAM_ROUTER_AVAILABLE:
     app.include_router(stream_router)
@@ -79,20 +159,135 @@ app.add_middleware(
 async def health_check():
     return {"status": "healthy", "service": "dispozhe backend"}
 
+@app.get("/metrics")
+async def metrics():
+    return PlainTextResponse(REGISTRY.render(), media_type="text/plain; version=0.0.4")
+
 @app.get("/")
 async def root():
     return {"message": "dispozhe backend API", "docs": "/docs", "health": "/health"}
 
+async def get_session_snapshot(db: AsyncSession, session_id: str) -> Optional[CachedSession]:
+    """Read a session from the in-process cache, falling back to the DB"""
+    cached = app.state.session_cache.get(session_id)
+    if cached:
+        return cached
+
+    session = await db.get(DBSession, session_id)
+    if not session:
+        return None
+
+    snapshot = CachedSession.from_row(session)
+    if snapshot.status in ("waiting", "active") and datetime.utcnow() < snapshot.expires_at:
+        app.state.session_cache.put(snapshot)
+    return snapshot
+
+async def read_session_snapshot(session_id: str) -> Optional[CachedSession]:
+    """Snapshot for long-lived handlers: a cache miss borrows a pooled connection only for the read"""
+    cached = app.state.session_cache.get(session_id)
+    if cached:
+        return cached
+    async with SessionLocal() as db:
+        return await get_session_snapshot(db, session_id)
+
+async def mark_session_expired(db: AsyncSession, session_id: str):
+    await mark_sessions_expired(db, [session_id])
+
+async def mark_sessions_expired(db: AsyncSession, session_ids: List[str]):
+    await db.execute(
+        update(DBSession).where(DBSession.id.in_(session_ids)).values(status="expired", link_active=False)
+    )
+    await db.commit()
+    for session_id in session_ids:
+        app.state.session_cache.invalidate(session_id)
+    await app.state.manager.invalidate_sessions(session_ids)
+
+# Payloads are built as plain dicts with the response model's fields and sent
+# with FastJSONResponse, so FastAPI does not validate and re-encode them again.
+# response_model stays on the routes for the OpenAPI schema.
+
+def session_status_payload(session: CachedSession) -> dict:
+    """SessionStatus fields for a snapshot"""
+    time_left = int((session.expires_at - datetime.utcnow()).total_seconds())
+    if time_left < 0:
+        time_left = 0
+
+    return {
+        "session_id": session.id,
+        "participant_count": session.participant_count,
+        "status": session.status,
+        "expires_at": session.expires_at,
+        "time_left_seconds": time_left,
+        "created_at": session.created_at
+    }
+
+def session_response_payload(session_id: str, duration: int, expires_at: datetime, code: str) -> dict:
+    """SessionResponse fields for a freshly created session"""
+    return {
+        "session_id": session_id,
+        "duration": duration,
+        "expires_at": expires_at,
+        "link": f"{BASE_URL}c/{session_id}",
+        "status": "waiting",
+        "code": code,
+        "time_left_seconds": duration * 60
+    }
+
+async def claim_second_seat(db: AsyncSession, session_id: str) -> CachedSession:
+    """Join a session with one conditional UPDATE; raise the matching HTTP error if it fails"""
+    cached = app.state.session_cache.get(session_id)
+    if cached and cached.participant_count >= 2:
+        raise HTTPException(400, "Session is full")
+
+    now = datetime.utcnow()
+    result = await db.execute(
+        update(DBSession)
+        .where(
+            DBSession.id == session_id,
+            DBSession.participant_count < 2,
+            DBSession.status.in_(("waiting", "active")),
+            DBSession.expires_at > now
+        )
+        .values(participant_count=2, status="active", link_active=False)
+        .returning(*DBSession.__table__.c)
+    )
+    row = result.first()
+    await db.commit()
+    if row:
+        session = app.state.session_cache.put(CachedSession.from_row(row))
+        await app.state.manager.invalidate_sessions([session_id])
+        await app.state.manager.publish_event(
+            session_id, "participant_joined", participant_count=session.participant_count
+        )
+        return session
+
+    # Nothing matched: read the row once to tell the caller why
+    session = await db.get(DBSession, session_id)
+    if not session:
+        raise HTTPException(404, "Session not found")
+
+    if session.status in ("expired", "terminated") or now > session.expires_at:
+        if session.status != "expired":
+            await mark_session_expired(db, session_id)
+        raise HTTPException(410, "Session expired")
+
+    raise HTTPException(400, "Session is full")
+
 @app.post("/session/create", response_model=SessionResponse)
-async def create_session(request: SessionCreate, db: Session = Depends(get_db)):
+async def create_session(request: SessionCreate, db: AsyncSession = Depends(get_db)):
     if request.duration < 1 or request.duration > MAX_DURATION:
         raise HTTPException(400, f"Duration must be between 1 and {MAX_DURATION} minutes")
 
     session_id = generate_session_id()
-    expires_at = datetime.utcnow() + timedelta(minutes=request.duration)
+    now = datetime.utcnow()
+    expires_at = now + timedelta(minutes=request.duration)
 
+    # Every column is set here, so nothing has to be read back after the commit.
+    # A refresh would also keep the request's connection checked out while the
+    # code store borrows another, which deadlocks the single-connection memory pool.
     db_session = DBSession(
         id=session_id,
+        created_at=now,
         expires_at=expires_at,
         duration_minutes=request.duration,
         participant_count=1,
@@ -101,224 +296,387 @@ async def create_session(request: SessionCreate, db: Session = Depends(get_db)):
     )
 
     db.add(db_session)
-    db.commit()
-    db.refresh(db_session)
+    await db.commit()
+    app.state.session_cache.put(db_session)
+    app.state.expiry_service.schedule(session_id, expires_at)
+
+    code = await app.state.code_store.create(session_id, expires_at, "")
+
+    logger.info("Session created: %s, duration: %smin, code: %s", session_id, request.duration, code,
+                extra={"session_id": session_id})
+
+    return FastJSONResponse(session_response_payload(session_id, request.duration, expires_at, code))
+
+@app.post("/session/create/batch", response_model=SessionResponseBatch)
+async def create_sessions_batch(request: SessionCreateBatch, db: AsyncSession = Depends(get_db)):
+    if not request.sessions or len(request.sessions) > MAX_BATCH_SIZE:
+        raise HTTPException(400, f"A batch must hold between 1 and {MAX_BATCH_SIZE} sessions")
+    for item in request.sessions:
+        if item.duration < 1 or item.duration > MAX_DURATION:
+            raise HTTPException(400, f"Duration must be between 1 and {MAX_DURATION} minutes")
+
+    now = datetime.utcnow()
+    rows = [
+        {
+            "id": generate_session_id(),
+            "created_at": now,
+            "expires_at": now + timedelta(minutes=item.duration),
+            "duration_minutes": item.duration,
+            "participant_count": 1,
+            "status": "waiting",
+            "link_active": True
+        }
+        for item in request.sessions
+    ]
 
-    link = f"{BASE_URL}c/{session_id}"
-    code = app.state.code_generator.generate_code(session_id, expires_at, "")
+    # One multi-row INSERT and one commit for the whole batch
+    await db.execute(insert(DBSession), rows)
+    await db.commit()
+    for row in rows:
+        app.state.session_cache.put(CachedSession(**row))
+        app.state.expiry_service.schedule(row["id"], row["expires_at"])
 
-    logger.info(f"Session created: {session_id}, duration: {request.duration}min, code: {code}")
+    codes = await app.state.code_store.create_many([(row["id"], row["expires_at"]) for row in rows])
 
-    return SessionResponse(
-        session_id=session_id,
-        duration=request.duration,
-        expires_at=expires_at,
-        link=link,
-        status="waiting",
-        code=code,
-        time_left_seconds=request.duration * 60
-    )
+    logger.info("Batch created %s sessions", len(rows))
+
+    return FastJSONResponse({"sessions": [
+        session_response_payload(row["id"], row["duration_minutes"], row["expires_at"], code)
+        for row, code in zip(rows, codes)
+    ]})
 
 @app.post("/session/code/{code}")
 async def join_by_code(code: str):
-    result = app.state.code_generator.redeem_code(code)
+    db_endpoint.set("join_by_code")
+    result = await app.state.code_store.redeem(code)
 
     if not result:
         raise HTTPException(404, "Invalid or expired code")
 
-    db = SessionLocal()
-    try:
-        session = db.query(DBSession).filter(DBSession.id == result["sessionId"]).first()
-
-        if not session:
-            raise HTTPException(404, "Session not found")
-
-        if session.status == "expired" or datetime.utcnow() > session.expires_at:
-            raise HTTPException(410, "Session expired")
-
-        if session.participant_count >= 2:
-            raise HTTPException(400, "Session is full")
-
-        session.participant_count = 2
-        session.status = "active"
-        session.link_active = False
-        db.commit()
+    async with SessionLocal() as db:
+        session = await claim_second_seat(db, result["sessionId"])
 
-        logger.info(f"User joined session {session.id} via code {code}")
+        logger.info("User joined session %s via code %s", session.id, code, extra={"session_id": session.id})
 
-        return {
+        return FastJSONResponse({
             "session_id": session.id,
             "encryption_key": result["encryptionKey"],
             "status": "active"
-        }
-    finally:
-        db.close()
+        })
 
 @app.get("/session/{session_id}/status", response_model=SessionStatus)
-async def get_session_status(session_id: str, db: Session = Depends(get_db)):
-    session = db.query(DBSession).filter(DBSession.id == session_id).first()
+async def get_session_status(session_id: str, db: AsyncSession = Depends(get_db)):
+    session = await get_session_snapshot(db, session_id)
 
     if not session:
         raise HTTPException(404, "Session not found")
 
-    if datetime.utcnow() > session.expires_at:
+    if datetime.utcnow() > session.expires_at and session.status != "expired":
+        await mark_session_expired(db, session_id)
         session.status = "expired"
         session.link_active = False
-        db.commit()
 
-    time_left = int((session.expires_at - datetime.utcnow()).total_seconds())
-    if time_left < 0:
-        time_left = 0
-
-    return SessionStatus(
-        session_id=session.id,
-        participant_count=session.participant_count,
-        status=session.status,
-        expires_at=session.expires_at,
-        time_left_seconds=time_left,
-        created_at=session.created_at
-    )
+    return FastJSONResponse(session_status_payload(session))
+
+@app.post("/session/status/batch", response_model=SessionStatusBatch)
+async def get_session_status_batch(request: SessionStatusBatchRequest, db: AsyncSession = Depends(get_db)):
+    session_ids = list(dict.fromkeys(request.session_ids))
+    if len(session_ids) > MAX_BATCH_SIZE:
+        raise HTTPException(400, f"At most {MAX_BATCH_SIZE} sessions per batch")
+
+    # Serve what the cache holds, then fetch the rest with one IN query
+    cache = app.state.session_cache
+    found: Dict[str, CachedSession] = {}
+    misses = []
+    for session_id in session_ids:
+        cached = cache.get(session_id)
+        if cached:
+            found[session_id] = cached
+        else:
+            misses.append(session_id)
+
+    now = datetime.utcnow()
+    if misses:
+        rows = await db.execute(select(*DBSession.__table__.c).where(DBSession.id.in_(misses)))
+        for row in rows:
+            snapshot = CachedSession.from_row(row)
+            found[snapshot.id] = snapshot
+            if snapshot.status in ("waiting", "active") and now < snapshot.expires_at:
+                cache.put(snapshot)
+
+    overdue = [s for s in found.values() if now > s.expires_at and s.status != "expired"]
+    if overdue:
+        await mark_sessions_expired(db, [s.id for s in overdue])
+        for session in overdue:
+            session.status = "expired"
+            session.link_active = False
+
+    return FastJSONResponse({
+        "sessions": [session_status_payload(found[sid]) for sid in session_ids if sid in found],
+        "missing": [sid for sid in session_ids if sid not in found]
+    })
 
 @app.post("/session/{session_id}/join")
-async def join_session(session_id: str, db: Session = Depends(get_db)):
-    session = db.query(DBSession).filter(DBSession.id == session_id).first()
-
-    if not session:
-        raise HTTPException(404, "Session not found")
-
-    if datetime.utcnow() > session.expires_at:
-        session.status = "expired"
-        session.link_active = False
-        db.commit()
-        raise HTTPException(410, "Session expired")
+async def join_session(session_id: str, db: AsyncSession = Depends(get_db)):
+    session = await claim_second_seat(db, session_id)
 
-    if session.participant_count >= 2:
-        raise HTTPException(400, "Session is full")
-
-    session.participant_count = 2
-    session.status = "active"
-    session.link_active = False
-    db.commit()
-
-    logger.info(f"Second participant joined session: {session_id}")
+    logger.info("Second participant joined session: %s", session_id, extra={"session_id": session_id})
 
-    return {
+    return FastJSONResponse({
         "session_id": session.id,
         "status": "active",
         "message": "Joined successfully"
-    }
+    })
 
-@app.delete("/session/{session_id}")
-async def terminate_session(session_id: str, db: Session = Depends(get_db)):
-    session = db.query(DBSession).filter(DBSession.id == session_id).first()
+@app.post("/session/{session_id}/extend")
+async def extend_session(session_id: str, request: SessionExtend, db: AsyncSession = Depends(get_db)):
+    if request.minutes < 1:
+        raise HTTPException(400, "Extension must be at least 1 minute")
 
+    session = await get_session_snapshot(db, session_id)
     if not session:
         raise HTTPException(404, "Session not found")
+    if session.status not in ("waiting", "active") or datetime.utcnow() > session.expires_at:
+        raise HTTPException(410, "Session expired")
+    if session.duration_minutes + request.minutes > MAX_DURATION:
+        raise HTTPException(400, f"Sessions cannot last longer than {MAX_DURATION} minutes")
+
+    # Only applies if nobody moved the deadline since the snapshot was taken
+    expires_at = session.expires_at + timedelta(minutes=request.minutes)
+    result = await db.execute(
+        update(DBSession)
+        .where(
+            DBSession.id == session_id,
+            DBSession.expires_at == session.expires_at,
+            DBSession.status.in_(("waiting", "active"))
+        )
+        .values(expires_at=expires_at, duration_minutes=DBSession.duration_minutes + request.minutes)
+        .returning(*DBSession.__table__.c)
+    )
+    row = result.first()
+    await db.commit()
+    if not row:
+        app.state.session_cache.invalidate(session_id)
+        raise HTTPException(409, "Session changed, try again")
+
+    session = app.state.session_cache.put(CachedSession.from_row(row))
+    await app.state.manager.invalidate_sessions([session_id])
+    app.state.expiry_service.schedule(session_id, expires_at)
+    time_left = session.time_left()
+    await app.state.manager.publish_event(
+        session_id, "extended", extended_by=request.minutes, expires_at=expires_at, time_left=time_left
+    )
 
-    logger.info(f"Termination requested for session {session_id}")
-
-    if session_id in message_queue:
-        del message_queue[session_id]
-
+    logger.info("Session %s extended by %smin", session_id, request.minutes, extra={"session_id": session_id})
+    return FastJSONResponse({
+        "session_id": session_id,
+        "extended_by": request.minutes,
+        "expires_at": expires_at,
+        "time_left_seconds": time_left
+    })
+
+@app.get("/session/{session_id}/events")
+async def session_events(session_id: str):
+    """Server-sent events for a session, so the waiting creator does not have to poll.
+
+    The first event is the current status; after that every control event the
+    sockets get (participant_joined, extended, expiring_soon) follows, and the
+    stream ends with session_expired or session_terminated.
+    """
+    # Listen before reading the status so a join in between is not missed
+    listener = app.state.manager.add_listener(session_id)
     try:
-        await app.state.manager.terminate_session(session_id)
-    except Exception as e:
-        logger.error(f"Error during WebSocket termination: {e}")
+        # Not Depends(get_db): that session would stay open until the stream ends
+        db_endpoint.set("session_events")
+        session = await read_session_snapshot(session_id)
+        if not session:
+            raise HTTPException(404, "Session not found")
+        if session.status not in ("waiting", "active") or datetime.utcnow() > session.expires_at:
+            raise HTTPException(410, "Session expired")
+    except BaseException:
+        app.state.manager.remove_listener(session_id, listener)
+        raise
+
+    first = control_frame("session_status", **session_status_payload(session))
+    return StreamingResponse(
+        session_event_stream(session_id, listener, first),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
 
-    app.state.code_generator.remove_by_session(session_id)
+async def session_event_stream(session_id: str, listener: asyncio.Queue, first: str):
+    try:
+        yield f"data: {first}\n\n"
+        while True:
+            try:
+                frame = await asyncio.wait_for(listener.get(), SSE_KEEPALIVE)
+            except asyncio.TimeoutError:
+                yield ": keepalive\n\n"
+                continue
+            if frame is CLOSE:
+                return
+            yield f"data: {frame}\n\n"
+    finally:
+        app.state.manager.remove_listener(session_id, listener)
 
+async def delete_sessions(db: AsyncSession, session_ids: List[str]) -> List[str]:
+    """Delete sessions in one statement and hand the socket teardown to a background task"""
     try:
-        db.delete(session)
-        db.commit()
+        result = await db.execute(
+            delete(DBSession).where(DBSession.id.in_(session_ids)).returning(DBSession.id)
+        )
+        terminated = list(result.scalars())
+        await db.commit()
     except Exception as e:
-        logger.error(f"Error deleting session: {e}")
-        db.rollback()
+        logger.error("Error deleting sessions: %s", e)
+        await db.rollback()
         raise HTTPException(500, "Failed to terminate session")
 
-    logger.info(f"Session {session_id} fully terminated")
-    return {"status": "terminated"}
+    for session_id in terminated:
+        app.state.expiry_service.cancel(session_id)
+        app.state.session_cache.invalidate(session_id)
+    if terminated:
+        await app.state.manager.invalidate_sessions(terminated)
+        run_in_background(teardown_sessions(terminated))
+    return terminated
+
+async def teardown_sessions(session_ids: List[str]):
+    """Notify and close every socket of the sessions concurrently, then drop their codes"""
+    results = await asyncio.gather(
+        *(app.state.manager.terminate_session(session_id) for session_id in session_ids),
+        *(app.state.code_store.remove_by_session(session_id) for session_id in session_ids),
+        return_exceptions=True
+    )
+    for result in results:
+        if isinstance(result, Exception):
+            logger.error("Error tearing down terminated session: %s", result)
+
+def run_in_background(coro):
+    """Run work after the response, tracked so shutdown can wait for it"""
+    task = asyncio.create_task(coro)
+    app.state.background_tasks.add(task)
+    task.add_done_callback(app.state.background_tasks.discard)
+    return task
+
+@app.delete("/session/{session_id}")
+async def terminate_session(session_id: str, db: AsyncSession = Depends(get_db)):
+    logger.info("Termination requested for session %s", session_id)
+
+    terminated = await delete_sessions(db, [session_id])
+    if not terminated:
+        raise HTTPException(404, "Session not found")
+
+    logger.info("Session %s terminated", session_id, extra={"session_id": session_id})
+    return FastJSONResponse({"status": "terminated"})
+
+@app.post("/session/terminate/batch")
+async def terminate_sessions_batch(request: SessionTerminateBatch, db: AsyncSession = Depends(get_db)):
+    session_ids = list(dict.fromkeys(request.session_ids))
+    if not session_ids or len(session_ids) > MAX_BATCH_SIZE:
+        raise HTTPException(400, f"A batch must hold between 1 and {MAX_BATCH_SIZE} sessions")
+
+    terminated = await delete_sessions(db, session_ids)
+    found = set(terminated)
+
+    logger.info("Batch terminated %s sessions", len(terminated))
+    return FastJSONResponse({
+        "terminated": terminated,
+        "missing": [sid for sid in session_ids if sid not in found]
+    })
 
 @app.websocket("/ws/{session_id}")
 async def websocket_endpoint(websocket: WebSocket, session_id: str):
     client_host = websocket.client.host if websocket.client else "unknown"
-    logger.info(f"WebSocket connection attempt from {client_host} for session {session_id}")
-    
-    db = SessionLocal()
+    logger.info("WebSocket connection attempt from %s for session %s", client_host, session_id)
+    db_endpoint.set("websocket_endpoint")
+
     try:
-        session = db.query(DBSession).filter(DBSession.id == session_id).first()
+        # Admission works from a snapshot; no DB connection is held while the socket is open
+        session = await read_session_snapshot(session_id)
 
         if not session:
-            logger.warning(f"Session {session_id} not found")
+            logger.warning("Session %s not found", session_id)
             await websocket.close(code=1008, reason="Session not found")
             return
 
-        logger.info(f"Session {session_id} found, status: {session.status}")
+        logger.info("Session %s found, status: %s", session_id, session.status)
 
         if session.status == "expired" or session.status == "terminated" or datetime.utcnow() > session.expires_at:
-            logger.warning(f"Session {session_id} expired")
+            logger.warning("Session %s expired", session_id)
             await websocket.close(code=1008, reason="Session expired")
             return
 
-        # Accept connection
-        await websocket.accept()
-        logger.info(f"WebSocket accepted for session {session_id}")
+        # Clients that pass last_seq get sequenced frames and a replay of what they missed
+        last_seq = websocket.query_params.get("last_seq")
+        if last_seq is not None:
+            if not last_seq.isdigit():
+                await websocket.close(code=1008, reason="Invalid last_seq")
+                return
+            last_seq = int(last_seq)
+        client_id = websocket.query_params.get("client_id")
+
+        # Accept connection, negotiating binary relay if the client offers it
+        binary = BINARY_SUBPROTOCOL in websocket.scope.get("subprotocols", ())
+        await websocket.accept(subprotocol=BINARY_SUBPROTOCOL if binary else None)
+        logger.info("WebSocket accepted for session %s (binary: %s)", session_id, binary)
 
         # Add to manager
-        await app.state.manager.connect(websocket, session_id)
+        conn = await app.state.manager.connect(
+            websocket, session_id, sequenced=last_seq is not None, client_id=client_id
+        )
         connection_count = app.state.manager.get_connection_count(session_id)
-        logger.info(f"WebSocket connected for session {session_id}, total connections: {connection_count}")
+        logger.info("WebSocket connected for session %s, total connections: %s", session_id, connection_count,
+                    extra={"session_id": session_id})
 
         # Send connected message
-        time_left = session.time_left() if hasattr(session, 'time_left') else 300
-        await websocket.send_text(json.dumps({
-            "type": "connected",
-            "session_id": session_id,
-            "participant_count": session.participant_count,
-            "connection_count": connection_count,
-            "time_left": time_left,
-            "timestamp": datetime.utcnow().isoformat()
-        }))
-
-        # Heartbeat to keep connection alive
-        async def heartbeat():
-            try:
-                while True:
-                    await asyncio.sleep(25)
-                    await websocket.send_text(json.dumps({
-                        "type": "ping",
-                        "timestamp": datetime.utcnow().isoformat()
-                    }))
-            except:
-                pass
-
-        heartbeat_task = asyncio.create_task(heartbeat())
-
+        time_left = session.time_left()
+        await app.state.manager.send(websocket, control_frame(
+            "connected",
+            session_id=session_id,
+            participant_count=session.participant_count,
+            connection_count=connection_count,
+            time_left=time_left,
+            seq=app.state.manager.replay.last_seq(session_id)
+        ))
+        if last_seq is not None:
+            replayed = app.state.manager.replay_since(conn, last_seq)
+            if replayed:
+                logger.info("Replayed %s frames to session %s after seq %s", replayed, session_id, last_seq)
+
+        # Liveness is tracked here; pings and reaping run in the manager's heartbeat loop
         try:
             while True:
-                message = await websocket.receive_text()
-                logger.debug(f"Received message from {session_id}: {message[:50]}")
-                
+                # Read the raw ASGI event so binary frames are relayed as-is, never decoded
+                event = await websocket.receive()
+                if event["type"] == "websocket.disconnect":
+                    raise WebSocketDisconnect(event.get("code", 1000))
+                message = event.get("bytes")
+                if message is None:
+                    message = event.get("text")
+                    if message is None:
+                        continue
+                received_at = time.perf_counter()
+                conn.last_seen = time.monotonic()
+                if logger.isEnabledFor(logging.DEBUG) and relay_log_sampler.hit():
+                    logger.debug("Received message from %s: %s bytes (1 in %s sampled)",
+                                 session_id, len(message), relay_log_sampler.every)
+
                 # Broadcast to other participants
                 await app.state.manager.broadcast_to_session(
                     session_id,
                     message,
                     exclude=websocket
                 )
+                RELAY_LATENCY.observe(time.perf_counter() - received_at)
         except WebSocketDisconnect:
-            logger.info(f"WebSocket disconnected for session {session_id}")
+            logger.info("WebSocket disconnected for session %s", session_id, extra={"session_id": session_id})
             app.state.manager.disconnect(websocket, session_id)
         except Exception as e:
-            logger.error(f"WebSocket error for session {session_id}: {e}")
-            logger.error(traceback.format_exc())
+            logger.exception("WebSocket error for session %s: %s", session_id, e)
             app.state.manager.disconnect(websocket, session_id)
-        finally:
-            heartbeat_task.cancel()
 
     except Exception as e:
-        logger.error(f"WebSocket endpoint error: {e}")
-        logger.error(traceback.format_exc())
-    finally:
-        db.close()
+        logger.exception("WebSocket endpoint error: %s", e)
 
 if __name__ == "__main__":
     import uvicorn
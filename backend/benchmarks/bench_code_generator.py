@@ -0,0 +1,57 @@
+"""Join-code allocator benchmark at 500k live codes.
+
+Run from the backend directory:
+
+    python -m benchmarks.bench_code_generator [--live 500000] [--ops 50000]
+"""
+import argparse
+import json
+import logging
+import time
+from datetime import datetime, timedelta
+
+from utils.code_generator import CodeGenerator
+from utils.scheduler import to_timestamp
+
+def run(live: int, ops: int) -> dict:
+    generator = CodeGenerator()
+    expires_at = datetime.utcnow() + timedelta(hours=1)
+
+    start = time.perf_counter()
+    for i in range(live):
+        generator.generate_code(f"fill{i}", expires_at)
+    fill_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    codes = [generator.generate_code(f"bench{i}", expires_at) for i in range(ops)]
+    generate_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for code in codes:
+        generator.redeem_code(code)
+    redeem_seconds = time.perf_counter() - start
+
+    # Move the clock past every deadline and time the expiry-heap drain
+    start = time.perf_counter()
+    drained = generator._drain_expired(now=to_timestamp(expires_at) + 1)
+    drain_seconds = time.perf_counter() - start
+
+    return {
+        "live_codes": live,
+        "fill_us_per_code": fill_seconds / live * 1e6,
+        "generate_us_per_code": generate_seconds / ops * 1e6,
+        "redeem_us_per_code": redeem_seconds / ops * 1e6,
+        "drained_codes": drained,
+        "drain_us_per_code": drain_seconds / max(drained, 1) * 1e6,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--live", type=int, default=500_000)
+    parser.add_argument("--ops", type=int, default=50_000)
+    args = parser.parse_args()
+    logging.disable(logging.INFO)
+    print(json.dumps(run(args.live, args.ops), indent=2))
+
+if __name__ == "__main__":
+    main()
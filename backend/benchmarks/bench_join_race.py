@@ -0,0 +1,72 @@
+"""Concurrent join race: hundreds of joiners per session, exactly one may win.
+
+Runs the real join handlers against the configured DATABASE_URL. Run from
+the backend directory:
+
+    python -m benchmarks.bench_join_race [--sessions 20] [--joiners 300]
+"""
+import argparse
+import asyncio
+import json
+import logging
+import time
+
+from fastapi import HTTPException
+
+import app as backend
+from models.database import SessionLocal
+from models.session import SessionCreate
+
+async def join_once(session_id: str, via_code: str = None) -> int:
+    try:
+        if via_code:
+            await backend.join_by_code(via_code)
+        else:
+            async with SessionLocal() as db:
+                await backend.join_session(session_id, db)
+        return 200
+    except HTTPException as e:
+        return e.status_code
+
+async def race(sessions: int, joiners: int) -> dict:
+    results = {"sessions": sessions, "joiners_per_session": joiners, "lost_updates": 0, "statuses": {}}
+    latencies = []
+    async with backend.app.router.lifespan_context(backend.app):
+        for _ in range(sessions):
+            async with SessionLocal() as db:
+                response = await backend.create_session(SessionCreate(duration=5), db)
+            # The route returns an already encoded response, not the model
+            created = json.loads(response.body)
+
+            # Half of the joiners race on the link, half on the join code
+            async def timed(i):
+                started = time.perf_counter()
+                status = await join_once(created["session_id"], created["code"] if i % 2 else None)
+                latencies.append(time.perf_counter() - started)
+                return status
+
+            statuses = await asyncio.gather(*(timed(i) for i in range(joiners)))
+            winners = statuses.count(200)
+            if winners != 1:
+                results["lost_updates"] += 1
+            for status in statuses:
+                results["statuses"][status] = results["statuses"].get(status, 0) + 1
+
+    latencies.sort()
+    results["p50_ms"] = latencies[len(latencies) // 2] * 1e3
+    results["p99_ms"] = latencies[int(len(latencies) * 0.99)] * 1e3
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sessions", type=int, default=20)
+    parser.add_argument("--joiners", type=int, default=300)
+    args = parser.parse_args()
+    logging.disable(logging.WARNING)
+    results = asyncio.run(race(args.sessions, args.joiners))
+    print(json.dumps(results, indent=2))
+    if results["lost_updates"]:
+        raise SystemExit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,219 @@
+"""Redis broker and code store against an in-process RESP stand-in.
+
+Starts a small fake Redis (strings with NX/PX, GETDEL, DEL and PUBLISH /
+SUBSCRIBE) on a free port and drives two RedisBrokers and a RedisCodeStore
+through it: fan-out to subscribed and unsubscribed workers, redeem-once codes,
+then a dropped connection with a command in flight, reconnect and
+resubscription. Prints one JSON report with the checks and redeem throughput,
+and exits non-zero if a check fails. Run from the backend directory:
+
+    python -m benchmarks.bench_redis [--codes 2000]
+"""
+import argparse
+import asyncio
+import json
+import logging
+import time
+from datetime import datetime, timedelta
+from typing import Dict, Set
+
+from utils.broker import EVENT, INVALIDATE, MESSAGE, RedisBroker
+from utils.code_store import RedisCodeStore
+from utils.resp import read_reply
+
+class FakeRedis:
+    """Just enough of Redis for the broker and the code store; TTLs are kept but never enforced"""
+
+    def __init__(self):
+        self.data: Dict[bytes, bytes] = {}
+        self.subscribers: Dict[bytes, Set[asyncio.StreamWriter]] = {}
+        self.writers: Set[asyncio.StreamWriter] = set()
+        # While set, commands are read but not answered
+        self.hold = False
+        self.server = None
+
+    async def start(self) -> str:
+        self.server = await asyncio.start_server(self._serve, "127.0.0.1", 0)
+        return "redis://127.0.0.1:%d/0" % self.server.sockets[0].getsockname()[1]
+
+    def drop_connections(self):
+        for writer in list(self.writers):
+            writer.transport.abort()
+
+    async def close(self):
+        self.drop_connections()
+        self.server.close()
+        await self.server.wait_closed()
+
+    async def _serve(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.writers.add(writer)
+        try:
+            while True:
+                command = await read_reply(reader)
+                if not self.hold:
+                    writer.write(self._execute(writer, command))
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            self.writers.discard(writer)
+            for writers in self.subscribers.values():
+                writers.discard(writer)
+
+    def _execute(self, writer: asyncio.StreamWriter, command: list) -> bytes:
+        name, args = command[0].upper(), command[1:]
+        if name in (b"AUTH", b"SELECT", b"PING"):
+            return b"+OK\r\n"
+        if name == b"SET":
+            if b"NX" in (arg.upper() for arg in args[2:]) and args[0] in self.data:
+                return b"$-1\r\n"
+            self.data[args[0]] = args[1]
+            return b"+OK\r\n"
+        if name in (b"GET", b"GETDEL"):
+            value = self.data.get(args[0]) if name == b"GET" else self.data.pop(args[0], None)
+            return b"$-1\r\n" if value is None else b"$%d\r\n%s\r\n" % (len(value), value)
+        if name == b"DEL":
+            return b":%d\r\n" % sum(self.data.pop(key, None) is not None for key in args)
+        if name == b"PUBLISH":
+            channel, message = args
+            receivers = self.subscribers.get(channel, ())
+            for receiver in receivers:
+                receiver.write(b"*3\r\n$7\r\nmessage\r\n$%d\r\n%s\r\n$%d\r\n%s\r\n"
+                               % (len(channel), channel, len(message), message))
+            return b":%d\r\n" % len(receivers)
+        if name in (b"SUBSCRIBE", b"UNSUBSCRIBE"):
+            kind = name.lower()
+            replies = []
+            for channel in args:
+                if name == b"SUBSCRIBE":
+                    self.subscribers.setdefault(channel, set()).add(writer)
+                else:
+                    self.subscribers.get(channel, set()).discard(writer)
+                replies.append(b"*3\r\n$%d\r\n%s\r\n$%d\r\n%s\r\n:1\r\n"
+                               % (len(kind), kind, len(channel), channel))
+            return b"".join(replies)
+        return b"-ERR unknown command '%s'\r\n" % name
+
+class Inbox:
+    def __init__(self):
+        self.items = []
+        self.arrived = asyncio.Event()
+
+    async def handler(self, kind: str, session_id: str, payload):
+        self.items.append((kind, session_id, payload))
+        self.arrived.set()
+
+    async def wait(self, timeout: float = 2.0) -> bool:
+        try:
+            await asyncio.wait_for(self.arrived.wait(), timeout)
+        except asyncio.TimeoutError:
+            return False
+        self.arrived.clear()
+        return True
+
+async def wait_until(predicate, timeout: float = 5.0) -> bool:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if predicate():
+            return True
+        await asyncio.sleep(0.01)
+    return False
+
+async def run(args) -> dict:
+    fake = FakeRedis()
+    url = await fake.start()
+    checks = {}
+
+    first, second = RedisBroker(url), RedisBroker(url)
+    inbox = Inbox()
+    await first.start(Inbox().handler)
+    await second.start(inbox.handler)
+    store = RedisCodeStore(url)
+    await store.start()
+
+    # Fan-out: session traffic to subscribers only, invalidations to everyone
+    second.subscribe("s1")
+    await second.subscriber.drain()
+    await asyncio.sleep(0.05)
+    await first.publish(MESSAGE, "s1", b"\x00frame")
+    checks["message_to_subscriber"] = await inbox.wait() and inbox.items[-1] == (MESSAGE, "s1", b"\x00frame")
+    await first.publish(EVENT, "s2", '{"type":"extended"}')
+    checks["no_message_without_subscription"] = not await inbox.wait(0.2)
+    await first.publish(INVALIDATE, "", "s2\ns3")
+    checks["invalidate_to_unsubscribed"] = await inbox.wait() and inbox.items[-1] == (INVALIDATE, "", "s2\ns3")
+
+    # Redeem-once codes and their throughput
+    expires_at = datetime.utcnow() + timedelta(minutes=5)
+    code = await store.create("s1", expires_at, "key")
+    redeemed = await asyncio.gather(*(store.redeem(code) for _ in range(10)))
+    checks["code_redeemed_once"] = sum(result is not None for result in redeemed) == 1
+    sessions = [(f"bench{i}", expires_at) for i in range(args.codes)]
+    started = time.perf_counter()
+    codes = await store.create_many(sessions)
+    create_elapsed = time.perf_counter() - started
+    started = time.perf_counter()
+    results = await asyncio.gather(*(store.redeem(code) for code in codes))
+    redeem_elapsed = time.perf_counter() - started
+    checks["batch_codes_redeem"] = [r["sessionId"] for r in results] == [s for s, _ in sessions]
+
+    # A command in flight when the connection drops fails instead of hanging
+    fake.hold = True
+    pending = asyncio.ensure_future(store.redeem("000000"))
+    await asyncio.sleep(0.05)
+    fake.drop_connections()
+    try:
+        await asyncio.wait_for(pending, 3)
+        checks["in_flight_fails_on_loss"] = False
+    except ConnectionError:
+        checks["in_flight_fails_on_loss"] = True
+    except asyncio.TimeoutError:
+        checks["in_flight_fails_on_loss"] = False
+    fake.hold = False
+
+    try:
+        await asyncio.wait_for(store.redeem("000000"), 3)
+        checks["send_while_down_fails"] = False
+    except ConnectionError:
+        checks["send_while_down_fails"] = True
+    except asyncio.TimeoutError:
+        checks["send_while_down_fails"] = False
+    await first.publish(MESSAGE, "s1", "lost")
+    checks["publish_while_down_dropped"] = first.dropped == 1
+
+    # Everything comes back on its own, subscriptions included
+    clients = (store.client, first.publisher, first.subscriber, second.publisher, second.subscriber)
+    started = time.perf_counter()
+    checks["reconnected"] = await wait_until(lambda: all(client.connected for client in clients))
+    reconnect_elapsed = time.perf_counter() - started
+    code = await store.create("s4", expires_at)
+    checks["code_store_after_reconnect"] = (await store.redeem(code) or {}).get("sessionId") == "s4"
+    await asyncio.sleep(0.05)
+    await first.publish(MESSAGE, "s1", "after")
+    checks["resubscribed_session"] = await inbox.wait() and inbox.items[-1] == (MESSAGE, "s1", "after")
+    await first.publish(INVALIDATE, "", "s5")
+    checks["resubscribed_control"] = await inbox.wait() and inbox.items[-1] == (INVALIDATE, "", "s5")
+
+    await store.close()
+    await first.close()
+    await second.close()
+    await fake.close()
+    return {
+        "codes": args.codes,
+        "create_many_ms": round(create_elapsed * 1000, 1),
+        "redeems_per_sec": round(len(codes) / redeem_elapsed),
+        "reconnect_ms": round(reconnect_elapsed * 1000, 1),
+        "checks": checks,
+        "ok": all(checks.values()),
+    }
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--codes", type=int, default=2000)
+    args = parser.parse_args()
+    logging.disable(logging.CRITICAL)
+    report = asyncio.run(run(args))
+    print(json.dumps(report, indent=2))
+    if not report["ok"]:
+        raise SystemExit(1)
+
+if __name__ == "__main__":
+    main()
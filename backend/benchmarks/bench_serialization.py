@@ -0,0 +1,86 @@
+"""Serialization microbenchmark: FastAPI's response_model pass vs pre-built payloads.
+
+Times the CPU spent turning one SessionStatus / SessionResponse into response
+bytes, and one control frame into text, the old way and through
+utils.serialization (orjson when installed). Run from the backend directory:
+
+    python -m benchmarks.bench_serialization [--iterations 50000]
+"""
+import argparse
+import asyncio
+import json
+import logging
+import time
+from datetime import datetime, timedelta
+
+from fastapi.responses import JSONResponse
+from fastapi.routing import serialize_response
+try:
+    from fastapi.utils import create_response_field
+except ImportError:  # renamed in later FastAPI releases
+    from fastapi.utils import create_model_field as create_response_field
+
+from models.session import SessionResponse, SessionStatus
+from utils.serialization import JSON_BACKEND, FastJSONResponse, control_frame
+
+def per_call_us(fn, iterations: int) -> float:
+    fn()
+    started = time.perf_counter()
+    for _ in range(iterations):
+        fn()
+    return (time.perf_counter() - started) / iterations * 1e6
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--iterations", type=int, default=50000)
+    args = parser.parse_args()
+    logging.disable(logging.CRITICAL)
+
+    loop = asyncio.new_event_loop()
+    now = datetime.utcnow()
+    status = {
+        "session_id": "abcd1234", "participant_count": 2, "status": "active",
+        "expires_at": now + timedelta(minutes=5), "time_left_seconds": 300, "created_at": now,
+    }
+    created = {
+        "session_id": "abcd1234", "duration": 5, "expires_at": now + timedelta(minutes=5),
+        "link": "https://driflly.vercel.app/c/abcd1234", "status": "waiting", "code": "123456",
+        "time_left_seconds": 300,
+    }
+    status_field = create_response_field(name="Response_status", type_=SessionStatus)
+    created_field = create_response_field(name="Response_create", type_=SessionResponse)
+
+    def through_response_model(model, field, payload):
+        # What FastAPI does with a model returned from a route that declares response_model
+        content = loop.run_until_complete(serialize_response(field=field, response_content=model(**payload)))
+        return JSONResponse(content).body
+
+    results = {}
+    for name, model, field, payload in (
+        ("session_status", SessionStatus, status_field, status),
+        ("session_create", SessionResponse, created_field, created),
+    ):
+        before = per_call_us(lambda: through_response_model(model, field, payload), args.iterations)
+        after = per_call_us(lambda: FastJSONResponse(payload).body, args.iterations)
+        results[name] = {"response_model_us": round(before, 2), "fast_us": round(after, 2),
+                         "saved_us": round(before - after, 2), "speedup": round(before / after, 1)}
+
+    def old_frame():
+        return json.dumps({"type": "connected", "session_id": "abcd1234", "participant_count": 2,
+                           "connection_count": 2, "time_left": 300,
+                           "timestamp": datetime.utcnow().isoformat()})
+
+    def new_frame():
+        return control_frame("connected", session_id="abcd1234", participant_count=2,
+                             connection_count=2, time_left=300)
+
+    before = per_call_us(old_frame, args.iterations)
+    after = per_call_us(new_frame, args.iterations)
+    results["connected_frame"] = {"json_us": round(before, 2), "fast_us": round(after, 2),
+                                  "saved_us": round(before - after, 2), "speedup": round(before / after, 1)}
+    loop.close()
+
+    print(json.dumps({"backend": JSON_BACKEND, "iterations": args.iterations, "results": results}, indent=2))
+
+if __name__ == "__main__":
+    main()
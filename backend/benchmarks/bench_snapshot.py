@@ -0,0 +1,77 @@
+"""Runtime snapshot: write and restore time for the join code table and replay rings.
+
+Fills a CodeGenerator with ``--codes`` codes (a ``--expired`` fraction of them
+past their deadline by the simulated restore time) and a replay buffer with
+``--replay-sessions`` rings, writes the snapshot, then restores it into a fresh
+generator and buffer. Run from the backend directory:
+
+    python -m benchmarks.bench_snapshot [--codes 1000000] [--expired 0.1]
+"""
+import argparse
+import json
+import logging
+import os
+import random
+import tempfile
+import time
+
+from utils.code_generator import CODE_SPACE, CodeGenerator
+from utils.replay import ReplayBuffer
+from utils.snapshot import restore_snapshot, write_snapshot
+
+def build_state(codes: int, expired: float, replay_sessions: int, frames: int):
+    generator = CodeGenerator()
+    now = time.time()
+    cutoff = int(codes * expired)
+    generator.restore([
+        (number, now, now + (60 if i < cutoff else 3600), f"s{i:07d}", "")
+        for i, number in enumerate(random.sample(range(CODE_SPACE), codes))
+    ], now)
+
+    replay = ReplayBuffer()
+    for s in range(replay_sessions):
+        for f in range(frames):
+            replay.append(f"r{s:07d}", "x" * 200 if f % 2 else b"y" * 200, origin="client")
+    return generator, replay
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--codes", type=int, default=1_000_000)
+    parser.add_argument("--expired", type=float, default=0.1, help="fraction of codes expired at restore")
+    parser.add_argument("--replay-sessions", type=int, default=1000)
+    parser.add_argument("--frames", type=int, default=32, help="frames per replay ring")
+    args = parser.parse_args()
+    logging.disable(logging.CRITICAL)
+
+    started = time.perf_counter()
+    generator, replay = build_state(args.codes, args.expired, args.replay_sessions, args.frames)
+    build_elapsed = time.perf_counter() - started
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "runtime.snapshot")
+        started = time.perf_counter()
+        size = write_snapshot(path, generator, replay)
+        write_elapsed = time.perf_counter() - started
+
+        # Restore as if the process came back ten minutes later, past the short-lived codes
+        fresh_generator, fresh_replay = CodeGenerator(), ReplayBuffer()
+        started = time.perf_counter()
+        stats = restore_snapshot(path, fresh_generator, fresh_replay, now=time.time() + 600)
+        restore_elapsed = time.perf_counter() - started
+
+    sample = next(iter(fresh_generator.active_codes), None)
+    redeemed = fresh_generator.redeem_code(sample) if sample else None
+    print(json.dumps({
+        "codes": args.codes,
+        "snapshot_bytes": size,
+        "build_sec": round(build_elapsed, 3),
+        "write_ms": round(write_elapsed * 1000, 1),
+        "restore_ms": round(restore_elapsed * 1000, 1),
+        "restore_us_per_code": round(restore_elapsed / max(1, args.codes) * 1e6, 3),
+        "restored": stats,
+        "allocator_used": fresh_generator.allocator.used,
+        "redeem_after_restore_ok": redeemed is not None,
+    }, indent=2))
+
+if __name__ == "__main__":
+    main()
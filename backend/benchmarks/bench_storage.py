@@ -0,0 +1,93 @@
+"""Storage backend throughput: the session create / read / join mix per backend.
+
+Each backend runs in its own process because the engine is configured from the
+environment at import time. Postgres is only included when a URL is given. Run
+from the backend directory:
+
+    python -m benchmarks.bench_storage [--sessions 2000] [--concurrency 50] [--postgres-url URL]
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+from datetime import datetime, timedelta
+
+async def workload(sessions: int, concurrency: int) -> dict:
+    from sqlalchemy import select, update
+
+    from models.database import SessionLocal, Session, init_db, engine
+
+    await init_db()
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one():
+        async with semaphore:
+            session_id = str(uuid.uuid4())
+            async with SessionLocal() as db:
+                db.add(Session(
+                    id=session_id, expires_at=datetime.utcnow() + timedelta(minutes=5),
+                    duration_minutes=5, participant_count=1, status="waiting"
+                ))
+                await db.commit()
+            for _ in range(3):
+                async with SessionLocal() as db:
+                    await db.execute(select(Session).where(Session.id == session_id))
+            async with SessionLocal() as db:
+                await db.execute(
+                    update(Session)
+                    .where(Session.id == session_id, Session.participant_count < 2)
+                    .values(participant_count=Session.participant_count + 1, status="active")
+                )
+                await db.commit()
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one() for _ in range(sessions)))
+    elapsed = time.perf_counter() - start
+    await engine.dispose()
+    # One insert, three reads and one conditional update per session
+    return {"sessions_per_sec": round(sessions / elapsed), "ops_per_sec": round(5 * sessions / elapsed),
+            "elapsed_sec": round(elapsed, 3)}
+
+def run_backend(name: str, env: dict, args) -> dict:
+    command = [sys.executable, "-m", "benchmarks.bench_storage", "--worker",
+               "--sessions", str(args.sessions), "--concurrency", str(args.concurrency)]
+    output = subprocess.run(command, env={**os.environ, **env}, capture_output=True, text=True)
+    if output.returncode != 0:
+        return {"backend": name, "error": output.stderr.strip().splitlines()[-1:]}
+    return {"backend": name, **json.loads(output.stdout)}
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sessions", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--postgres-url", default="")
+    parser.add_argument("--worker", action="store_true")
+    args = parser.parse_args()
+    logging.disable(logging.CRITICAL)
+
+    if args.worker:
+        print(json.dumps(asyncio.run(workload(args.sessions, args.concurrency))))
+        return
+
+    with tempfile.TemporaryDirectory() as directory:
+        configs = [
+            ("memory", {"STORAGE_BACKEND": "memory"}),
+            ("sqlite-rollback", {"STORAGE_BACKEND": "sqlite", "SQLITE_JOURNAL_MODE": "DELETE",
+                                 "SQLITE_SYNCHRONOUS": "FULL", "SQLITE_MMAP_SIZE": "0",
+                                 "DATABASE_URL": f"sqlite:///{directory}/rollback.db"}),
+            ("sqlite-wal", {"STORAGE_BACKEND": "sqlite", "DATABASE_URL": f"sqlite:///{directory}/wal.db"}),
+        ]
+        if args.postgres_url:
+            configs.append(("postgres", {"STORAGE_BACKEND": "postgres", "DATABASE_URL": args.postgres_url}))
+        results = [run_backend(name, env, args) for name, env in configs]
+
+    print(json.dumps({"sessions": args.sessions, "concurrency": args.concurrency, "results": results}, indent=2))
+
+if __name__ == "__main__":
+    main()
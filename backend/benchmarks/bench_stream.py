@@ -0,0 +1,121 @@
+"""Stream router against a local fake Stream server.
+
+Starts a fake Stream API (user upsert and channel query, each answering after
+``--latency`` ms) on a free port, points the router at it through
+STREAM_BASE_URL and drives the route handlers concurrently. Reports throughput,
+the longest event-loop stall seen while the calls were in flight, token cache
+hits and the number of requests the fake server received. Run from the backend
+directory:
+
+    python -m benchmarks.bench_stream [--channels 200] [--latency 50]
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import socket
+import threading
+import time
+from collections import Counter
+
+import uvicorn
+from fastapi import FastAPI, Request
+
+def fake_stream_app(latency: float, calls: Counter) -> FastAPI:
+    fake = FastAPI()
+
+    @fake.post("/users")
+    async def upsert_users(request: Request):
+        body = await request.json()
+        calls["upsert_users"] += 1
+        calls["users"] += len(body["users"])
+        await asyncio.sleep(latency)
+        return {"users": body["users"], "duration": "1ms"}
+
+    @fake.post("/channels/{channel_type}/{channel_id}/query")
+    async def query_channel(channel_type: str, channel_id: str, request: Request):
+        body = await request.json()
+        calls["channel_query"] += 1
+        await asyncio.sleep(latency)
+        return {
+            "channel": {"id": channel_id, "type": channel_type, "created_by": body["data"]["created_by"]},
+            "members": [{"user_id": user_id} for user_id in body["data"].get("members", [])],
+            "duration": "1ms",
+        }
+
+    return fake
+
+def start_fake(latency: float, calls: Counter) -> str:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        port = s.getsockname()[1]
+    server = uvicorn.Server(uvicorn.Config(
+        fake_stream_app(latency, calls), host="127.0.0.1", port=port, log_level="warning"
+    ))
+    threading.Thread(target=server.run, daemon=True).start()
+    deadline = time.monotonic() + 10
+    while not server.started and time.monotonic() < deadline:
+        time.sleep(0.05)
+    return f"http://127.0.0.1:{port}"
+
+async def measure_stall(stop: asyncio.Event, stalls: list, tick: float = 0.005):
+    while not stop.is_set():
+        started = time.perf_counter()
+        await asyncio.sleep(tick)
+        stalls.append(time.perf_counter() - started - tick)
+
+async def run(args, calls: Counter) -> dict:
+    # Imported after STREAM_BASE_URL is set, since the router reads its settings at import
+    # time; the client itself is built on the first request
+    from routes import stream
+
+    stop = asyncio.Event()
+    stalls: list = []
+    ticker = asyncio.create_task(measure_stall(stop, stalls))
+
+    started = time.perf_counter()
+    await asyncio.gather(*(
+        stream.create_channel(f"bench{i}", f"a{i}", f"b{i}") for i in range(args.channels)
+    ))
+    channel_elapsed = time.perf_counter() - started
+
+    users = [f"a{i}" for i in range(args.channels)]
+    started = time.perf_counter()
+    await asyncio.gather(*(stream.create_token(user_id) for user_id in users))
+    first_tokens = time.perf_counter() - started
+    started = time.perf_counter()
+    await asyncio.gather(*(stream.create_token(user_id) for user_id in users))
+    cached_tokens = time.perf_counter() - started
+
+    stop.set()
+    await ticker
+    stream.executor.shutdown(wait=True)
+    return {
+        "channels": args.channels,
+        "latency_ms": args.latency,
+        "workers": stream.STREAM_MAX_WORKERS,
+        "channels_per_sec": round(args.channels / channel_elapsed),
+        "tokens_per_sec_uncached": round(len(users) / first_tokens),
+        "tokens_per_sec_cached": round(len(users) / cached_tokens),
+        "max_loop_stall_ms": round(max(stalls, default=0) * 1000, 2),
+        "fake_server_calls": dict(calls),
+    }
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--channels", type=int, default=200)
+    parser.add_argument("--latency", type=float, default=50.0, help="fake Stream response time in ms")
+    args = parser.parse_args()
+    logging.disable(logging.CRITICAL)
+
+    calls: Counter = Counter()
+    os.environ.update({
+        "STREAM_BASE_URL": start_fake(args.latency / 1000, calls),
+        "STREAM_API_KEY": os.getenv("STREAM_API_KEY", "bench-key"),
+        "STREAM_API_SECRET": os.getenv("STREAM_API_SECRET", "bench-secret"),
+    })
+    print(json.dumps(asyncio.run(run(args, calls)), indent=2))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,336 @@
+"""End-to-end load test: create, join by code, relay over two sockets, delete.
+
+Starts the app with uvicorn on a scratch database (or targets ``--url``) and
+drives every session through the full lifecycle in phases, so that all sockets
+are open at the same time when memory is sampled. Prints one JSON report with
+latency percentiles per step, relay throughput, server memory per connection
+and error rates. Run from the backend directory:
+
+    python -m benchmarks.loadtest [--sessions 1000] [--messages 20] [--rate 5]
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import resource
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import urlparse
+
+import websockets
+
+from utils.protocol import BINARY_SUBPROTOCOL
+
+class HttpClient:
+    """Minimal keep-alive HTTP/1.1 client so the harness needs nothing beyond the app's own deps"""
+
+    def __init__(self, url: str, connections: int):
+        parsed = urlparse(url)
+        self.host = parsed.hostname
+        self.port = parsed.port or 80
+        self.slots = asyncio.Semaphore(connections)
+        self.idle: List[Tuple[asyncio.StreamReader, asyncio.StreamWriter]] = []
+
+    async def request(self, method: str, path: str, body: Optional[dict] = None) -> Tuple[int, dict]:
+        payload = json.dumps(body).encode() if body is not None else b""
+        message = (
+            f"{method} {path} HTTP/1.1\r\nHost: {self.host}\r\n"
+            f"Content-Type: application/json\r\nContent-Length: {len(payload)}\r\n\r\n".encode()
+            + payload
+        )
+        async with self.slots:
+            while True:
+                reused = bool(self.idle)
+                if reused:
+                    reader, writer = self.idle.pop()
+                else:
+                    reader, writer = await asyncio.open_connection(self.host, self.port)
+                try:
+                    writer.write(message)
+                    status_line = await reader.readline()
+                    if not status_line and reused:
+                        # The server timed out this idle keep-alive connection
+                        writer.close()
+                        continue
+                    status = int(status_line.split()[1])
+                    length, keep_alive = 0, True
+                    while True:
+                        line = await reader.readline()
+                        if line in (b"\r\n", b""):
+                            break
+                        name, _, value = line.decode().partition(":")
+                        name = name.strip().lower()
+                        if name == "content-length":
+                            length = int(value)
+                        elif name == "connection" and value.strip().lower() == "close":
+                            keep_alive = False
+                    data = await reader.readexactly(length) if length else b""
+                except ConnectionError:
+                    writer.close()
+                    if reused:
+                        continue
+                    raise
+                except Exception:
+                    writer.close()
+                    raise
+                if keep_alive:
+                    self.idle.append((reader, writer))
+                else:
+                    writer.close()
+                return status, json.loads(data) if data else {}
+
+    def close(self):
+        for _, writer in self.idle:
+            writer.close()
+        self.idle.clear()
+
+class Stats:
+    def __init__(self):
+        self.latencies: Dict[str, List[float]] = {}
+        self.errors: Dict[str, Dict[str, int]] = {}
+        self.attempts: Dict[str, int] = {}
+
+    def record(self, step: str, started: float, error: Optional[str] = None):
+        self.attempts[step] = self.attempts.get(step, 0) + 1
+        if error is None:
+            self.latencies.setdefault(step, []).append(time.perf_counter() - started)
+        else:
+            kinds = self.errors.setdefault(step, {})
+            kinds[error] = kinds.get(error, 0) + 1
+
+    def report(self) -> dict:
+        steps = {}
+        for step, attempts in self.attempts.items():
+            errors = self.errors.get(step, {})
+            steps[step] = {
+                "count": attempts,
+                "error_rate": round(sum(errors.values()) / attempts, 5),
+                "errors": errors,
+                **percentiles(self.latencies.get(step, [])),
+            }
+        return steps
+
+def percentiles(values: List[float]) -> dict:
+    if not values:
+        return {}
+    values = sorted(values)
+    pick = lambda q: round(values[min(len(values) - 1, int(q * len(values)))] * 1000, 3)
+    return {"p50_ms": pick(0.50), "p99_ms": pick(0.99), "p999_ms": pick(0.999), "max_ms": pick(1.0)}
+
+def rss_bytes(pid: int) -> Optional[int]:
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
+
+class Peer:
+    """One WebSocket participant; its reader records relay latency from the embedded send time"""
+
+    def __init__(self, ws, stats: Stats):
+        self.ws = ws
+        self.stats = stats
+        self.received = 0
+        self.relay_latencies: List[float] = []
+        self.reader = asyncio.create_task(self._read())
+
+    async def _read(self):
+        try:
+            async for frame in self.ws:
+                if isinstance(frame, bytes):
+                    frame = frame.decode()
+                if frame[:1] != "#":
+                    continue  # connected / ping / terminated control frames
+                sent_ns = int(frame[1:frame.index(" ")])
+                self.relay_latencies.append((time.perf_counter_ns() - sent_ns) / 1e9)
+                self.received += 1
+        except websockets.ConnectionClosed:
+            pass
+
+    async def send_loop(self, messages: int, rate: float, size: int):
+        interval = 1 / rate if rate > 0 else 0
+        padding = "x" * size
+        for _ in range(messages):
+            await self.ws.send(f"#{time.perf_counter_ns()} {padding}")
+            if interval:
+                await asyncio.sleep(interval)
+
+async def run(args, url: str, server_pid: Optional[int]) -> dict:
+    stats = Stats()
+    http = HttpClient(url, args.http_connections)
+    limit = asyncio.Semaphore(args.concurrency)
+    ws_url = url.replace("http://", "ws://", 1)
+    subprotocols = [BINARY_SUBPROTOCOL] if args.binary else None
+    sessions: List[dict] = []
+
+    async def timed_http(step: str, method: str, path: str, body: Optional[dict] = None, expect: int = 200):
+        started = time.perf_counter()
+        try:
+            status, data = await http.request(method, path, body)
+        except Exception as e:
+            stats.record(step, started, type(e).__name__)
+            return None
+        stats.record(step, started, None if status == expect else str(status))
+        return data if status == expect else None
+
+    async def create_and_join(_):
+        async with limit:
+            created = await timed_http("create", "POST", "/session/create", {"duration": args.duration})
+            if not created:
+                return
+            joined = await timed_http("join_code", "POST", f"/session/code/{created['code']}")
+            if joined:
+                sessions.append({"id": created["session_id"], "peers": []})
+
+    async def connect(session: dict):
+        async with limit:
+            for _ in range(2):
+                started = time.perf_counter()
+                try:
+                    ws = await websockets.connect(
+                        f"{ws_url}/ws/{session['id']}", subprotocols=subprotocols,
+                        ping_interval=None, max_size=None, open_timeout=30
+                    )
+                except Exception as e:
+                    stats.record("ws_connect", started, type(e).__name__)
+                    continue
+                stats.record("ws_connect", started)
+                session["peers"].append(Peer(ws, stats))
+
+    async def delete(session: dict):
+        async with limit:
+            await timed_http("delete", "DELETE", f"/session/{session['id']}")
+        # The server closes both sockets on terminate
+        await asyncio.wait([peer.reader for peer in session["peers"]], timeout=10)
+        for peer in session["peers"]:
+            await peer.ws.close()
+
+    baseline_rss = rss_bytes(server_pid) if server_pid else None
+
+    started = time.perf_counter()
+    await asyncio.gather(*(create_and_join(i) for i in range(args.sessions)))
+    http_phase = time.perf_counter() - started
+
+    idle_rss = rss_bytes(server_pid) if server_pid else None
+    await asyncio.gather(*(connect(s) for s in sessions))
+    peers = [peer for s in sessions for peer in s["peers"]]
+    connected_rss = rss_bytes(server_pid) if server_pid else None
+
+    # Relay phase: both peers of a session send concurrently
+    relay_start = time.perf_counter()
+    senders = []
+    for session in sessions:
+        if len(session["peers"]) == 2:
+            senders += [peer.send_loop(args.messages, args.rate, args.message_size) for peer in session["peers"]]
+    results = await asyncio.gather(*senders, return_exceptions=True)
+    send_errors = sum(1 for r in results if isinstance(r, Exception))
+    expected = (len(senders) - send_errors) * args.messages
+    deadline = time.monotonic() + args.drain_timeout
+    while sum(peer.received for peer in peers) < expected and time.monotonic() < deadline:
+        await asyncio.sleep(0.05)
+    relay_elapsed = time.perf_counter() - relay_start
+    received = sum(peer.received for peer in peers)
+
+    await asyncio.gather(*(delete(s) for s in sessions))
+    http.close()
+
+    relay = [latency for peer in peers for latency in peer.relay_latencies]
+    memory = {}
+    if connected_rss is not None and idle_rss is not None:
+        memory = {
+            "baseline_rss_bytes": baseline_rss,
+            "rss_with_sockets_bytes": connected_rss,
+            "bytes_per_connection": round((connected_rss - idle_rss) / len(peers)) if peers else None,
+        }
+    return {
+        "sessions": args.sessions,
+        "sockets": len(peers),
+        "steps": stats.report(),
+        "http_phase_sec": round(http_phase, 3),
+        "relay": {
+            "sent": expected,
+            "received": received,
+            "loss_rate": round(1 - received / expected, 5) if expected else 0.0,
+            "send_errors": send_errors,
+            "messages_per_sec": round(received / relay_elapsed) if relay_elapsed else 0,
+            **percentiles(relay),
+        },
+        "memory": memory,
+    }
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def start_server(port: int, directory: str) -> subprocess.Popen:
+    env = {
+        **os.environ,
+        "DATABASE_URL": os.getenv("DATABASE_URL", f"sqlite:///{directory}/loadtest.db"),
+        # Every simulated client shares one address
+        "RATE_LIMIT_ENABLED": os.getenv("RATE_LIMIT_ENABLED", "0"),
+        # Keep the server's shutdown snapshot out of the default location, where
+        # the next dev server would restore the load test's codes
+        "RUNTIME_SNAPSHOT_DIR": os.path.join(directory, "snapshots"),
+    }
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app:app", "--host", "127.0.0.1", "--port", str(port),
+         "--log-level", "warning", "--no-access-log"],
+        env=env, stdout=subprocess.DEVNULL, stderr=open(os.path.join(directory, "server.log"), "w"),
+    )
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        if server.poll() is not None:
+            raise RuntimeError(f"Server exited during startup, see {directory}/server.log")
+        try:
+            with socket.create_connection(("127.0.0.1", port), timeout=0.2):
+                return server
+        except OSError:
+            time.sleep(0.1)
+    server.kill()
+    raise RuntimeError("Server did not start listening in time")
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sessions", type=int, default=1000)
+    parser.add_argument("--messages", type=int, default=20, help="messages sent by each socket")
+    parser.add_argument("--rate", type=float, default=5.0, help="messages per second per socket, 0 for unthrottled")
+    parser.add_argument("--message-size", type=int, default=256)
+    parser.add_argument("--duration", type=int, default=10, help="session duration in minutes")
+    parser.add_argument("--concurrency", type=int, default=200, help="sessions in flight per phase")
+    parser.add_argument("--http-connections", type=int, default=64)
+    parser.add_argument("--drain-timeout", type=float, default=30.0)
+    parser.add_argument("--binary", action="store_true", help="negotiate the binary relay subprotocol")
+    parser.add_argument("--url", default="", help="target a running server instead of starting one")
+    args = parser.parse_args()
+    logging.disable(logging.CRITICAL)
+
+    # Two sockets per session on both ends of the loopback
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+
+    if args.url:
+        report = asyncio.run(run(args, args.url.rstrip("/"), None))
+    else:
+        with tempfile.TemporaryDirectory() as directory:
+            port = free_port()
+            server = start_server(port, directory)
+            try:
+                report = asyncio.run(run(args, f"http://127.0.0.1:{port}", server.pid))
+            finally:
+                server.terminate()
+                server.wait(timeout=10)
+    print(json.dumps(report, indent=2))
+    if any(step.get("error_rate") for step in report["steps"].values()) or report["relay"]["loss_rate"]:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,130 @@
+"""Cold-start profile: import time per module and process start to first response.
+
+Runs ``python -X importtime -c "import app"`` and reports the modules that
+``app`` imports directly, by cumulative import time. Then starts uvicorn
+``--runs`` times on a database whose schema is already current, with the schema
+step skipped and with it left on auto, and measures the time from spawning the
+process to the first successful GET /health. Prints one JSON report and
+compares the skipped-schema median against ``--target-ms``. Run from the
+backend directory:
+
+    python -m benchmarks.profile_startup [--runs 5] [--top 15] [--target-ms 200]
+"""
+import argparse
+import http.client
+import json
+import os
+import re
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Dict, List
+
+# "import time: <self us> | <cumulative us> | <indent><module>"
+_IMPORTTIME_LINE = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \|( +)(\S+)")
+
+def import_profile(env: Dict[str, str], top: int) -> dict:
+    output = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import app"],
+        env=env, capture_output=True, text=True,
+    )
+    if output.returncode != 0:
+        raise RuntimeError(output.stderr[-2000:])
+
+    # Each import is listed after everything it imported, one level deeper;
+    # direct children of app are the lines one level below it
+    entries = []
+    for line in output.stderr.splitlines():
+        match = _IMPORTTIME_LINE.match(line)
+        if match:
+            entries.append((len(match.group(3)), match.group(4), int(match.group(2))))
+    end = max(i for i, entry in enumerate(entries) if entry[1] == "app")
+    app_depth, _, app_total = entries[end]
+    start = end
+    while start > 0 and entries[start - 1][0] > app_depth:
+        start -= 1
+    children = [(name, total) for depth, name, total in entries[start:end] if depth == app_depth + 2]
+    children.sort(key=lambda item: item[1], reverse=True)
+    return {
+        "app_import_ms": round(app_total / 1000, 1),
+        "top_imports_ms": {name: round(total / 1000, 1) for name, total in children[:top]},
+    }
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def wait_for_health(port: int, server: subprocess.Popen, timeout: float = 30.0) -> bool:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if server.poll() is not None:
+            return False
+        try:
+            connection = http.client.HTTPConnection("127.0.0.1", port, timeout=1)
+            connection.request("GET", "/health")
+            if connection.getresponse().status == 200:
+                return True
+        except (ConnectionError, socket.timeout, http.client.HTTPException):
+            time.sleep(0.002)
+        finally:
+            connection.close()
+    return False
+
+def first_response_ms(env: Dict[str, str], runs: int) -> List[float]:
+    timings = []
+    for _ in range(runs):
+        port = free_port()
+        started = time.perf_counter()
+        server = subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "app:app", "--host", "127.0.0.1", "--port", str(port),
+             "--log-level", "warning", "--no-access-log"],
+            env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+        )
+        try:
+            if not wait_for_health(port, server):
+                raise RuntimeError("Server did not answer /health")
+            timings.append((time.perf_counter() - started) * 1000)
+        finally:
+            server.terminate()
+            server.wait(timeout=10)
+    return timings
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--top", type=int, default=15, help="direct imports of app to list")
+    parser.add_argument("--target-ms", type=float, default=200.0)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        env = {
+            **os.environ,
+            "DATABASE_URL": os.getenv("DATABASE_URL", f"sqlite:///{directory}/startup.db"),
+            "LOG_LEVEL": "WARNING",
+            "RUNTIME_SNAPSHOT_DIR": os.path.join(directory, "snapshots"),
+        }
+        # Bring the schema up to date once, as a deploy step would
+        subprocess.run([sys.executable, "-m", "models.migrate"], env=env, check=True, capture_output=True)
+
+        report = import_profile(env, args.top)
+        timings = first_response_ms({**env, "DB_SCHEMA_INIT": "skip"}, args.runs)
+        auto_timings = first_response_ms({**env, "DB_SCHEMA_INIT": "auto"}, args.runs)
+
+    median = statistics.median(timings)
+    report.update({
+        "first_response_ms": {
+            "schema_skip": {"median": round(median, 1), "min": round(min(timings), 1)},
+            "schema_auto": {"median": round(statistics.median(auto_timings), 1),
+                            "min": round(min(auto_timings), 1)},
+        },
+        "target_ms": args.target_ms,
+        "target_met": median <= args.target_ms,
+    })
+    print(json.dumps(report, indent=2))
+
+if __name__ == "__main__":
+    main()
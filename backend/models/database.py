@@ -1,23 +1,37 @@
-from sqlalchemy import create_engine, Column, String, Integer, DateTime, Boolean
+from sqlalchemy import Column, String, Integer, DateTime, Boolean, Index, delete, func, insert, select
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.ext.asyncio import async_sessionmaker, AsyncSession
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
 from datetime import datetime
+import logging
 import os
-from dotenv import load_dotenv
+from fastapi import Request
 
-load_dotenv()
+from models.storage import create_storage_engine
+from utils.metrics import db_endpoint, instrument_engine
+
+logger = logging.getLogger(__name__)
 
 DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./chatlly.db")
 
-engine = create_engine(
-    DATABASE_URL, connect_args={"check_same_thread": False} if "sqlite" in DATABASE_URL else {}
-)
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+engine = create_storage_engine(DATABASE_URL)
+instrument_engine(engine)
+SessionLocal = async_sessionmaker(engine, class_=AsyncSession, autoflush=False, expire_on_commit=False)
+
+# Bump whenever a table, column or index changes so init_db runs again
+SCHEMA_VERSION = 2
+# "auto" runs the schema step at startup unless the DB is already at
+# SCHEMA_VERSION; "skip" leaves it to ``python -m models.migrate``
+DB_SCHEMA_INIT = os.getenv("DB_SCHEMA_INIT", "auto")
 
 Base = declarative_base()
 
 class Session(Base):
     __tablename__ = "sessions"
+    __table_args__ = (
+        # Serves the expiry sweep and the retention purge without a full scan
+        Index("ix_sessions_status_expires_at", "status", "expires_at"),
+    )
 
     id = Column(String, primary_key=True, index=True)
     created_at = Column(DateTime, default=datetime.utcnow)
@@ -39,7 +53,7 @@ class Session(Base):
             "link_active": self.link_active,
             "terminated_at": self.terminated_at.isoformat() if self.terminated_at else None
         }
-    
+
     def time_left(self) -> int:
         """Calculate time left in seconds"""
         if self.status == "terminated":
@@ -48,12 +62,53 @@ class Session(Base):
             return 0
         return int((self.expires_at - datetime.utcnow()).total_seconds())
 
-# Create tables (this will add the new column)
-Base.metadata.create_all(bind=engine)
+class JoinCode(Base):
+    __tablename__ = "join_codes"
+
+    code = Column(String(6), primary_key=True)
+    session_id = Column(String, nullable=False, index=True)
+    encryption_key = Column(String, nullable=False, default="")
+    expires_at = Column(DateTime, nullable=False, index=True)
+
+class SchemaVersion(Base):
+    __tablename__ = "schema_version"
 
-def get_db():
-    db = SessionLocal()
+    version = Column(Integer, primary_key=True)
+
+def _create_schema(conn):
+    Base.metadata.create_all(conn)
+    # create_all skips indexes on tables that already exist
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(conn, checkfirst=True)
+
+async def schema_version() -> int:
+    """Version recorded by the last schema step, 0 if it never ran"""
     try:
+        async with engine.connect() as conn:
+            return (await conn.execute(select(func.max(SchemaVersion.version)))).scalar() or 0
+    except DBAPIError:
+        # No schema_version table yet
+        return 0
+
+async def init_db(force: bool = False) -> bool:
+    """Create missing tables and indexes; a no-op when the DB is already current.
+
+    Returns True if the schema step ran.
+    """
+    if not force and await schema_version() >= SCHEMA_VERSION:
+        return False
+    async with engine.begin() as conn:
+        await conn.run_sync(_create_schema)
+        await conn.execute(delete(SchemaVersion))
+        await conn.execute(insert(SchemaVersion).values(version=SCHEMA_VERSION))
+    logger.info("Database schema at version %s", SCHEMA_VERSION)
+    return True
+
+async def get_db(request: Request):
+    # Label the DB timings of this request with its endpoint
+    endpoint = request.scope.get("endpoint")
+    if endpoint is not None:
+        db_endpoint.set(endpoint.__name__)
+    async with SessionLocal() as db:
         yield db
-    finally:
-        db.close()
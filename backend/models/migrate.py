@@ -0,0 +1,32 @@
+"""Bring the database schema up to date, as a deploy step before the app starts.
+
+    python -m models.migrate [--force]
+
+Pair it with DB_SCHEMA_INIT=skip so app startup never touches the schema.
+"""
+import argparse
+import asyncio
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+from models.database import SCHEMA_VERSION, engine, init_db, schema_version
+
+async def migrate(force: bool) -> None:
+    before = await schema_version()
+    ran = await init_db(force=force)
+    await engine.dispose()
+    if ran:
+        print(f"Schema updated from version {before} to {SCHEMA_VERSION}")
+    else:
+        print(f"Schema already at version {before}")
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--force", action="store_true", help="run the schema step even if the DB is current")
+    args = parser.parse_args()
+    asyncio.run(migrate(args.force))
+
+if __name__ == "__main__":
+    main()
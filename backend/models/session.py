@@ -1,6 +1,6 @@
 from pydantic import BaseModel
 from datetime import datetime
-from typing import Optional
+from typing import List, Optional
 
 class SessionCreate(BaseModel):
     duration: int
@@ -24,3 +24,19 @@ class SessionStatus(BaseModel):
     expires_at: datetime
     time_left_seconds: int
     created_at: Optional[datetime] = None
+
+class SessionCreateBatch(BaseModel):
+    sessions: List[SessionCreate]
+
+class SessionResponseBatch(BaseModel):
+    sessions: List[SessionResponse]
+
+class SessionStatusBatchRequest(BaseModel):
+    session_ids: List[str]
+
+class SessionStatusBatch(BaseModel):
+    sessions: List[SessionStatus]
+    missing: List[str] = []
+
+class SessionTerminateBatch(BaseModel):
+    session_ids: List[str]
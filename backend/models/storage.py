@@ -0,0 +1,93 @@
+import logging
+import os
+from typing import Optional
+
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import AsyncEngine, create_async_engine
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+
+logger = logging.getLogger(__name__)
+
+BACKENDS = ("sqlite", "postgres", "memory")
+
+def async_database_url(url: str) -> str:
+    """Map a plain DATABASE_URL onto its asyncio driver"""
+    if url.startswith("sqlite://"):
+        return url.replace("sqlite://", "sqlite+aiosqlite://", 1)
+    if url.startswith("postgres://"):
+        return url.replace("postgres://", "postgresql+asyncpg://", 1)
+    if url.startswith("postgresql://"):
+        return url.replace("postgresql://", "postgresql+asyncpg://", 1)
+    return url
+
+def resolve_backend(url: str, backend: Optional[str] = None) -> str:
+    """STORAGE_BACKEND wins; otherwise the backend follows the DATABASE_URL scheme"""
+    backend = backend or os.getenv("STORAGE_BACKEND", "")
+    if backend:
+        if backend not in BACKENDS:
+            raise ValueError(f"Unknown STORAGE_BACKEND: {backend}")
+        return backend
+    return "postgres" if url.startswith(("postgres://", "postgresql")) else "sqlite"
+
+def _sqlite_engine(url: str) -> AsyncEngine:
+    busy_timeout_ms = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+    journal_mode = os.getenv("SQLITE_JOURNAL_MODE", "WAL")
+    synchronous = os.getenv("SQLITE_SYNCHRONOUS", "NORMAL")
+    mmap_size = int(os.getenv("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024)))
+
+    engine = create_async_engine(async_database_url(url), connect_args={"timeout": busy_timeout_ms / 1000})
+
+    @event.listens_for(engine.sync_engine, "connect")
+    def _set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        # WAL lets readers run alongside the single writer; NORMAL only fsyncs at checkpoints
+        cursor.execute(f"PRAGMA journal_mode={journal_mode}")
+        cursor.execute(f"PRAGMA synchronous={synchronous}")
+        cursor.execute(f"PRAGMA mmap_size={mmap_size}")
+        cursor.execute(f"PRAGMA busy_timeout={busy_timeout_ms}")
+        cursor.execute("PRAGMA temp_store=MEMORY")
+        cursor.close()
+
+    return engine
+
+def _postgres_engine(url: str) -> AsyncEngine:
+    return create_async_engine(
+        async_database_url(url),
+        pool_size=int(os.getenv("DB_POOL_SIZE", "10")),
+        max_overflow=int(os.getenv("DB_MAX_OVERFLOW", "20")),
+        pool_timeout=float(os.getenv("DB_POOL_TIMEOUT", "10")),
+        pool_recycle=int(os.getenv("DB_POOL_RECYCLE", "1800")),
+        pool_pre_ping=True,
+    )
+
+def _memory_engine() -> AsyncEngine:
+    # An in-memory SQLite database lives and dies with its connection, so the
+    # pool holds exactly one and never recycles it. Unlike the StaticPool the
+    # dialect would pick, sessions queue for it instead of sharing it mid-transaction.
+    # Nothing survives a restart.
+    engine = create_async_engine(
+        "sqlite+aiosqlite:///:memory:",
+        poolclass=AsyncAdaptedQueuePool,
+        pool_size=1,
+        max_overflow=0,
+        pool_recycle=-1,
+    )
+
+    @event.listens_for(engine.sync_engine, "connect")
+    def _set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        cursor.execute("PRAGMA journal_mode=MEMORY")
+        cursor.execute("PRAGMA synchronous=OFF")
+        cursor.close()
+
+    return engine
+
+def create_storage_engine(url: str, backend: Optional[str] = None) -> AsyncEngine:
+    """Build the async engine for the configured storage backend"""
+    backend = resolve_backend(url, backend)
+    logger.info("Using %s storage backend", backend)
+    if backend == "memory":
+        return _memory_engine()
+    if backend == "postgres":
+        return _postgres_engine(url)
+    return _sqlite_engine(url)
@@ -1,101 +1,169 @@
+import importlib.util
 import os
 import logging
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Dict, Optional, Tuple
 from fastapi import APIRouter, HTTPException
-from dotenv import load_dotenv
 import asyncio
 
 logger = logging.getLogger(__name__)
-load_dotenv()
 
 router = APIRouter(prefix="/stream", tags=["stream"])
 
-logger.info(f"STREAM_API_KEY exists: {bool(os.getenv('STREAM_API_KEY'))}")
-logger.info(f"STREAM_API_SECRET exists: {bool(os.getenv('STREAM_API_SECRET'))}")
+logger.info("STREAM_API_KEY exists: %s", bool(os.getenv('STREAM_API_KEY')))
+logger.info("STREAM_API_SECRET exists: %s", bool(os.getenv('STREAM_API_SECRET')))
 
-try:
-    from stream_chat import StreamChat
-    STREAM_AVAILABLE = True
-    logger.info("Successfully imported stream_chat")
-except ImportError as e:
-    STREAM_AVAILABLE = False
-    logger.error(f"Failed to import stream_chat: {e}")
+# Checked without importing: stream_chat pulls in aiohttp and its async
+# client, which is most of the app's import time
+STREAM_AVAILABLE = importlib.util.find_spec("stream_chat") is not None
+if not STREAM_AVAILABLE:
+    logger.error("stream_chat is not installed")
 
 STREAM_API_KEY = os.getenv("STREAM_API_KEY")
 STREAM_API_SECRET = os.getenv("STREAM_API_SECRET")
+# Point the client at a local fake Stream server; empty means Stream's own API
+STREAM_BASE_URL = os.getenv("STREAM_BASE_URL", "")
+STREAM_TIMEOUT = float(os.getenv("STREAM_TIMEOUT", "6"))
+# Threads making blocking Stream API calls; further calls wait their turn
+STREAM_MAX_WORKERS = int(os.getenv("STREAM_MAX_WORKERS", "8"))
+TOKEN_TTL = int(os.getenv("STREAM_TOKEN_TTL", str(24 * 60 * 60)))
+# Cached tokens are reissued once they have less than this left
+TOKEN_REFRESH_MARGIN = int(os.getenv("STREAM_TOKEN_REFRESH_MARGIN", str(60 * 60)))
+TOKEN_CACHE_SIZE = int(os.getenv("STREAM_TOKEN_CACHE_SIZE", "10000"))
 
-if STREAM_AVAILABLE and STREAM_API_KEY and STREAM_API_SECRET:
+_server_client = None
+_client_failed = False
+
+def get_server_client():
+    """The StreamChat client, imported and built on first use"""
+    global _server_client, _client_failed
+    if _server_client is not None or _client_failed:
+        return _server_client
+    if not (STREAM_AVAILABLE and STREAM_API_KEY and STREAM_API_SECRET):
+        _client_failed = True
+        return None
     try:
-        server_client = StreamChat(api_key=STREAM_API_KEY, api_secret=STREAM_API_SECRET)
+        from stream_chat import StreamChat
+
+        options = {"base_url": STREAM_BASE_URL} if STREAM_BASE_URL else {}
+        _server_client = StreamChat(
+            api_key=STREAM_API_KEY, api_secret=STREAM_API_SECRET, timeout=STREAM_TIMEOUT, **options
+        )
         logger.info("Successfully initialized StreamChat client")
     except Exception as e:
-        server_client = None
-        logger.error(f"Failed to initialize StreamChat client: {e}")
-else:
-    server_client = None
+        _client_failed = True
+        logger.error("Failed to initialize StreamChat client: %s", e)
+    return _server_client
 
-@router.post("/token")
-async def create_token(user_id: str):
-    logger.info(f"Token request for user: {user_id}")
-    
+# The stream_chat client is synchronous (requests), so its calls run here
+# instead of on the event loop
+executor = ThreadPoolExecutor(max_workers=STREAM_MAX_WORKERS, thread_name_prefix="stream")
+
+async def run_stream(fn, *args, **kwargs):
+    """Run a blocking Stream client call on the executor"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(executor, partial(fn, *args, **kwargs))
+
+class TokenCache:
+    """Issued tokens per user id, reused until shortly before they expire.
+
+    A user with a cached token has also been upserted already, so a hit skips
+    the Stream API entirely.
+    """
+
+    def __init__(self, max_size: int = TOKEN_CACHE_SIZE, refresh_margin: int = TOKEN_REFRESH_MARGIN):
+        self.max_size = max_size
+        self.refresh_margin = refresh_margin
+        # user id -> (token, exp)
+        self._entries: "OrderedDict[str, Tuple[str, int]]" = OrderedDict()
+
+    def get(self, user_id: str) -> Optional[str]:
+        entry = self._entries.get(user_id)
+        if entry is None:
+            return None
+        token, exp = entry
+        if exp - time.time() < self.refresh_margin:
+            del self._entries[user_id]
+            return None
+        self._entries.move_to_end(user_id)
+        return token
+
+    def put(self, user_id: str, token: str, exp: int):
+        self._entries[user_id] = (token, exp)
+        self._entries.move_to_end(user_id)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+token_cache = TokenCache()
+
+def user_payload(user_id: str) -> Dict[str, str]:
+    return {
+        "id": user_id,
+        "name": f"User_{user_id[:4]}",
+        "role": "user"
+    }
+
+async def require_client():
     if not STREAM_AVAILABLE:
         raise HTTPException(status_code=501, detail="Stream Chat not configured")
+    # The first call imports stream_chat, which is slow enough to run off the loop too
+    server_client = _server_client or await run_stream(get_server_client)
     if not server_client:
         raise HTTPException(status_code=503, detail="Stream Chat not available")
+    return server_client
+
+@router.post("/token")
+async def create_token(user_id: str):
+    logger.info("Token request for user: %s", user_id)
+    server_client = await require_client()
+
+    token = token_cache.get(user_id)
+    if token:
+        return {"token": token, "user_id": user_id}
 
     try:
         # Create or update user
-        server_client.update_user({
-            "id": user_id,
-            "name": f"User_{user_id[:4]}",
-            "role": "user"
-        })
-        logger.info(f"User created/updated: {user_id}")
-        
-        # Create token
-        token = server_client.create_token(user_id, exp_seconds=24*60*60)
-        logger.info(f"Token created for user: {user_id}")
-        
+        await run_stream(server_client.update_users, [user_payload(user_id)])
+        logger.info("User created/updated: %s", user_id)
+
+        # Signing is local, no request to Stream
+        exp = int(time.time()) + TOKEN_TTL
+        token = server_client.create_token(user_id, exp=exp)
+        token_cache.put(user_id, token, exp)
+        logger.info("Token created for user: %s", user_id)
+
         return {"token": token, "user_id": user_id}
     except Exception as e:
-        logger.error(f"Token creation failed: {e}")
+        logger.error("Token creation failed: %s", e)
         raise HTTPException(status_code=500, detail=str(e))
 
 @router.post("/channel")
 async def create_channel(session_id: str, user1_id: str, user2_id: str):
-    logger.info(f"Channel request for session: {session_id}, users: {user1_id}, {user2_id}")
-    
-    if not STREAM_AVAILABLE:
-        raise HTTPException(status_code=501, detail="Stream Chat not configured")
-    if not server_client:
-        raise HTTPException(status_code=503, detail="Stream Chat not available")
+    logger.info("Channel request for session: %s, users: %s, %s", session_id, user1_id, user2_id)
+    server_client = await require_client()
 
     try:
-        # Create both users first
-        for user_id in [user1_id, user2_id]:
-            try:
-                server_client.update_user({
-                    "id": user_id,
-                    "name": f"User_{user_id[:4]}",
-                    "role": "user"
-                })
-                logger.info(f"User created/updated for channel: {user_id}")
-            except Exception as user_error:
-                logger.error(f"Failed to create user {user_id}: {user_error}")
-                # Continue anyway - the channel creation might still work
-        
-        # Small delay to ensure users are created
-        await asyncio.sleep(0.5)
+        # Both users in one upsert; it has returned before the channel is created,
+        # so no settling delay is needed
+        try:
+            await run_stream(server_client.update_users, [user_payload(user1_id), user_payload(user2_id)])
+            logger.info("Users created/updated for channel: %s, %s", user1_id, user2_id)
+        except Exception as user_error:
+            logger.error("Failed to create users %s, %s: %s", user1_id, user2_id, user_error)
+            # Continue anyway - the channel creation might still work
 
         # Create channel
         channel = server_client.channel("messaging", session_id, {
             "name": f"Chat Session {session_id}",
-            "members": [user1_id, user2_id],
-            "created_by_id": user1_id
+            "members": [user1_id, user2_id]
         })
 
-        response = await channel.create()
-        logger.info(f"Channel created for session: {session_id}")
+        await run_stream(channel.create, user1_id)
+        logger.info("Channel created for session: %s", session_id)
         return {"channel_id": channel.id}
     except Exception as e:
-        logger.error(f"Channel creation failed: {e}")
+        logger.error("Channel creation failed: %s", e)
         raise HTTPException(status_code=500, detail=str(e))
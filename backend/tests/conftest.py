@@ -0,0 +1,11 @@
+import os
+import sys
+import tempfile
+
+# The app reads its configuration at import, so the test settings go in first
+_directory = tempfile.mkdtemp(prefix="dispozhe-tests-")
+os.environ["DATABASE_URL"] = f"sqlite:///{_directory}/test.db"
+os.environ["RATE_LIMIT_ENABLED"] = "0"
+os.environ["RUNTIME_SNAPSHOT_DIR"] = ""
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
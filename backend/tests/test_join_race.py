@@ -0,0 +1,34 @@
+"""Hundreds of concurrent joins on one session, through both join routes: exactly one may win."""
+import asyncio
+
+import httpx
+
+import app as backend
+from models.database import Session, SessionLocal
+
+JOINERS = 300
+
+async def race():
+    async with backend.app.router.lifespan_context(backend.app):
+        transport = httpx.ASGITransport(app=backend.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            response = await client.post("/session/create", json={"duration": 5})
+            assert response.status_code == 200
+            created = response.json()
+
+            # Half of the joiners race on the link, half on the join code
+            paths = [
+                f"/session/code/{created['code']}" if i % 2 else f"/session/{created['session_id']}/join"
+                for i in range(JOINERS)
+            ]
+            responses = await asyncio.gather(*(client.post(path) for path in paths))
+
+        async with SessionLocal() as db:
+            session = await db.get(Session, created["session_id"])
+        return [r.status_code for r in responses], session.participant_count
+
+def test_exactly_one_concurrent_join_wins():
+    statuses, participant_count = asyncio.run(race())
+    assert statuses.count(200) == 1
+    assert set(statuses) - {200} <= {400, 404, 409}
+    assert participant_count == 2
@@ -0,0 +1,202 @@
+import math
+import os
+import re
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional, Pattern, Tuple
+
+from utils.serialization import dumps_bytes
+
+RATE_LIMIT_ENABLED = os.getenv("RATE_LIMIT_ENABLED", "1") == "1"
+# "N/period": N requests in a burst, refilling at N per period
+RATE_LIMIT_CREATE = os.getenv("RATE_LIMIT_CREATE", "30/minute")
+RATE_LIMIT_CREATE_GLOBAL = os.getenv("RATE_LIMIT_CREATE_GLOBAL", "200/second")
+RATE_LIMIT_CREATE_BATCH = os.getenv("RATE_LIMIT_CREATE_BATCH", "5/minute")
+RATE_LIMIT_CREATE_BATCH_GLOBAL = os.getenv("RATE_LIMIT_CREATE_BATCH_GLOBAL", "20/second")
+# Code guesses are the brute-force target, so they get the tightest per-IP limit
+RATE_LIMIT_JOIN_CODE = os.getenv("RATE_LIMIT_JOIN_CODE", "10/minute")
+RATE_LIMIT_JOIN_CODE_GLOBAL = os.getenv("RATE_LIMIT_JOIN_CODE_GLOBAL", "200/second")
+# Client addresses tracked per limiter; the least recently seen are forgotten first
+RATE_LIMIT_MAX_KEYS = int(os.getenv("RATE_LIMIT_MAX_KEYS", "100000"))
+# HTTP requests in flight before new ones get 503, 0 to disable
+MAX_CONCURRENT_REQUESTS = int(os.getenv("MAX_CONCURRENT_REQUESTS", "1000"))
+# Proxies in front of the app that each append the address they saw to
+# X-Forwarded-For. The client is the entry this many places from the right;
+# entries further left are whatever the client sent. 0 uses the socket peer.
+TRUSTED_PROXY_HOPS = int(os.getenv("TRUSTED_PROXY_HOPS", "0"))
+
+_PERIODS = {"second": 1, "minute": 60, "hour": 3600}
+
+def parse_rate(rate: str) -> Tuple[int, float]:
+    """Parse ``"N/period"`` (second, minute or hour) into (count, seconds)"""
+    count, _, period = rate.partition("/")
+    seconds = _PERIODS.get(period.strip().rstrip("s"))
+    if seconds is None or not count.strip().isdigit() or int(count) < 1:
+        raise ValueError(f"Invalid rate {rate!r}, expected N/second, N/minute or N/hour")
+    return int(count), float(seconds)
+
+class GCRALimiter:
+    """Generic cell rate algorithm over a bounded LRU of keys.
+
+    Each key stores one float, its theoretical arrival time. A request is
+    admitted if that time is no more than ``tolerance`` ahead of now, which
+    allows a burst of ``count`` and then ``count`` per ``period``. A forgotten
+    key is indistinguishable from an idle one, so eviction only ever errs on the
+    side of admitting.
+    """
+
+    def __init__(self, count: int, period: float, max_keys: int = RATE_LIMIT_MAX_KEYS):
+        self.interval = period / count
+        self.tolerance = period - self.interval
+        self.max_keys = max_keys
+        self._tat: "OrderedDict[str, float]" = OrderedDict()
+
+    @classmethod
+    def from_rate(cls, rate: str, max_keys: int = RATE_LIMIT_MAX_KEYS) -> "GCRALimiter":
+        return cls(*parse_rate(rate), max_keys=max_keys)
+
+    def __len__(self) -> int:
+        return len(self._tat)
+
+    def delay(self, key: str, now: float) -> float:
+        """Seconds until ``key`` may make a request, 0 if it may now"""
+        tat = self._tat.get(key, now)
+        wait = tat - self.tolerance - now
+        return wait if wait > 0 else 0.0
+
+    def consume(self, key: str, now: float):
+        tat = self._tat.get(key, now)
+        self._tat[key] = (tat if tat > now else now) + self.interval
+        self._tat.move_to_end(key)
+        if len(self._tat) > self.max_keys:
+            self._tat.popitem(last=False)
+
+class RateLimitRule:
+    """Per-client and global limits for one method and path pattern"""
+
+    __slots__ = ("name", "method", "pattern", "per_client", "global_limit")
+
+    def __init__(self, name: str, method: str, pattern: str, per_client: Optional[str],
+                 global_limit: Optional[str], max_keys: int = RATE_LIMIT_MAX_KEYS):
+        self.name = name
+        self.method = method
+        self.pattern: Pattern = re.compile(pattern)
+        self.per_client = GCRALimiter.from_rate(per_client, max_keys) if per_client else None
+        self.global_limit = GCRALimiter.from_rate(global_limit, max_keys=1) if global_limit else None
+
+    def matches(self, method: str, path: str) -> bool:
+        return method == self.method and self.pattern.match(path) is not None
+
+    def admit(self, client: str, now: float) -> float:
+        """Take one request from both limits, or return how long to wait without taking any"""
+        wait = 0.0
+        if self.per_client is not None:
+            wait = self.per_client.delay(client, now)
+        if self.global_limit is not None:
+            wait = max(wait, self.global_limit.delay("", now))
+        if wait:
+            return wait
+        if self.per_client is not None:
+            self.per_client.consume(client, now)
+        if self.global_limit is not None:
+            self.global_limit.consume("", now)
+        return 0.0
+
+def default_rules() -> List[RateLimitRule]:
+    return [
+        RateLimitRule("create", "POST", r"^/session/create$", RATE_LIMIT_CREATE, RATE_LIMIT_CREATE_GLOBAL),
+        RateLimitRule("create_batch", "POST", r"^/session/create/batch$",
+                      RATE_LIMIT_CREATE_BATCH, RATE_LIMIT_CREATE_BATCH_GLOBAL),
+        RateLimitRule("join_code", "POST", r"^/session/code/[^/]+$",
+                      RATE_LIMIT_JOIN_CODE, RATE_LIMIT_JOIN_CODE_GLOBAL),
+    ]
+
+# Probes and long-lived streams never count against the concurrency limit
+EXEMPT_PATHS = re.compile(r"^/(health|metrics)$|/events$")
+
+def client_address(scope, trusted_hops: int = TRUSTED_PROXY_HOPS) -> str:
+    """The address rate limits are keyed on: the socket peer, or the hop the proxies vouch for"""
+    if trusted_hops:
+        hosts = [
+            host.strip()
+            for name, value in scope["headers"] if name == b"x-forwarded-for"
+            for host in value.decode("latin-1").split(",")
+        ]
+        if hosts:
+            # Fewer entries than proxies means none of them were added by the client
+            return hosts[-trusted_hops] if len(hosts) >= trusted_hops else hosts[0]
+    client = scope.get("client")
+    return client[0] if client else ""
+
+class AdmissionControl:
+    """Limits and counters shared by the middleware and the metrics endpoint"""
+
+    def __init__(self, rules: Optional[List[RateLimitRule]] = None,
+                 max_concurrent: int = MAX_CONCURRENT_REQUESTS, enabled: bool = RATE_LIMIT_ENABLED,
+                 trusted_hops: int = TRUSTED_PROXY_HOPS):
+        self.rules = (rules if rules is not None else default_rules()) if enabled else []
+        self.max_concurrent = max_concurrent
+        self.trusted_hops = trusted_hops
+        self.in_flight = 0
+        self.rate_limited: Dict[str, int] = {rule.name: 0 for rule in self.rules}
+        self.overloaded = 0
+
+class AdmissionMiddleware:
+    """Sheds load before routing: 429 for rate-limited clients, 503 when too much is in flight.
+
+    Plain ASGI rather than BaseHTTPMiddleware so an admitted request costs a
+    few comparisons and a rejected one never reaches a dependency, the DB or a
+    lock. Behind a proxy every socket peer is the proxy, so set
+    TRUSTED_PROXY_HOPS to the number of proxies that append to
+    X-Forwarded-For; otherwise one limit is shared by every client.
+    uvicorn's ``--forwarded-allow-ips='*'`` is no substitute, since it takes
+    the leftmost entry, which the client controls.
+    """
+
+    def __init__(self, app, control: AdmissionControl):
+        self.app = app
+        self.control = control
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        control = self.control
+        path = scope["path"]
+        method = scope["method"]
+        for rule in control.rules:
+            if rule.matches(method, path):
+                wait = rule.admit(client_address(scope, control.trusted_hops), time.monotonic())
+                if wait:
+                    control.rate_limited[rule.name] += 1
+                    await _reject(send, 429, "Too many requests", wait)
+                    return
+                break
+
+        if not control.max_concurrent or EXEMPT_PATHS.search(path):
+            await self.app(scope, receive, send)
+            return
+
+        if control.in_flight >= control.max_concurrent:
+            control.overloaded += 1
+            await _reject(send, 503, "Server busy", 1)
+            return
+        control.in_flight += 1
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            control.in_flight -= 1
+
+async def _reject(send, status: int, detail: str, retry_after: float):
+    body = dumps_bytes({"detail": detail})
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [
+            (b"content-type", b"application/json"),
+            (b"content-length", str(len(body)).encode()),
+            (b"retry-after", str(max(1, math.ceil(retry_after))).encode()),
+        ],
+    })
+    await send({"type": "http.response.body", "body": body})
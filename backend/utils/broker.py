@@ -0,0 +1,282 @@
+import asyncio
+import logging
+import os
+import socket
+import time
+import uuid
+from typing import Awaitable, Callable, Dict, List, Optional, Set, Union
+from urllib.parse import urlparse
+
+from utils.resp import RespClient
+
+logger = logging.getLogger(__name__)
+
+Payload = Union[str, bytes]
+BrokerHandler = Callable[[str, str, Payload], Awaitable[None]]
+
+# Envelope kinds
+MESSAGE = "m"
+TERMINATE = "t"
+EVENT = "e"
+# Broker-wide: the payload is newline-separated session ids whose cached
+# snapshots are stale; every worker receives it, subscribed or not
+INVALIDATE = "i"
+
+NODE_ID_LENGTH = 12
+
+def encode_envelope(kind: str, origin: str, session_id: str, payload: Payload) -> bytes:
+    """kind(1) | origin(12) | len(session_id)(1) | session_id | is_text(1) | payload"""
+    sid = session_id.encode()
+    if isinstance(payload, str):
+        flag, body = b"\x01", payload.encode()
+    else:
+        flag, body = b"\x00", payload
+    return b"".join((kind.encode(), origin.encode(), bytes((len(sid),)), sid, flag, body))
+
+def decode_envelope(data: bytes):
+    kind = chr(data[0])
+    origin = data[1:1 + NODE_ID_LENGTH].decode()
+    offset = 1 + NODE_ID_LENGTH
+    sid_len = data[offset]
+    session_id = data[offset + 1:offset + 1 + sid_len].decode()
+    offset += 1 + sid_len
+    body = data[offset + 1:]
+    payload = body.decode() if data[offset] == 1 else body
+    return kind, origin, session_id, payload
+
+class Broker:
+    """Fans session traffic out to the other workers.
+
+    ``publish`` never loops back to the publishing worker, so callers deliver to
+    their own sockets directly and use the broker only for remote peers.
+    """
+
+    def __init__(self):
+        self.node_id = uuid.uuid4().hex[:NODE_ID_LENGTH]
+        self.handler: Optional[BrokerHandler] = None
+        self.published = 0
+        self.received = 0
+
+    async def start(self, handler: BrokerHandler):
+        self.handler = handler
+
+    def subscribe(self, session_id: str):
+        """Called when this worker starts needing a session's traffic; may repeat"""
+
+    def unsubscribe(self, session_id: str):
+        """Called once no socket, listener or replay ring here needs it any more"""
+
+    async def publish(self, kind: str, session_id: str, payload: Payload):
+        raise NotImplementedError
+
+    async def close(self):
+        self.handler = None
+
+    async def _dispatch(self, data: bytes):
+        kind, origin, session_id, payload = decode_envelope(data)
+        if origin == self.node_id or self.handler is None:
+            return
+        self.received += 1
+        try:
+            await self.handler(kind, session_id, payload)
+        except Exception as e:
+            logger.error("Broker handler error for session %s: %s", session_id, e)
+
+class InProcessBroker(Broker):
+    """Delivers between managers living in the same process (single worker)"""
+
+    _buses: Dict[str, List["InProcessBroker"]] = {}
+
+    def __init__(self, name: str = "default"):
+        super().__init__()
+        self.name = name
+
+    async def start(self, handler: BrokerHandler):
+        await super().start(handler)
+        self._buses.setdefault(self.name, []).append(self)
+
+    async def publish(self, kind: str, session_id: str, payload: Payload):
+        peers = self._buses.get(self.name, ())
+        if len(peers) < 2:
+            return
+        self.published += 1
+        data = encode_envelope(kind, self.node_id, session_id, payload)
+        for peer in peers:
+            if peer is not self:
+                await peer._dispatch(data)
+
+    async def close(self):
+        peers = self._buses.get(self.name, [])
+        if self in peers:
+            peers.remove(self)
+        await super().close()
+
+class UnixSocketBroker(Broker):
+    """Single-host fan-out over Unix datagram sockets.
+
+    Every worker binds ``<directory>/<node_id>.sock``; publishing sends one
+    datagram to each peer socket found in the directory.
+    """
+
+    BUFFER_SIZE = 4 * 1024 * 1024
+    PEER_REFRESH_SECONDS = 2.0
+
+    def __init__(self, directory: str):
+        super().__init__()
+        self.directory = directory
+        self.path = os.path.join(directory, f"{self.node_id}.sock")
+        self.sock: Optional[socket.socket] = None
+        self._peers: List[str] = []
+        self._peers_refreshed = 0.0
+        self.dropped = 0
+
+    async def start(self, handler: BrokerHandler):
+        await super().start(handler)
+        os.makedirs(self.directory, exist_ok=True)
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, self.BUFFER_SIZE)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, self.BUFFER_SIZE)
+        self.sock.bind(self.path)
+        self.sock.setblocking(False)
+        asyncio.get_running_loop().add_reader(self.sock.fileno(), self._on_readable)
+        logger.info("Unix socket broker listening on %s", self.path)
+
+    def _on_readable(self):
+        while True:
+            try:
+                data = self.sock.recv(self.BUFFER_SIZE)
+            except (BlockingIOError, InterruptedError):
+                return
+            except OSError as e:
+                logger.error("Unix socket broker receive error: %s", e)
+                return
+            asyncio.ensure_future(self._dispatch(data))
+
+    def _refresh_peers(self):
+        now = time.monotonic()
+        if now - self._peers_refreshed < self.PEER_REFRESH_SECONDS:
+            return
+        self._peers_refreshed = now
+        try:
+            self._peers = [
+                os.path.join(self.directory, name) for name in os.listdir(self.directory)
+                if name.endswith(".sock") and name != os.path.basename(self.path)
+            ]
+        except OSError as e:
+            logger.error("Unix socket broker cannot list peers: %s", e)
+
+    async def publish(self, kind: str, session_id: str, payload: Payload):
+        self._refresh_peers()
+        if not self._peers:
+            return
+        self.published += 1
+        data = encode_envelope(kind, self.node_id, session_id, payload)
+        for peer in list(self._peers):
+            try:
+                self.sock.sendto(data, peer)
+            except (ConnectionRefusedError, FileNotFoundError):
+                # Worker is gone; drop its stale socket file
+                self._peers.remove(peer)
+                try:
+                    os.unlink(peer)
+                except OSError:
+                    pass
+            except BlockingIOError:
+                self.dropped += 1
+                logger.warning("Unix socket broker dropped message for session %s: peer busy", session_id)
+            except OSError as e:
+                self.dropped += 1
+                logger.error("Unix socket broker send error: %s", e)
+
+    async def close(self):
+        if self.sock:
+            asyncio.get_running_loop().remove_reader(self.sock.fileno())
+            self.sock.close()
+            self.sock = None
+            try:
+                os.unlink(self.path)
+            except OSError:
+                pass
+        await super().close()
+
+class RedisBroker(Broker):
+    """Fan-out over Redis PUBLISH/SUBSCRIBE with one channel per session.
+
+    While the connection is down, publishes are dropped and counted; the
+    subscriptions are restored as soon as the client reconnects.
+    """
+
+    CHANNEL_PREFIX = "dispozhe:session:"
+    # Carries broker-wide kinds that are not tied to a session's subscribers
+    CONTROL_CHANNEL = "dispozhe:control"
+
+    def __init__(self, url: str):
+        super().__init__()
+        self.url = url
+        self.publisher = RespClient(url)
+        self.subscriber = RespClient(url, on_push=self._on_push, on_reconnect=self._resubscribe)
+        self.channels: Set[str] = set()
+        self.dropped = 0
+
+    async def start(self, handler: BrokerHandler):
+        await super().start(handler)
+        await self.publisher.connect()
+        await self.subscriber.connect()
+        self._resubscribe()
+        logger.info("Redis broker connected")
+
+    def _channel(self, session_id: str) -> str:
+        return self.CHANNEL_PREFIX + session_id
+
+    def _channel_for(self, kind: str, session_id: str) -> str:
+        return self.CONTROL_CHANNEL if kind == INVALIDATE else self._channel(session_id)
+
+    def _resubscribe(self):
+        """Subscribe a fresh connection to the control channel and every tracked session"""
+        self.subscriber.send("SUBSCRIBE", self.CONTROL_CHANNEL, *map(self._channel, self.channels))
+
+    def subscribe(self, session_id: str):
+        if session_id in self.channels:
+            return
+        self.channels.add(session_id)
+        if self.subscriber.connected:
+            self.subscriber.send("SUBSCRIBE", self._channel(session_id))
+
+    def unsubscribe(self, session_id: str):
+        if session_id not in self.channels:
+            return
+        self.channels.discard(session_id)
+        if self.subscriber.connected:
+            self.subscriber.send("UNSUBSCRIBE", self._channel(session_id))
+
+    def _on_push(self, reply):
+        if isinstance(reply, list) and len(reply) == 3 and reply[0] == b"message":
+            asyncio.ensure_future(self._dispatch(reply[2]))
+
+    async def publish(self, kind: str, session_id: str, payload: Payload):
+        self.published += 1
+        data = encode_envelope(kind, self.node_id, session_id, payload)
+        try:
+            # The integer reply is not needed; the reader discards it in order
+            self.publisher.send("PUBLISH", self._channel_for(kind, session_id), data, discard=True)
+            await self.publisher.drain()
+        except ConnectionError as e:
+            self.dropped += 1
+            logger.warning("Redis broker dropped message for session %s: %s", session_id, e)
+
+    async def close(self):
+        await self.publisher.close()
+        await self.subscriber.close()
+        await super().close()
+
+def create_broker(url: Optional[str] = None) -> Broker:
+    """Build a broker from BROKER_URL: memory://, unix:///dir or redis://host:port/db"""
+    url = url if url is not None else os.getenv("BROKER_URL", "memory://")
+    scheme = urlparse(url).scheme or "memory"
+    if scheme == "memory":
+        return InProcessBroker()
+    if scheme == "unix":
+        return UnixSocketBroker(urlparse(url).path or "/tmp/dispozhe-broker")
+    if scheme in ("redis", "rediss"):
+        return RedisBroker(url)
+    raise ValueError(f"Unsupported BROKER_URL scheme: {scheme}")
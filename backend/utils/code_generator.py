@@ -1,116 +1,222 @@
-import hashlib
-import threading
+import heapq
+import itertools
+import secrets
 import time
+from array import array
 from datetime import datetime, timedelta
-from typing import Dict, Optional
+from typing import Dict, Iterable, List, Optional, Tuple
 import logging
 
+from utils.scheduler import to_timestamp
+
 logger = logging.getLogger(__name__)
 
+CODE_SPACE = 1_000_000
+
+_EPOCH = datetime(1970, 1, 1)
+
+# (code, created timestamp, expires timestamp, session_id, encryption_key)
+CodeRecord = Tuple[int, float, float, str, str]
+
 class CodeEntry:
-    def __init__(self, session_id: str, encryption_key: str, expires_at: datetime):
+    """Times are epoch floats; the datetime views are only built when asked for"""
+
+    __slots__ = ("session_id", "encryption_key", "created", "expires", "used")
+
+    def __init__(self, session_id: str, encryption_key: str, expires: float, created: Optional[float] = None):
         self.session_id = session_id
         self.encryption_key = encryption_key
-        self.created_at = datetime.utcnow()
-        self.expires_at = expires_at
+        self.created = created if created is not None else time.time()
+        self.expires = expires
         self.used = False
 
+    @property
+    def created_at(self) -> datetime:
+        return _EPOCH + timedelta(seconds=self.created)
+
+    @property
+    def expires_at(self) -> datetime:
+        return _EPOCH + timedelta(seconds=self.expires)
+
+class CodeAllocator:
+    """Free list over the whole code space.
+
+    ``_codes`` is a permutation of every code: the first ``used`` slots hold
+    allocated codes and the rest are free. Allocating swaps a random free code
+    into the allocated prefix and releasing swaps it back out, so both stay
+    O(1) no matter how full the space is.
+    """
+
+    def __init__(self, size: int = CODE_SPACE):
+        self.size = size
+        self.used = 0
+        self._codes: Optional[array] = None
+        self._index: Optional[array] = None
+
+    def _ensure(self):
+        # Built on first use so importing the app stays cheap
+        if self._codes is None:
+            self._codes = array("i", range(self.size))
+            self._index = array("i", range(self.size))
+
+    def _swap(self, i: int, j: int):
+        codes, index = self._codes, self._index
+        a, b = codes[i], codes[j]
+        codes[i], codes[j] = b, a
+        index[a], index[b] = j, i
+
+    def allocate(self) -> int:
+        self._ensure()
+        if self.used >= self.size:
+            raise RuntimeError("Code space exhausted")
+        pick = self.used + secrets.randbelow(self.size - self.used)
+        self._swap(pick, self.used)
+        code = self._codes[self.used]
+        self.used += 1
+        return code
+
+    def reserve(self, code: int) -> bool:
+        """Mark a specific code as allocated, returns False if it already was"""
+        self._ensure()
+        codes, index = self._codes, self._index
+        position = index[code]
+        used = self.used
+        if position < used:
+            return False
+        # _swap inlined: a snapshot restore calls this once per code
+        other = codes[used]
+        codes[position], codes[used] = other, code
+        index[other], index[code] = position, used
+        self.used = used + 1
+        return True
+
+    def release(self, code: int):
+        self._ensure()
+        position = self._index[code]
+        if position >= self.used:
+            return
+        self.used -= 1
+        self._swap(position, self.used)
+
 class CodeGenerator:
-    def __init__(self):
+    """Six-digit join codes with O(1) allocation and an expiry heap.
+
+    All methods are synchronous and never await, so on the event loop each call
+    runs to completion without interleaving and needs no lock.
+    """
+
+    def __init__(self, size: int = CODE_SPACE):
         self.active_codes: Dict[str, CodeEntry] = {}
         self.session_to_code: Dict[str, str] = {}
-        self.lock = threading.Lock()
-        
-    def _generate_six_digit_code(self, session_id: str) -> str:
-        hash_obj = hashlib.sha256(session_id.encode())
-        hash_int = int.from_bytes(hash_obj.digest(), byteorder='big')
-        code_int = hash_int % 1_000_000
-        return f"{code_int:06d}"
-    
-    def _ensure_unique_code(self, base_code: str, session_id: str) -> str:
-        code = base_code
-        offset = 0
-        
-        while code in self.active_codes and self.active_codes[code].session_id != session_id:
-            offset += 1
-            if offset > 100:
-                code_int = (int(base_code) + offset) % 1_000_000
-                code = f"{code_int:06d}"
-            else:
-                code_int = (int(base_code) + offset) % 1_000_000
-                code = f"{code_int:06d}"
-        
-        return code
-    
+        self.allocator = CodeAllocator(size)
+        self._expiry_heap: List[Tuple[float, int, str, CodeEntry]] = []
+        self._counter = itertools.count()
+
     def generate_code(self, session_id: str, expires_at: datetime, encryption_key: str = "") -> str:
-        with self.lock:
-            if session_id in self.session_to_code:
-                old_code = self.session_to_code[session_id]
-                if old_code in self.active_codes:
-                    del self.active_codes[old_code]
-                del self.session_to_code[session_id]
-            
-            base_code = self._generate_six_digit_code(session_id)
-            code = self._ensure_unique_code(base_code, session_id)
-            
-            self.active_codes[code] = CodeEntry(session_id, encryption_key, expires_at)
-            self.session_to_code[session_id] = code
-            
-            logger.info(f"Generated code {code} for session {session_id}")
-            return code
-    
+        self._drain_expired()
+
+        if session_id in self.session_to_code:
+            self._cleanup_code(self.session_to_code[session_id], session_id)
+
+        code = f"{self.allocator.allocate():06d}"
+        entry = CodeEntry(session_id, encryption_key, to_timestamp(expires_at))
+        self._store(code, entry)
+
+        logger.info("Generated code %s for session %s", code, session_id)
+        return code
+
+    def _store(self, code: str, entry: CodeEntry):
+        self.active_codes[code] = entry
+        self.session_to_code[entry.session_id] = code
+        heapq.heappush(self._expiry_heap, (entry.expires, next(self._counter), code, entry))
+
     def redeem_code(self, code: str) -> Optional[Dict[str, str]]:
-        with self.lock:
-            entry = self.active_codes.get(code)
-            
-            if not entry:
-                logger.info(f"Code {code} not found")
-                return None
-            
-            if entry.used:
-                logger.info(f"Code {code} already used")
-                return None
-            
-            if datetime.utcnow() > entry.expires_at:
-                logger.info(f"Code {code} expired")
-                self._cleanup_code(code, entry.session_id)
-                return None
-            
-            entry.used = True
-            
-            result = {
-                "sessionId": entry.session_id,
-                "encryptionKey": entry.encryption_key
-            }
-            
+        self._drain_expired()
+        entry = self.active_codes.get(code)
+
+        if not entry:
+            logger.info("Code %s not found", code)
+            return None
+
+        if entry.used:
+            logger.info("Code %s already used", code)
+            return None
+
+        if time.time() > entry.expires:
+            logger.info("Code %s expired", code)
             self._cleanup_code(code, entry.session_id)
-            
-            logger.info(f"Code {code} redeemed successfully for session {entry.session_id}")
-            return result
-    
+            return None
+
+        entry.used = True
+
+        result = {
+            "sessionId": entry.session_id,
+            "encryptionKey": entry.encryption_key
+        }
+
+        self._cleanup_code(code, entry.session_id)
+
+        logger.info("Code %s redeemed successfully for session %s", code, entry.session_id)
+        return result
+
     def _cleanup_code(self, code: str, session_id: str):
         if code in self.active_codes:
             del self.active_codes[code]
-        if session_id in self.session_to_code:
+            self.allocator.release(int(code))
+        if self.session_to_code.get(session_id) == code:
             del self.session_to_code[session_id]
-    
+
     def remove_by_session(self, session_id: str):
-        with self.lock:
-            if session_id in self.session_to_code:
-                code = self.session_to_code[session_id]
-                self._cleanup_code(code, session_id)
-                logger.info(f"Removed code {code} for session {session_id}")
-    
-    def cleanup_expired(self):
-        with self.lock:
-            now = datetime.utcnow()
-            expired = [
-                code for code, entry in self.active_codes.items()
-                if entry.expires_at < now
-            ]
-            for code in expired:
-                entry = self.active_codes[code]
+        if session_id in self.session_to_code:
+            code = self.session_to_code[session_id]
+            self._cleanup_code(code, session_id)
+            logger.info("Removed code %s for session %s", code, session_id)
+
+    def _drain_expired(self, now: Optional[float] = None) -> int:
+        """Pop every expired code off the heap; stale heap entries are skipped"""
+        heap = self._expiry_heap
+        if not heap:
+            return 0
+        now = now if now is not None else time.time()
+        removed = 0
+        while heap and heap[0][0] < now:
+            _, _, code, entry = heapq.heappop(heap)
+            if self.active_codes.get(code) is entry:
                 self._cleanup_code(code, entry.session_id)
-            
-            if expired:
-                logger.info(f"Cleaned up {len(expired)} expired codes")
+                removed += 1
+        if len(heap) > 1024 and len(heap) > 2 * len(self.active_codes):
+            self._expiry_heap = [item for item in heap if self.active_codes.get(item[2]) is item[3]]
+            heapq.heapify(self._expiry_heap)
+        return removed
+
+    def export(self) -> List[CodeRecord]:
+        """Every unexpired, unredeemed code, for a snapshot"""
+        self._drain_expired()
+        return [
+            (int(code), entry.created, expires, entry.session_id, entry.encryption_key)
+            for expires, _, code, entry in self._expiry_heap
+            if self.active_codes.get(code) is entry
+        ]
+
+    def restore(self, records: Iterable[CodeRecord], now: Optional[float] = None) -> int:
+        """Load codes from a snapshot, skipping expired ones and any already taken"""
+        now = now if now is not None else time.time()
+        reserve = self.allocator.reserve
+        heap = self._expiry_heap
+        restored = 0
+        for number, created, expires, session_id, encryption_key in records:
+            if expires <= now or session_id in self.session_to_code or not reserve(number):
+                continue
+            code = f"{number:06d}"
+            entry = CodeEntry(session_id, encryption_key, expires, created)
+            self.active_codes[code] = entry
+            self.session_to_code[session_id] = code
+            heap.append((expires, next(self._counter), code, entry))
+            restored += 1
+        heapq.heapify(heap)
+        return restored
+
+    def cleanup_expired(self):
+        removed = self._drain_expired()
+        if removed:
+            logger.info("Cleaned up %s expired codes", removed)
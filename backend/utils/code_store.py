@@ -0,0 +1,264 @@
+import asyncio
+import logging
+import os
+import secrets
+import time
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import urlparse
+
+from sqlalchemy import delete, insert, select
+from sqlalchemy.exc import IntegrityError
+
+from models.database import SessionLocal, JoinCode
+from utils.code_generator import CodeGenerator, CODE_SPACE
+from utils.resp import RespClient
+from utils.scheduler import to_timestamp
+
+logger = logging.getLogger(__name__)
+
+# Attempts at finding a free random code before giving up
+MAX_ALLOCATION_ATTEMPTS = 32
+
+def random_code() -> str:
+    return f"{secrets.randbelow(CODE_SPACE):06d}"
+
+class CodeStore:
+    """Join codes with redeem-once semantics, shared by every worker using the same backend"""
+
+    async def start(self):
+        pass
+
+    async def close(self):
+        pass
+
+    async def create(self, session_id: str, expires_at: datetime, encryption_key: str = "") -> str:
+        raise NotImplementedError
+
+    async def create_many(self, sessions: List[Tuple[str, datetime]], encryption_key: str = "") -> List[str]:
+        """Issue codes for freshly created sessions, in the order given"""
+        return [await self.create(session_id, expires_at, encryption_key) for session_id, expires_at in sessions]
+
+    async def redeem(self, code: str) -> Optional[Dict[str, str]]:
+        """Atomically consume a code; at most one caller ever gets the session back"""
+        raise NotImplementedError
+
+    async def remove_by_session(self, session_id: str):
+        raise NotImplementedError
+
+    def size(self) -> Optional[int]:
+        """Live codes held by this process, None when they live elsewhere"""
+        return None
+
+class MemoryCodeStore(CodeStore):
+    """Process-local store; codes are only redeemable on the worker that issued them"""
+
+    def __init__(self, generator: Optional[CodeGenerator] = None):
+        self.generator = generator or CodeGenerator()
+
+    async def create(self, session_id: str, expires_at: datetime, encryption_key: str = "") -> str:
+        return self.generator.generate_code(session_id, expires_at, encryption_key)
+
+    async def redeem(self, code: str) -> Optional[Dict[str, str]]:
+        return self.generator.redeem_code(code)
+
+    async def remove_by_session(self, session_id: str):
+        self.generator.remove_by_session(session_id)
+
+    def size(self) -> Optional[int]:
+        return len(self.generator.active_codes)
+
+class SQLCodeStore(CodeStore):
+    """Codes in the join_codes table; redeeming is a single DELETE ... RETURNING"""
+
+    PURGE_INTERVAL = 60
+
+    def __init__(self):
+        self._purge_task: Optional[asyncio.Task] = None
+
+    async def start(self):
+        self._purge_task = asyncio.create_task(self._purge_loop())
+
+    async def close(self):
+        if self._purge_task:
+            self._purge_task.cancel()
+
+    async def create(self, session_id: str, expires_at: datetime, encryption_key: str = "") -> str:
+        async with SessionLocal() as db:
+            await db.execute(delete(JoinCode).where(JoinCode.session_id == session_id))
+            await db.commit()
+            for _ in range(MAX_ALLOCATION_ATTEMPTS):
+                code = random_code()
+                # Reclaim the code if a previous holder expired but was not purged yet
+                await db.execute(
+                    delete(JoinCode).where(JoinCode.code == code, JoinCode.expires_at < datetime.utcnow())
+                )
+                db.add(JoinCode(
+                    code=code, session_id=session_id,
+                    encryption_key=encryption_key, expires_at=expires_at
+                ))
+                try:
+                    await db.commit()
+                except IntegrityError:
+                    await db.rollback()
+                    continue
+                logger.info("Generated code %s for session %s", code, session_id)
+                return code
+        raise RuntimeError("Could not allocate a free join code")
+
+    async def create_many(self, sessions: List[Tuple[str, datetime]], encryption_key: str = "") -> List[str]:
+        """One multi-row INSERT, redrawing only the codes that are already taken"""
+        async with SessionLocal() as db:
+            for _ in range(MAX_ALLOCATION_ATTEMPTS):
+                now = datetime.utcnow()
+                codes = set()
+                while len(codes) < len(sessions):
+                    candidates = {random_code() for _ in range(len(sessions) - len(codes))} - codes
+                    taken = (await db.execute(
+                        select(JoinCode.code).where(JoinCode.code.in_(candidates), JoinCode.expires_at >= now)
+                    )).scalars()
+                    codes |= candidates.difference(taken)
+                codes = list(codes)
+                # Reclaim codes whose holders expired but were not purged yet. A live
+                # holder committed since the check above is left alone; the insert
+                # then fails on it and the whole batch is drawn again
+                await db.execute(delete(JoinCode).where(JoinCode.code.in_(codes), JoinCode.expires_at < now))
+                try:
+                    await db.execute(insert(JoinCode), [
+                        {"code": code, "session_id": session_id,
+                         "encryption_key": encryption_key, "expires_at": expires_at}
+                        for code, (session_id, expires_at) in zip(codes, sessions)
+                    ])
+                    await db.commit()
+                except IntegrityError:
+                    # Another worker took one of the codes in between
+                    await db.rollback()
+                    continue
+                logger.info("Generated %s codes", len(codes))
+                return codes
+        raise RuntimeError("Could not allocate free join codes")
+
+    async def redeem(self, code: str) -> Optional[Dict[str, str]]:
+        async with SessionLocal() as db:
+            result = await db.execute(
+                delete(JoinCode)
+                .where(JoinCode.code == code, JoinCode.expires_at > datetime.utcnow())
+                .returning(JoinCode.session_id, JoinCode.encryption_key)
+            )
+            row = result.first()
+            await db.commit()
+        if not row:
+            logger.info("Code %s not found or expired", code)
+            return None
+        logger.info("Code %s redeemed successfully for session %s", code, row.session_id)
+        return {"sessionId": row.session_id, "encryptionKey": row.encryption_key}
+
+    async def remove_by_session(self, session_id: str):
+        async with SessionLocal() as db:
+            await db.execute(delete(JoinCode).where(JoinCode.session_id == session_id))
+            await db.commit()
+
+    async def purge_expired(self) -> int:
+        async with SessionLocal() as db:
+            result = await db.execute(delete(JoinCode).where(JoinCode.expires_at < datetime.utcnow()))
+            await db.commit()
+            return result.rowcount or 0
+
+    async def _purge_loop(self):
+        while True:
+            await asyncio.sleep(self.PURGE_INTERVAL)
+            try:
+                purged = await self.purge_expired()
+                if purged:
+                    logger.info("Purged %s expired join codes", purged)
+            except Exception as e:
+                logger.error("Error purging join codes: %s", e)
+
+class RedisCodeStore(CodeStore):
+    """Codes as Redis keys with a TTL; redeeming is a single GETDEL"""
+
+    CODE_PREFIX = "dispozhe:code:"
+    SESSION_PREFIX = "dispozhe:session-code:"
+
+    def __init__(self, url: str):
+        self.client = RespClient(url)
+
+    async def start(self):
+        await self.client.connect()
+
+    async def close(self):
+        await self.client.close()
+
+    async def create(self, session_id: str, expires_at: datetime, encryption_key: str = "") -> str:
+        await self.remove_by_session(session_id)
+        ttl_ms = max(1, int((to_timestamp(expires_at) - time.time()) * 1000))
+        value = f"{session_id}\n{encryption_key}"
+        for _ in range(MAX_ALLOCATION_ATTEMPTS):
+            code = random_code()
+            if await self.client.execute("SET", self.CODE_PREFIX + code, value, "NX", "PX", ttl_ms):
+                await self.client.execute("SET", self.SESSION_PREFIX + session_id, code, "PX", ttl_ms)
+                logger.info("Generated code %s for session %s", code, session_id)
+                return code
+        raise RuntimeError("Could not allocate a free join code")
+
+    async def create_many(self, sessions: List[Tuple[str, datetime]], encryption_key: str = "") -> List[str]:
+        """Pipeline one SET NX per session and redraw only the codes that collided"""
+        codes: List[Optional[str]] = [None] * len(sessions)
+        ttls = [max(1, int((to_timestamp(expires_at) - time.time()) * 1000)) for _, expires_at in sessions]
+        pending = list(range(len(sessions)))
+        for _ in range(MAX_ALLOCATION_ATTEMPTS):
+            if not pending:
+                break
+            attempts = [(i, random_code()) for i in pending]
+            replies = await asyncio.gather(*(
+                self.client.send("SET", self.CODE_PREFIX + code, f"{sessions[i][0]}\n{encryption_key}",
+                                 "NX", "PX", ttls[i])
+                for i, code in attempts
+            ))
+            pending = []
+            for (i, code), reply in zip(attempts, replies):
+                if reply:
+                    codes[i] = code
+                    self.client.send("SET", self.SESSION_PREFIX + sessions[i][0], code, "PX", ttls[i], discard=True)
+                else:
+                    pending.append(i)
+        if pending:
+            raise RuntimeError("Could not allocate free join codes")
+        logger.info("Generated %s codes", len(codes))
+        return codes
+
+    async def redeem(self, code: str) -> Optional[Dict[str, str]]:
+        value = await self.client.execute("GETDEL", self.CODE_PREFIX + code)
+        if value is None:
+            logger.info("Code %s not found or expired", code)
+            return None
+        session_id, _, encryption_key = value.decode().partition("\n")
+        try:
+            self.client.send("DEL", self.SESSION_PREFIX + session_id, discard=True)
+        except ConnectionError:
+            # The code is already consumed; the index key just runs out its TTL
+            pass
+        logger.info("Code %s redeemed successfully for session %s", code, session_id)
+        return {"sessionId": session_id, "encryptionKey": encryption_key}
+
+    async def remove_by_session(self, session_id: str):
+        code = await self.client.execute("GETDEL", self.SESSION_PREFIX + session_id)
+        if code is None:
+            return
+        key = self.CODE_PREFIX + code.decode()
+        value = await self.client.execute("GET", key)
+        # The code may already belong to another session after being redeemed
+        if value is not None and value.decode().partition("\n")[0] == session_id:
+            await self.client.execute("DEL", key)
+
+def create_code_store(url: Optional[str] = None) -> CodeStore:
+    """Build a code store from CODE_STORE_URL: memory://, sql:// or redis://host:port/db"""
+    url = url if url is not None else os.getenv("CODE_STORE_URL", "memory://")
+    scheme = urlparse(url).scheme or "memory"
+    if scheme == "memory":
+        return MemoryCodeStore()
+    if scheme == "sql":
+        return SQLCodeStore()
+    if scheme in ("redis", "rediss"):
+        return RedisCodeStore(url)
+    raise ValueError(f"Unsupported CODE_STORE_URL scheme: {scheme}")
@@ -1,32 +1,85 @@
-import threading
-import time
+import asyncio
 import logging
+import os
+import time
 from datetime import datetime, timedelta
-from typing import Callable, Dict, List
+from typing import Callable, Dict, List, Optional
+from sqlalchemy import delete, select, update
 from models.database import SessionLocal, Session
+from utils.metrics import EXPIRY_LAG, EXPIRY_RUN
+from utils.scheduler import DeadlineScheduler
 
 logger = logging.getLogger(__name__)
 
+LIVE_STATUSES = ("waiting", "active")
+DEAD_STATUSES = ("expired", "terminated")
+
+# Safety-net sweep for sessions no scheduler in this process knows about
+SWEEP_INTERVAL = int(os.getenv("EXPIRY_SWEEP_INTERVAL", "300"))
+# Expired and terminated rows are deleted once they are this old
+RETENTION_HOURS = float(os.getenv("SESSION_RETENTION_HOURS", "24"))
+RETENTION_INTERVAL = int(os.getenv("SESSION_RETENTION_INTERVAL", "3600"))
+RETENTION_BATCH = int(os.getenv("SESSION_RETENTION_BATCH", "500"))
+# Participants get an expiring_soon event this long before the deadline
+EXPIRING_SOON_SECONDS = int(os.getenv("EXPIRING_SOON_SECONDS", "60"))
+
 class ExpiryService:
-    def __init__(self, check_interval: int = 60):
-        self.check_interval = check_interval
+    # Keeps IN (...) lists under SQLite's bound-parameter limit
+    UPDATE_CHUNK = 500
+
+    def __init__(self, sweep_interval: int = SWEEP_INTERVAL, retention_hours: float = RETENTION_HOURS,
+                 retention_interval: int = RETENTION_INTERVAL, retention_batch: int = RETENTION_BATCH,
+                 warning_seconds: int = EXPIRING_SOON_SECONDS):
         self.running = False
-        self.thread = None
+        self.sweep_interval = sweep_interval
+        self.retention = timedelta(hours=retention_hours)
+        self.retention_interval = retention_interval
+        self.retention_batch = retention_batch
+        self.task: Optional[asyncio.Task] = None
+        self.scheduler = DeadlineScheduler(self._on_due)
+        self.warning = timedelta(seconds=warning_seconds)
+        self.warnings = DeadlineScheduler(self._on_warning)
         self.callbacks: Dict[str, List[Callable]] = {}
+        self.manager = None
+        self.session_cache = None
 
-    def start(self):
-        """Start the expiry cleanup service"""
+    def set_connection_manager(self, manager):
+        self.manager = manager
+
+    def set_session_cache(self, session_cache):
+        self.session_cache = session_cache
+
+    async def start(self):
+        """Start the expiry scheduler and load deadlines of live sessions"""
         self.running = True
-        self.thread = threading.Thread(target=self._run, daemon=True)
-        self.thread.start()
-        logger.info(f"Expiry cleanup service started (interval: {self.check_interval}s)")
+        self.scheduler.start()
+        self.warnings.start()
+        await self.sweep()
+        await self._load_pending()
+        self.task = asyncio.create_task(self._maintenance())
+        logger.info("Expiry scheduler started (%s sessions pending)", len(self.scheduler))
 
     def stop(self):
-        """Stop the expiry cleanup service"""
+        """Stop the expiry scheduler"""
         self.running = False
-        if self.thread:
-            self.thread.join(timeout=5)
-        logger.info("Expiry cleanup service stopped")
+        self.scheduler.stop()
+        self.warnings.stop()
+        if self.task:
+            self.task.cancel()
+            self.task = None
+        logger.info("Expiry scheduler stopped")
+
+    def schedule(self, session_id: str, expires_at: datetime):
+        """Expire the session exactly at expires_at, warning participants shortly before"""
+        self.scheduler.schedule_at(session_id, expires_at)
+        if self.warning:
+            self.warnings.schedule_at(session_id, expires_at - self.warning)
+
+    def cancel(self, session_id: str):
+        """Forget a session that was terminated before it expired"""
+        self.scheduler.cancel(session_id)
+        self.warnings.cancel(session_id)
+        self.callbacks.pop(session_id, None)
 
     def register_callback(self, session_id: str, callback: Callable):
         """Register a callback for when a session expires"""
@@ -34,61 +87,193 @@ class ExpiryService:
             self.callbacks[session_id] = []
         self.callbacks[session_id].append(callback)
 
-    def _run(self):
-        """Main cleanup loop"""
-        while self.running:
+    async def _load_pending(self):
+        """Schedule every live session in the DB that has not expired yet"""
+        async with SessionLocal() as db:
             try:
-                self._cleanup_expired_sessions()
-                time.sleep(self.check_interval)
+                rows = await db.execute(
+                    select(Session.id, Session.expires_at).where(
+                        Session.status.in_(LIVE_STATUSES),
+                        Session.expires_at >= datetime.utcnow()
+                    )
+                )
+                for session_id, expires_at in rows:
+                    self.schedule(session_id, expires_at)
             except Exception as e:
-                logger.error(f"Error in expiry cleanup: {e}")
-
-    def _cleanup_expired_sessions(self):
-        """Clean up expired sessions"""
-        db = SessionLocal()
-        try:
-            now = datetime.utcnow()
-            # Only expire sessions that are at least 5 seconds old and truly expired
-            # This prevents immediate expiration of new sessions
-            expired = db.query(Session).filter(
-                Session.expires_at < now,
-                Session.status != "expired",
-                Session.status != "terminated",
-                Session.created_at < now - timedelta(seconds=5)  # Only expire sessions older than 5 seconds
-            ).all()
-
-            for session in expired:
-                logger.info(f"Session {session.id} expired")
-                session.status = "expired"
-                session.link_active = False
-                
-                # Trigger callbacks
-                if session.id in self.callbacks:
-                    for callback in self.callbacks[session.id]:
-                        try:
-                            callback(session.id)
-                        except Exception as e:
-                            logger.error(f"Callback error for session {session.id}: {e}")
-                    del self.callbacks[session.id]
-
-            db.commit()
-            
+                logger.error("Error loading pending sessions: %s", e)
+
+    async def _on_due(self, session_ids: List[str]):
+        """Mark a batch of due sessions expired, then notify callbacks and sockets.
+
+        Only the sessions this call actually expired are notified. A deadline
+        moved by another worker (extend) leaves a stale entry in this worker's
+        heap; it fires here but matches no row and does nothing.
+        """
+        EXPIRY_LAG.observe(self.scheduler.last_lag)
+        with EXPIRY_RUN.time("scheduled"):
+            expired = await self._mark_expired(session_ids)
             if expired:
-                logger.info(f"Marked {len(expired)} sessions as expired")
-                
-        except Exception as e:
-            logger.error(f"Error cleaning up expired sessions: {e}")
-            db.rollback()
-        finally:
-            db.close()
-
-    def get_time_left(self, session_id: str) -> int:
+                await self._notify_expired(expired)
+
+    async def _on_warning(self, session_ids: List[str]):
+        """Tell participants their session is about to expire.
+
+        The deadline is read back from the DB, since another worker may have
+        extended the session after this one scheduled the warning.
+        """
+        if not self.manager:
+            return
+        deadlines = {}
+        async with SessionLocal() as db:
+            try:
+                for i in range(0, len(session_ids), self.UPDATE_CHUNK):
+                    rows = await db.execute(
+                        select(Session.id, Session.expires_at).where(
+                            Session.id.in_(session_ids[i:i + self.UPDATE_CHUNK]),
+                            Session.status.in_(LIVE_STATUSES)
+                        )
+                    )
+                    deadlines.update(rows.all())
+            except Exception as e:
+                logger.error("Error reading session deadlines: %s", e)
+                return
+        now = datetime.utcnow()
+        # The warning scheduler fires up to its batch window early
+        horizon = self.warning + timedelta(seconds=self.warnings.BATCH_WINDOW)
+        events = [
+            self.manager.publish_event(
+                session_id, "expiring_soon", time_left=max(0, int((expires_at - now).total_seconds()))
+            )
+            for session_id, expires_at in deadlines.items()
+            if expires_at - now <= horizon
+        ]
+        await asyncio.gather(*events, return_exceptions=True)
+
+    async def _notify_expired(self, session_ids: List[str]):
+        if self.session_cache is not None:
+            for session_id in session_ids:
+                self.session_cache.invalidate(session_id)
+        if self.manager:
+            # Workers without sockets in these sessions get no TERMINATE but may cache them
+            await self.manager.invalidate_sessions(session_ids)
+
+        for session_id in session_ids:
+            logger.info("Session %s expired", session_id)
+            for callback in self.callbacks.pop(session_id, []):
+                try:
+                    result = callback(session_id)
+                    if asyncio.iscoroutine(result):
+                        await result
+                except Exception as e:
+                    logger.error("Callback error for session %s: %s", session_id, e)
+
+        if self.manager:
+            await asyncio.gather(
+                *(self.manager.terminate_session(session_id, reason="session_expired")
+                  for session_id in session_ids),
+                return_exceptions=True
+            )
+
+    async def _mark_expired(self, session_ids: List[str]) -> List[str]:
+        """Expire the sessions whose deadline in the DB has passed; returns their ids"""
+        # The scheduler fires deadlines up to its batch window early
+        cutoff = datetime.utcnow() + timedelta(seconds=self.scheduler.BATCH_WINDOW)
+        expired: List[str] = []
+        async with SessionLocal() as db:
+            try:
+                for i in range(0, len(session_ids), self.UPDATE_CHUNK):
+                    result = await db.execute(
+                        update(Session)
+                        .where(
+                            Session.id.in_(session_ids[i:i + self.UPDATE_CHUNK]),
+                            Session.status.in_(LIVE_STATUSES),
+                            Session.expires_at <= cutoff
+                        )
+                        .values(status="expired", link_active=False)
+                        .returning(Session.id)
+                    )
+                    expired.extend(result.scalars())
+                await db.commit()
+            except Exception as e:
+                logger.error("Error marking sessions expired: %s", e)
+                await db.rollback()
+                return []
+        return expired
+
+    async def sweep(self) -> int:
+        """Expire every overdue live session with one indexed UPDATE"""
+        started = time.perf_counter()
+        async with SessionLocal() as db:
+            try:
+                result = await db.execute(
+                    update(Session)
+                    .where(
+                        Session.status.in_(LIVE_STATUSES),
+                        Session.expires_at < datetime.utcnow()
+                    )
+                    .values(status="expired", link_active=False)
+                    .returning(Session.id)
+                )
+                session_ids = list(result.scalars())
+                await db.commit()
+            except Exception as e:
+                logger.error("Error sweeping expired sessions: %s", e)
+                await db.rollback()
+                return 0
+
+        if session_ids:
+            for session_id in session_ids:
+                self.scheduler.cancel(session_id)
+                self.warnings.cancel(session_id)
+            await self._notify_expired(session_ids)
+            elapsed = time.perf_counter() - started
+            EXPIRY_RUN.observe(elapsed, "sweep")
+            logger.info("Marked %s sessions as expired in %.1fms", len(session_ids), elapsed * 1000)
+        return len(session_ids)
+
+    async def purge_retention(self) -> int:
+        """Delete dead rows past the retention horizon, a small batch per statement"""
+        cutoff = datetime.utcnow() - self.retention
+        purged = 0
+        while self.running:
+            async with SessionLocal() as db:
+                try:
+                    batch = (
+                        select(Session.id)
+                        .where(Session.status.in_(DEAD_STATUSES), Session.expires_at < cutoff)
+                        .limit(self.retention_batch)
+                        .scalar_subquery()
+                    )
+                    result = await db.execute(delete(Session).where(Session.id.in_(batch)))
+                    await db.commit()
+                except Exception as e:
+                    logger.error("Error purging old sessions: %s", e)
+                    await db.rollback()
+                    break
+            deleted = result.rowcount or 0
+            purged += deleted
+            if deleted < self.retention_batch:
+                break
+            # Let other work run between batches
+            await asyncio.sleep(0)
+
+        if purged:
+            logger.info("Purged %s sessions older than %s", purged, self.retention)
+        return purged
+
+    async def _maintenance(self):
+        last_purge = 0.0
+        while self.running:
+            await asyncio.sleep(self.sweep_interval)
+            await self.sweep()
+            if time.monotonic() - last_purge >= self.retention_interval:
+                last_purge = time.monotonic()
+                await self.purge_retention()
+
+    async def get_time_left(self, session_id: str) -> int:
         """Get time left for a session in seconds"""
-        db = SessionLocal()
-        try:
-            session = db.query(Session).filter(Session.id == session_id).first()
+        async with SessionLocal() as db:
+            session = await db.get(Session, session_id)
             if not session:
                 return 0
             return session.time_left()
-        finally:
-            db.close()
@@ -0,0 +1,83 @@
+import asyncio
+import logging
+import os
+import time
+from typing import List, Optional, Set
+
+from utils.logging_setup import Sampler
+from utils.serialization import PING_FRAME
+
+logger = logging.getLogger(__name__)
+
+HEARTBEAT_INTERVAL = float(os.getenv("HEARTBEAT_INTERVAL", "25"))
+# Connections silent for longer than this are considered dead and reaped
+HEARTBEAT_TIMEOUT = float(os.getenv("HEARTBEAT_TIMEOUT", "75"))
+HEARTBEAT_BUCKETS = int(os.getenv("HEARTBEAT_BUCKETS", "25"))
+
+# One in N bucket sweeps is logged at debug level
+HEARTBEAT_LOG_SAMPLE = int(os.getenv("HEARTBEAT_LOG_SAMPLE", "100"))
+
+class HeartbeatService:
+    """One loop that pings every connection and reaps the silent ones.
+
+    Connections are spread round-robin over ``buckets`` sets and the loop visits
+    one bucket per ``interval / buckets`` seconds, so each connection is checked
+    once per interval without a task of its own.
+    """
+
+    def __init__(self, manager, interval: float = HEARTBEAT_INTERVAL,
+                 timeout: float = HEARTBEAT_TIMEOUT, buckets: int = HEARTBEAT_BUCKETS):
+        self.manager = manager
+        self.interval = interval
+        self.timeout = timeout
+        self.buckets: List[Set] = [set() for _ in range(max(1, buckets))]
+        self._next_bucket = 0
+        self.task: Optional[asyncio.Task] = None
+        self.reaped_count = 0
+        self._log_sampler = Sampler(HEARTBEAT_LOG_SAMPLE)
+
+    def start(self):
+        self.task = asyncio.create_task(self._run())
+        logger.info("Heartbeat started (interval: %ss, timeout: %ss)", self.interval, self.timeout)
+
+    def stop(self):
+        if self.task:
+            self.task.cancel()
+            self.task = None
+
+    def add(self, conn):
+        conn.bucket = self._next_bucket
+        self.buckets[conn.bucket].add(conn)
+        self._next_bucket = (self._next_bucket + 1) % len(self.buckets)
+
+    def remove(self, conn):
+        self.buckets[conn.bucket].discard(conn)
+
+    async def _run(self):
+        step = self.interval / len(self.buckets)
+        index = 0
+        while True:
+            await asyncio.sleep(step)
+            try:
+                self.sweep(index)
+            except Exception as e:
+                logger.error("Heartbeat sweep error: %s", e)
+            index = (index + 1) % len(self.buckets)
+
+    def sweep(self, index: int):
+        """Ping live connections in one bucket and reap the ones past the deadline"""
+        deadline = time.monotonic() - self.timeout
+        reaped = 0
+        bucket = list(self.buckets[index])
+        for conn in bucket:
+            if conn.last_seen < deadline:
+                reaped += 1
+                logger.debug("Reaping idle connection in session %s", conn.session_id)
+                self.manager.reap(conn)
+            else:
+                self.manager.offer(conn, PING_FRAME)
+        self.reaped_count += reaped
+        if reaped:
+            logger.info("Reaped %s idle connections in heartbeat bucket %s", reaped, index)
+        elif logger.isEnabledFor(logging.DEBUG) and self._log_sampler.hit():
+            logger.debug("Pinged %s connections in heartbeat bucket %s", len(bucket), index)
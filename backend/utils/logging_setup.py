@@ -0,0 +1,86 @@
+import atexit
+import json
+import logging
+import os
+import queue
+import sys
+from logging.handlers import QueueHandler, QueueListener
+from typing import Optional
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+# "text" for humans, "json" for one structured object per line
+LOG_FORMAT = os.getenv("LOG_FORMAT", "text")
+# One in N relayed frames is logged at debug level
+RELAY_LOG_SAMPLE = int(os.getenv("RELAY_LOG_SAMPLE", "1000"))
+
+# Attributes every LogRecord has; anything else came in through ``extra``
+_RECORD_FIELDS = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime"}
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": self.formatTime(record, "%Y-%m-%dT%H:%M:%S"),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        for key, value in record.__dict__.items():
+            if key not in _RECORD_FIELDS:
+                entry[key] = value
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+class _DeferredQueueHandler(QueueHandler):
+    """Hands the record over untouched so formatting happens on the listener thread.
+
+    The stock handler formats in ``prepare`` to make records picklable, which is
+    not needed for an in-process queue. Callers must pass immutable arguments.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+class Sampler:
+    """Lets one in ``every`` events through"""
+
+    __slots__ = ("every", "count")
+
+    def __init__(self, every: int):
+        self.every = max(1, every)
+        self.count = 0
+
+    def hit(self) -> bool:
+        self.count += 1
+        return self.count % self.every == 0
+
+_listener: Optional[QueueListener] = None
+
+def setup_logging(level: str = LOG_LEVEL, fmt: str = LOG_FORMAT) -> QueueListener:
+    """Route the root logger through a queue drained by a background thread.
+
+    Log calls on the event loop only append to the queue; the stderr writes
+    happen on the listener thread, so a slow terminal or pipe never stalls a socket.
+    """
+    global _listener
+    if _listener is not None:
+        return _listener
+
+    output = logging.StreamHandler(sys.stderr)
+    if fmt == "json":
+        output.setFormatter(JsonFormatter())
+    else:
+        output.setFormatter(logging.Formatter("%(levelname)s:%(name)s:%(message)s"))
+
+    log_queue: queue.SimpleQueue = queue.SimpleQueue()
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(_DeferredQueueHandler(log_queue))
+    root.setLevel(level)
+
+    _listener = QueueListener(log_queue, output, respect_handler_level=True)
+    _listener.start()
+    # Flush what is still queued when the process exits
+    atexit.register(_listener.stop)
+    return _listener
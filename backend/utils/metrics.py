@@ -0,0 +1,152 @@
+import time
+from bisect import bisect_left
+from contextvars import ContextVar
+from typing import Callable, Dict, List, Sequence, Tuple
+
+from sqlalchemy import event
+
+# Seconds; covers sub-millisecond relays up to multi-second DB stalls
+LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025,
+                   0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+# Name of the endpoint whose DB statements are being timed
+db_endpoint: ContextVar[str] = ContextVar("db_endpoint", default="background")
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{value}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+class Histogram:
+    """Cumulative histogram over fixed buckets.
+
+    Each label set owns a preallocated count list, so observing is a bisect and
+    three in-place additions with no allocation on the hot path.
+    """
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._series: Dict[Tuple[str, ...], list] = {}
+
+    def _series_for(self, labels: Tuple[str, ...]) -> list:
+        series = self._series.get(labels)
+        if series is None:
+            # Per-bucket counts plus +Inf, then sum
+            series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+        return series
+
+    def observe(self, value: float, *labels: str):
+        series = self._series.get(labels) or self._series_for(labels)
+        series[0][bisect_left(self.buckets, value)] += 1
+        series[1] += value
+
+    def time(self, *labels: str) -> "_Timer":
+        return _Timer(self, labels)
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        for labels, (counts, total) in sorted(self._series.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = 'le="+Inf"' if bound == float("inf") else f'le="{bound}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, labels, le)} {cumulative}")
+            label_text = _format_labels(self.labelnames, labels)
+            lines.append(f"{self.name}_sum{label_text} {total}")
+            lines.append(f"{self.name}_count{label_text} {cumulative}")
+        return lines
+
+class _Timer:
+    __slots__ = ("histogram", "labels", "started")
+
+    def __init__(self, histogram: Histogram, labels: Tuple[str, ...]):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.started, *self.labels)
+
+class CallbackMetric:
+    """Gauge or counter read from live state when scraped, so it costs nothing in between"""
+
+    def __init__(self, name: str, documentation: str, read: Callable[[], float], kind: str = "gauge"):
+        self.name = name
+        self.documentation = documentation
+        self.read = read
+        self.kind = kind
+
+    def render(self) -> List[str]:
+        try:
+            value = self.read()
+        except Exception:
+            return []
+        if value is None:
+            return []
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}",
+                f"{self.name} {value}"]
+
+class Registry:
+    def __init__(self):
+        self.metrics: Dict[str, object] = {}
+
+    def register(self, metric):
+        self.metrics[metric.name] = metric
+        return metric
+
+    def gauge(self, name: str, documentation: str, read: Callable[[], float]):
+        return self.register(CallbackMetric(name, documentation, read))
+
+    def counter_from(self, name: str, documentation: str, read: Callable[[], float]):
+        return self.register(CallbackMetric(name, documentation, read, kind="counter"))
+
+    def render(self) -> str:
+        lines: List[str] = []
+        for metric in self.metrics.values():
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+REGISTRY = Registry()
+
+RELAY_LATENCY = REGISTRY.register(Histogram(
+    "dispozhe_relay_seconds",
+    "Time from receiving a frame to queueing it for every peer and publishing it"))
+BROADCAST_FANOUT = REGISTRY.register(Histogram(
+    "dispozhe_broadcast_fanout_seconds",
+    "Time to queue one frame for every local peer of a session"))
+SOCKET_SEND = REGISTRY.register(Histogram(
+    "dispozhe_socket_send_seconds",
+    "Time spent writing one frame to a socket"))
+DB_QUERY = REGISTRY.register(Histogram(
+    "dispozhe_db_query_seconds",
+    "Duration of DB statements by endpoint", labelnames=("endpoint",)))
+EXPIRY_RUN = REGISTRY.register(Histogram(
+    "dispozhe_expiry_run_seconds",
+    "Duration of scheduled expiry batches and safety-net sweeps", labelnames=("kind",)))
+EXPIRY_LAG = REGISTRY.register(Histogram(
+    "dispozhe_expiry_lag_seconds",
+    "How late scheduled expiries fired after their deadline"))
+
+def instrument_engine(engine):
+    """Time every statement on ``engine``, labelled with the current ``db_endpoint``"""
+    @event.listens_for(engine.sync_engine, "before_cursor_execute")
+    def _before(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+    @event.listens_for(engine.sync_engine, "after_cursor_execute")
+    def _after(conn, cursor, statement, parameters, context, executemany):
+        started = conn.info["query_started"].pop()
+        DB_QUERY.observe(time.perf_counter() - started, db_endpoint.get())
+
+    @event.listens_for(engine.sync_engine, "handle_error")
+    def _error(context):
+        if context.connection is not None and context.connection.info.get("query_started"):
+            context.connection.info["query_started"].pop()
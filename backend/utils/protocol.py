@@ -0,0 +1,5 @@
+# Wire-level names shared by the server and its clients. Import-free, so
+# client tools such as the load generator can use them without the server.
+
+# Clients offering this subprotocol relay raw ciphertext in binary frames
+BINARY_SUBPROTOCOL = "dispozhe.binary.v1"
@@ -0,0 +1,187 @@
+import os
+import re
+import struct
+from collections import OrderedDict, deque
+from itertools import islice
+from typing import Deque, Iterable, Iterator, List, Optional, Tuple, Union
+
+from utils.serialization import dumps
+
+# Most recent frames kept per session for reconnecting clients
+REPLAY_FRAMES = int(os.getenv("REPLAY_FRAMES", "256"))
+REPLAY_SESSION_BYTES = int(os.getenv("REPLAY_SESSION_BYTES", str(1024 * 1024)))
+# Ceiling across all sessions; the least recently active sessions give way first
+REPLAY_TOTAL_BYTES = int(os.getenv("REPLAY_TOTAL_BYTES", str(64 * 1024 * 1024)))
+
+# Text frame types worth replaying; everything else a client relays (ping, pong,
+# typing, read receipts) is transient and passed through unrecorded
+REPLAY_TYPES = frozenset(os.getenv("REPLAY_TYPES", "message,file").split(","))
+
+Frame = Union[str, bytes]
+
+_SEQ_HEADER = struct.Struct(">Q")
+# Clients write the type first, so the type is read without decoding the frame
+_TYPE_PREFIX = re.compile(r'\{\s*"type"\s*:\s*"([^"]*)"')
+
+def replayable(frame: Frame) -> bool:
+    """Whether a relayed frame belongs in the replay buffer.
+
+    Binary frames are always ciphertext. Text frames are kept if their type is
+    in REPLAY_TYPES, or if they do not start with a type at all.
+    """
+    if isinstance(frame, bytes):
+        return True
+    match = _TYPE_PREFIX.match(frame, 0, 256)
+    return match is None or match.group(1) in REPLAY_TYPES
+
+def frame_size(frame: Frame) -> int:
+    """Encoded size in bytes, which is what the byte caps count"""
+    if isinstance(frame, bytes) or frame.isascii():
+        return len(frame)
+    return len(frame.encode())
+
+def stamp(seq: int, frame: Frame) -> Frame:
+    """Wrap a relayed frame for a sequenced socket.
+
+    Binary frames get an 8-byte big-endian sequence prefix; text frames become
+    ``{"type": "message", "seq": n, "data": frame}``.
+    """
+    if isinstance(frame, bytes):
+        return _SEQ_HEADER.pack(seq) + frame
+    return dumps({"type": "message", "seq": seq, "data": frame})
+
+class ReplayRing:
+    __slots__ = ("frames", "bytes", "last_seq", "gap")
+
+    def __init__(self):
+        # (seq, frame, origin client id, encoded size)
+        self.frames: Deque[Tuple[int, Frame, Optional[str], int]] = deque()
+        self.bytes = 0
+        self.last_seq = 0
+        # Recording stopped after this seq for a while (e.g. a restart), so frames
+        # relayed in between were never numbered; -1 if recording never stopped
+        self.gap = -1
+
+class ReplayBuffer:
+    """Recent relayed frames per session, numbered so a client can ask for the gap.
+
+    Sequence numbers are assigned by each worker on its own, so a client has to
+    reconnect to the same worker to replay. A worker records every frame of a
+    session from the moment one of its sockets joins (``track``) until the
+    session ends, whether or not it still has sockets in it.
+    """
+
+    def __init__(self, max_frames: int = REPLAY_FRAMES, session_bytes: int = REPLAY_SESSION_BYTES,
+                 total_bytes: int = REPLAY_TOTAL_BYTES):
+        self.max_frames = max_frames
+        self.session_bytes = session_bytes
+        self.total_bytes = total_bytes
+        self.bytes = 0
+        self.evicted_frames = 0
+        self._rings: "OrderedDict[str, ReplayRing]" = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._rings)
+
+    def __contains__(self, session_id: str) -> bool:
+        return session_id in self._rings
+
+    def track(self, session_id: str):
+        """Start recording a session, so frames relayed while its sockets are away are kept"""
+        if session_id not in self._rings:
+            self._rings[session_id] = ReplayRing()
+
+    def last_seq(self, session_id: str) -> int:
+        ring = self._rings.get(session_id)
+        return ring.last_seq if ring else 0
+
+    def append(self, session_id: str, frame: Frame, origin: Optional[str] = None) -> int:
+        """Record a frame and return its sequence number"""
+        ring = self._rings.get(session_id)
+        if ring is None:
+            ring = self._rings[session_id] = ReplayRing()
+        else:
+            self._rings.move_to_end(session_id)
+        ring.last_seq += 1
+        size = frame_size(frame)
+        ring.frames.append((ring.last_seq, frame, origin, size))
+        ring.bytes += size
+        self.bytes += size
+
+        while ring.frames and (len(ring.frames) > self.max_frames or ring.bytes > self.session_bytes):
+            self._pop_oldest(ring)
+        if self.bytes > self.total_bytes:
+            self._enforce_ceiling()
+        return ring.last_seq
+
+    def since(self, session_id: str, last_seq: int,
+              client_id: Optional[str] = None) -> Tuple[List[Tuple[int, Frame]], bool]:
+        """Frames after ``last_seq``, skipping the client's own.
+
+        The flag is True only if the ring provably holds every frame after
+        ``last_seq``: none were evicted, recording did not stop after it, and
+        ``last_seq`` is one this ring issued.
+        """
+        ring = self._rings.get(session_id)
+        if ring is None:
+            return [], last_seq == 0
+        if last_seq >= ring.last_seq:
+            # Ahead of the ring means the seq came from another worker or an earlier process
+            return [], last_seq == ring.last_seq and last_seq > ring.gap
+        frames = ring.frames
+        complete = bool(frames) and frames[0][0] <= last_seq + 1 and last_seq > ring.gap
+        # Sequence numbers are contiguous, so the start is a direct offset
+        start = max(0, last_seq + 1 - frames[0][0]) if frames else 0
+        gap = [
+            (seq, frame) for seq, frame, origin, _ in islice(frames, start, None)
+            if client_id is None or origin != client_id
+        ]
+        return gap, complete
+
+    def export(self) -> Iterator[Tuple[str, ReplayRing]]:
+        """Every ring, least recently active first, for a snapshot"""
+        return iter(list(self._rings.items()))
+
+    def restore_ring(self, session_id: str, last_seq: int,
+                     frames: Iterable[Tuple[int, Frame, Optional[str]]]):
+        """Load a ring from a snapshot; the caps apply as if the frames had just arrived.
+
+        Frames relayed while the process was down were never recorded, so the
+        ring cannot vouch for anything at or before ``last_seq``.
+        """
+        self.drop(session_id)
+        ring = self._rings[session_id] = ReplayRing()
+        ring.last_seq = last_seq
+        ring.gap = last_seq
+        for seq, frame, origin in frames:
+            size = frame_size(frame)
+            ring.frames.append((seq, frame, origin, size))
+            ring.bytes += size
+        self.bytes += ring.bytes
+        while ring.frames and (len(ring.frames) > self.max_frames or ring.bytes > self.session_bytes):
+            self._pop_oldest(ring)
+        if self.bytes > self.total_bytes:
+            self._enforce_ceiling()
+
+    def drop(self, session_id: str):
+        """Free a session's frames, on terminate or expiry"""
+        ring = self._rings.pop(session_id, None)
+        if ring is not None:
+            self.bytes -= ring.bytes
+
+    def _pop_oldest(self, ring: ReplayRing):
+        size = ring.frames.popleft()[3]
+        ring.bytes -= size
+        self.bytes -= size
+        self.evicted_frames += 1
+
+    def _enforce_ceiling(self):
+        for session_id in list(self._rings):
+            if self.bytes <= self.total_bytes:
+                return
+            ring = self._rings[session_id]
+            while ring.frames and self.bytes > self.total_bytes:
+                self._pop_oldest(ring)
+            if not ring.frames:
+                # Keep the sequence position so later frames keep counting up
+                self._rings.move_to_end(session_id)
@@ -0,0 +1,197 @@
+import asyncio
+import logging
+import os
+from collections import deque
+from typing import Any, Callable, Deque, Optional, Tuple
+from urllib.parse import urlparse
+
+logger = logging.getLogger(__name__)
+
+CONNECT_TIMEOUT = float(os.getenv("REDIS_CONNECT_TIMEOUT", "5"))
+# Backoff between attempts to reopen a lost connection
+RECONNECT_MIN_DELAY = 0.1
+RECONNECT_MAX_DELAY = float(os.getenv("REDIS_RECONNECT_MAX_DELAY", "5"))
+
+class RespError(Exception):
+    pass
+
+def encode_command(*args) -> bytes:
+    """Encode a command as a RESP array of bulk strings"""
+    out = [b"*%d\r\n" % len(args)]
+    for arg in args:
+        if isinstance(arg, str):
+            arg = arg.encode()
+        elif isinstance(arg, (int, float)):
+            arg = str(arg).encode()
+        elif isinstance(arg, memoryview):
+            arg = arg.tobytes()
+        out.append(b"$%d\r\n" % len(arg))
+        out.append(arg)
+        out.append(b"\r\n")
+    return b"".join(out)
+
+async def read_reply(reader: asyncio.StreamReader) -> Any:
+    line = await reader.readline()
+    if not line:
+        raise ConnectionError("Connection closed by server")
+    prefix, body = line[:1], line[1:-2]
+    if prefix == b"+":
+        return body.decode()
+    if prefix == b"-":
+        return RespError(body.decode())
+    if prefix == b":":
+        return int(body)
+    if prefix == b"$":
+        length = int(body)
+        if length < 0:
+            return None
+        data = await reader.readexactly(length + 2)
+        return data[:-2]
+    if prefix == b"*":
+        length = int(body)
+        if length < 0:
+            return None
+        return [await read_reply(reader) for _ in range(length)]
+    raise RespError(f"Unexpected reply prefix {prefix!r}")
+
+def parse_redis_url(url: str) -> Tuple[str, int, int, Optional[str]]:
+    parsed = urlparse(url)
+    db = int(parsed.path.lstrip("/") or 0)
+    return parsed.hostname or "localhost", parsed.port or 6379, db, parsed.password
+
+class RespClient:
+    """Minimal pipelined client for the Redis protocol.
+
+    Replies are matched to commands in FIFO order. When ``on_push`` is set the
+    connection is in pub/sub mode and every reply is handed to that callback
+    instead.
+
+    Once connected, a lost connection fails every pending command with
+    ConnectionError and is reopened in the background with exponential
+    backoff; ``send`` raises ConnectionError until then. ``on_reconnect`` runs
+    after each reopen, e.g. to restore subscriptions.
+    """
+
+    def __init__(self, url: str, on_push: Optional[Callable[[list], None]] = None,
+                 on_reconnect: Optional[Callable[[], None]] = None):
+        self.url = url
+        self.on_push = on_push
+        self.on_reconnect = on_reconnect
+        self.reader: Optional[asyncio.StreamReader] = None
+        self.writer: Optional[asyncio.StreamWriter] = None
+        self.connected = False
+        self.closed = False
+        self.reconnects = 0
+        self._waiters: Deque[asyncio.Future] = deque()
+        self._reader_task: Optional[asyncio.Task] = None
+        self._reconnect_task: Optional[asyncio.Task] = None
+
+    async def connect(self):
+        await self._open()
+
+    async def _open(self):
+        host, port, db, password = parse_redis_url(self.url)
+        ssl = True if self.url.startswith("rediss://") else None
+        reader, writer = await asyncio.wait_for(asyncio.open_connection(host, port, ssl=ssl), CONNECT_TIMEOUT)
+        try:
+            # Answered before the read loop starts, so no waiter is involved
+            handshake = ([("AUTH", password)] if password else []) + ([("SELECT", db)] if db else [])
+            for command in handshake:
+                writer.write(encode_command(*command))
+                reply = await asyncio.wait_for(read_reply(reader), CONNECT_TIMEOUT)
+                if isinstance(reply, RespError):
+                    raise reply
+        except BaseException:
+            writer.close()
+            raise
+        self.reader, self.writer = reader, writer
+        self.connected = True
+        self._reader_task = asyncio.create_task(self._read_loop())
+
+    def send(self, *args, discard: bool = False) -> Optional[asyncio.Future]:
+        """Write a command without waiting for its reply"""
+        if not self.connected:
+            raise ConnectionError("Redis connection lost")
+        self.writer.write(encode_command(*args))
+        if self.on_push is not None:
+            return None
+        if discard:
+            self._waiters.append(None)
+            return None
+        future = asyncio.get_running_loop().create_future()
+        self._waiters.append(future)
+        return future
+
+    async def execute(self, *args) -> Any:
+        reply = await self.send(*args)
+        if isinstance(reply, RespError):
+            raise reply
+        return reply
+
+    async def drain(self):
+        if not self.connected:
+            raise ConnectionError("Redis connection lost")
+        await self.writer.drain()
+
+    async def _read_loop(self):
+        try:
+            while True:
+                reply = await read_reply(self.reader)
+                if self.on_push is not None:
+                    try:
+                        self.on_push(reply)
+                    except Exception as e:
+                        logger.error("Pub/sub handler error: %s", e)
+                elif self._waiters:
+                    future = self._waiters.popleft()
+                    if future is not None and not future.done():
+                        future.set_result(reply)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.warning("Redis connection lost: %s", e)
+        finally:
+            self._connection_lost()
+
+    def _connection_lost(self):
+        self.connected = False
+        if self.writer:
+            self.writer.close()
+        while self._waiters:
+            future = self._waiters.popleft()
+            if future is not None and not future.done():
+                future.set_exception(ConnectionError("Redis connection lost"))
+        if not self.closed and self._reconnect_task is None:
+            self._reconnect_task = asyncio.create_task(self._reconnect())
+
+    async def _reconnect(self):
+        delay = RECONNECT_MIN_DELAY
+        try:
+            while not self.closed:
+                await asyncio.sleep(delay)
+                try:
+                    await self._open()
+                except Exception as e:
+                    delay = min(delay * 2, RECONNECT_MAX_DELAY)
+                    logger.warning("Redis reconnect failed, retrying in %.1fs: %s", delay, e)
+                    continue
+                self.reconnects += 1
+                logger.info("Redis connection restored")
+                if self.on_reconnect is not None:
+                    try:
+                        self.on_reconnect()
+                    except Exception as e:
+                        logger.error("Redis reconnect handler error: %s", e)
+                return
+        finally:
+            self._reconnect_task = None
+
+    async def close(self):
+        self.closed = True
+        if self._reconnect_task:
+            self._reconnect_task.cancel()
+        if self._reader_task:
+            self._reader_task.cancel()
+        if self.writer:
+            self.writer.close()
+        self.connected = False
@@ -0,0 +1,150 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+from datetime import datetime, timezone
+from typing import Any, Awaitable, Callable, Dict, Hashable, List, Optional
+
+logger = logging.getLogger(__name__)
+
+DueHandler = Callable[[List[Hashable]], Optional[Awaitable[Any]]]
+
+
+def to_timestamp(when: datetime) -> float:
+    """Convert a naive UTC datetime (as stored in the DB) to an epoch timestamp"""
+    if when.tzinfo is None:
+        when = when.replace(tzinfo=timezone.utc)
+    return when.timestamp()
+
+
+class DeadlineScheduler:
+    """Fires keys at their deadline from a single heap inside the event loop.
+
+    There is exactly one pending ``TimerHandle`` for the whole scheduler, armed
+    for the earliest deadline. Scheduling and cancelling are O(log n) and O(1);
+    cancelled or rescheduled entries are dropped lazily when they reach the top
+    of the heap, and the heap is compacted when stale entries dominate it.
+    """
+
+    # Deadlines closer together than this are delivered in the same batch
+    BATCH_WINDOW = 0.005
+
+    def __init__(self, on_due: DueHandler):
+        self.on_due = on_due
+        self._heap: List[list] = []
+        self._entries: Dict[Hashable, list] = {}
+        self._counter = itertools.count()
+        self._handle: Optional[asyncio.TimerHandle] = None
+        self._handle_when: Optional[float] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._pending: set = set()
+        self.fired = 0
+        self.last_lag = 0.0
+
+    def start(self, loop: Optional[asyncio.AbstractEventLoop] = None):
+        """Bind the scheduler to the running event loop"""
+        self._loop = loop or asyncio.get_running_loop()
+        self._arm()
+
+    def stop(self):
+        """Stop firing; pending deadlines are kept so the scheduler can be restarted"""
+        if self._handle:
+            self._handle.cancel()
+        self._handle = None
+        self._handle_when = None
+        for task in list(self._pending):
+            task.cancel()
+        self._loop = None
+
+    @property
+    def running(self) -> bool:
+        return self._loop is not None
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._entries
+
+    def schedule(self, key: Hashable, deadline: float):
+        """Schedule (or reschedule) ``key`` to fire at epoch timestamp ``deadline``"""
+        old = self._entries.get(key)
+        if old is not None:
+            old[2] = None
+        entry = [deadline, next(self._counter), key]
+        self._entries[key] = entry
+        heapq.heappush(self._heap, entry)
+        if self._handle_when is None or deadline < self._handle_when:
+            self._arm()
+
+    def schedule_at(self, key: Hashable, when: datetime):
+        self.schedule(key, to_timestamp(when))
+
+    def cancel(self, key: Hashable) -> bool:
+        """Cancel a pending deadline, returns False if it was not scheduled"""
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return False
+        entry[2] = None
+        if len(self._heap) > 1024 and len(self._heap) > 2 * len(self._entries):
+            self._compact()
+        return True
+
+    def deadline(self, key: Hashable) -> Optional[float]:
+        entry = self._entries.get(key)
+        return entry[0] if entry else None
+
+    def _compact(self):
+        self._heap = [entry for entry in self._heap if entry[2] is not None]
+        heapq.heapify(self._heap)
+
+    def _arm(self):
+        if self._loop is None:
+            return
+        heap = self._heap
+        while heap and heap[0][2] is None:
+            heapq.heappop(heap)
+        if self._handle:
+            self._handle.cancel()
+            self._handle = None
+            self._handle_when = None
+        if not heap:
+            return
+        when = heap[0][0]
+        delay = max(0.0, when - time.time())
+        self._handle = self._loop.call_later(delay, self._fire)
+        self._handle_when = when
+
+    def _fire(self):
+        self._handle = None
+        self._handle_when = None
+        now = time.time()
+        cutoff = now + self.BATCH_WINDOW
+        heap = self._heap
+        due = []
+        while heap and heap[0][0] <= cutoff:
+            deadline, _, key = heapq.heappop(heap)
+            if key is None:
+                continue
+            del self._entries[key]
+            due.append(key)
+            self.last_lag = max(0.0, now - deadline)
+        self._arm()
+        if not due:
+            return
+        self.fired += len(due)
+        try:
+            result = self.on_due(due)
+        except Exception as e:
+            logger.error("Scheduler handler error: %s", e)
+            return
+        if asyncio.iscoroutine(result):
+            task = self._loop.create_task(result)
+            self._pending.add(task)
+            task.add_done_callback(self._on_task_done)
+
+    def _on_task_done(self, task: asyncio.Task):
+        self._pending.discard(task)
+        if not task.cancelled() and task.exception():
+            logger.error("Scheduler handler error: %s", task.exception())
@@ -0,0 +1,55 @@
+import json
+from datetime import datetime
+from typing import Any
+
+from fastapi.responses import Response
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - depends on the environment
+    orjson = None
+
+JSON_BACKEND = "orjson" if orjson is not None else "json"
+
+def _default(value: Any):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+if orjson is not None:
+    def dumps_bytes(value: Any) -> bytes:
+        return orjson.dumps(value, default=_default)
+
+    def dumps(value: Any) -> str:
+        return orjson.dumps(value, default=_default).decode()
+
+    loads = orjson.loads
+else:
+    _encode = json.JSONEncoder(default=_default, separators=(",", ":")).encode
+
+    def dumps_bytes(value: Any) -> bytes:
+        return _encode(value).encode()
+
+    def dumps(value: Any) -> str:
+        return _encode(value)
+
+    loads = json.loads
+
+class FastJSONResponse(Response):
+    """JSON response that skips FastAPI's response_model pass.
+
+    Returning a Response bypasses validation and jsonable_encoder, so handlers
+    build the payload from data that is already known to match the model.
+    """
+
+    media_type = "application/json"
+
+    def render(self, content: Any) -> bytes:
+        return dumps_bytes(content)
+
+def control_frame(frame_type: str, **fields) -> str:
+    """A timestamped WebSocket control frame"""
+    return dumps({"type": frame_type, **fields, "timestamp": datetime.utcnow().isoformat()})
+
+# Frames that never change are encoded once
+PING_FRAME = dumps({"type": "ping"})
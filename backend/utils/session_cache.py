@@ -0,0 +1,98 @@
+import logging
+from collections import OrderedDict
+from datetime import datetime
+from typing import Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+class CachedSession:
+    """Slotted snapshot of a sessions row, detached from any DB session"""
+
+    __slots__ = (
+        "id", "created_at", "expires_at", "duration_minutes",
+        "participant_count", "status", "link_active"
+    )
+
+    def __init__(self, id: str, created_at: Optional[datetime], expires_at: datetime,
+                 duration_minutes: int, participant_count: int, status: str, link_active: bool):
+        self.id = id
+        self.created_at = created_at
+        self.expires_at = expires_at
+        self.duration_minutes = duration_minutes
+        self.participant_count = participant_count
+        self.status = status
+        self.link_active = link_active
+
+    @classmethod
+    def from_row(cls, row) -> "CachedSession":
+        return cls(
+            row.id, row.created_at, row.expires_at, row.duration_minutes,
+            row.participant_count, row.status, row.link_active
+        )
+
+    def time_left(self) -> int:
+        """Calculate time left in seconds"""
+        if self.status == "terminated":
+            return 0
+        left = int((self.expires_at - datetime.utcnow()).total_seconds())
+        return left if left > 0 else 0
+
+class SessionCache:
+    """Bounded LRU of live sessions; an entry lives until its expires_at.
+
+    Each worker has its own cache. Writes made by another worker reach it as
+    broker invalidations (see ConnectionManager.invalidate_sessions).
+    """
+
+    def __init__(self, max_size: int = 100_000):
+        self.max_size = max_size
+        self._entries: "OrderedDict[str, CachedSession]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, session_id: str) -> Optional[CachedSession]:
+        entry = self._entries.get(session_id)
+        if entry is None:
+            self.misses += 1
+            return None
+        if datetime.utcnow() > entry.expires_at:
+            del self._entries[session_id]
+            self.misses += 1
+            return None
+        self._entries.move_to_end(session_id)
+        self.hits += 1
+        return entry
+
+    def put(self, session) -> CachedSession:
+        """Store a sessions row (or snapshot) and return the cached snapshot"""
+        entry = session if isinstance(session, CachedSession) else CachedSession.from_row(session)
+        self._entries[entry.id] = entry
+        self._entries.move_to_end(entry.id)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+        return entry
+
+    def update(self, session_id: str, **fields):
+        """Apply a committed write to the cached copy, if there is one"""
+        entry = self._entries.get(session_id)
+        if entry is None:
+            return
+        for name, value in fields.items():
+            setattr(entry, name, value)
+
+    def invalidate(self, session_id: str):
+        self._entries.pop(session_id, None)
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "size": len(self._entries),
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions
+        }
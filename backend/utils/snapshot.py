@@ -0,0 +1,334 @@
+import gc
+import hashlib
+import logging
+import mmap
+import os
+import struct
+import tempfile
+import stat
+import time
+from array import array
+from typing import Callable, Dict, List, Optional
+
+from models.database import DATABASE_URL
+from utils.code_generator import CodeGenerator, CodeRecord
+from utils.replay import ReplayBuffer
+
+logger = logging.getLogger(__name__)
+
+# Each worker writes its own snapshot here on graceful shutdown, and each
+# starting worker claims one to restore; empty disables. Snapshots hold join
+# codes and session keys, so the directory must belong to the service's user
+SNAPSHOT_DIR = os.getenv("RUNTIME_SNAPSHOT_DIR", os.path.join(
+    os.getenv("XDG_STATE_HOME") or os.path.join(os.path.expanduser("~"), ".local", "state"),
+    "dispozhe", "snapshots",
+))
+# runtime-<deployment id>-<pid>.snapshot
+SNAPSHOT_PREFIX = "runtime-"
+SNAPSHOT_SUFFIX = ".snapshot"
+
+MAGIC = b"DZSNAP"
+VERSION = 2
+
+# magic, version, deployment id, written at
+_HEADER = struct.Struct("=6sH16sd")
+_COUNT = struct.Struct("=I")
+# session id length, deadline (0 if unknown), last seq, frame count
+_RING = struct.Struct("=HdQI")
+# seq, is binary, origin length, frame length
+_FRAME = struct.Struct("=QBHI")
+
+class SnapshotError(Exception):
+    pass
+
+def deployment_id() -> bytes:
+    """Identifies the database and code store a snapshot's state belongs to.
+
+    Another deployment sharing the directory (or a stale snapshot from before a
+    database switch) would otherwise restore codes for sessions it never had.
+    """
+    url = DATABASE_URL
+    scheme, sep, path = url.partition(":///")
+    if sep and scheme.startswith("sqlite") and not path.startswith("/"):
+        # A relative SQLite path names a different file from every working directory
+        url = f"{scheme}:///{os.path.abspath(path)}"
+    identity = f"{url}\n{os.getenv('CODE_STORE_URL', 'memory://')}"
+    return hashlib.sha256(identity.encode()).digest()[:16]
+
+def _check_private(st: os.stat_result, what: str):
+    """Refuse anything another user owns or could have written"""
+    if st.st_uid != os.getuid():
+        raise SnapshotError(f"{what} is owned by uid {st.st_uid}, not {os.getuid()}")
+    if st.st_mode & (stat.S_IWGRP | stat.S_IWOTH):
+        raise SnapshotError(f"{what} is writable by group or others ({stat.filemode(st.st_mode)})")
+
+def _private_directory(directory: str, create: bool = False):
+    if create:
+        os.makedirs(directory, mode=0o700, exist_ok=True)
+    _check_private(os.stat(directory), directory)
+
+def _array_bytes(typecode: str, values) -> bytes:
+    return array(typecode, values).tobytes()
+
+def _encode_codes(records: List[CodeRecord]) -> List[bytes]:
+    """Columnar: fixed-width columns first, then the string blobs they index"""
+    session_ids = [record[3].encode() for record in records]
+    keys = [record[4].encode() for record in records]
+    return [
+        _COUNT.pack(len(records)),
+        _array_bytes("i", [record[0] for record in records]),
+        _array_bytes("d", [record[1] for record in records]),
+        _array_bytes("d", [record[2] for record in records]),
+        _array_bytes("H", [len(value) for value in session_ids]),
+        _array_bytes("H", [len(value) for value in keys]),
+        b"".join(session_ids),
+        b"".join(keys),
+    ]
+
+def _encode_replay(replay: ReplayBuffer, deadline_for: Callable[[str], Optional[float]]) -> List[bytes]:
+    parts = []
+    rings = list(replay.export())
+    parts.append(_COUNT.pack(len(rings)))
+    for session_id, ring in rings:
+        encoded_id = session_id.encode()
+        parts.append(_RING.pack(len(encoded_id), deadline_for(session_id) or 0.0,
+                                ring.last_seq, len(ring.frames)))
+        parts.append(encoded_id)
+        for seq, frame, origin, _ in ring.frames:
+            binary = isinstance(frame, bytes)
+            data = frame if binary else frame.encode()
+            encoded_origin = origin.encode() if origin else b""
+            parts.append(_FRAME.pack(seq, binary, len(encoded_origin), len(data)))
+            parts.append(encoded_origin)
+            parts.append(data)
+    return parts
+
+def write_snapshot(path: str, generator: Optional[CodeGenerator], replay: Optional[ReplayBuffer],
+                   deadline_for: Callable[[str], Optional[float]] = lambda session_id: None,
+                   identity: bytes = b"") -> int:
+    """Write codes and replay rings to ``path`` atomically, returns the size in bytes.
+
+    Arrays are stored in native byte order; a snapshot is only meant to be read
+    back on the host that wrote it. The file is readable by its owner only.
+    """
+    parts = [_HEADER.pack(MAGIC, VERSION, identity, time.time())]
+    parts += _encode_codes(generator.export() if generator else [])
+    parts += _encode_replay(replay, deadline_for) if replay else [_COUNT.pack(0)]
+
+    # A unique name next to the target, so concurrent writers never share one
+    fd, temporary = tempfile.mkstemp(dir=os.path.dirname(path) or ".",
+                                     prefix=os.path.basename(path) + ".", suffix=".tmp")
+    try:
+        os.fchmod(fd, 0o600)
+        with os.fdopen(fd, "wb") as f:
+            f.writelines(parts)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temporary, path)
+    except BaseException:
+        try:
+            os.remove(temporary)
+        except OSError:
+            pass
+        raise
+    return sum(len(part) for part in parts)
+
+class _Reader:
+    __slots__ = ("view", "offset")
+
+    def __init__(self, view: memoryview):
+        self.view = view
+        self.offset = 0
+
+    def take(self, size: int) -> memoryview:
+        end = self.offset + size
+        if end > len(self.view):
+            raise SnapshotError("Snapshot is truncated")
+        chunk = self.view[self.offset:end]
+        self.offset = end
+        return chunk
+
+    def unpack(self, fmt: struct.Struct) -> tuple:
+        return fmt.unpack(self.take(fmt.size))
+
+    def array(self, typecode: str, count: int) -> array:
+        values = array(typecode)
+        values.frombytes(self.take(count * values.itemsize))
+        return values
+
+def _decode_blob(chunk: memoryview):
+    """Decode a blob once if it is ASCII, so byte lengths index the string directly"""
+    data = bytes(chunk)
+    if data.isascii():
+        return data.decode()
+    # Slicing bytes and decoding per item is slower but always right
+    return _Utf8Slicer(data)
+
+class _Utf8Slicer:
+    __slots__ = ("data",)
+
+    def __init__(self, data: bytes):
+        self.data = data
+
+    def __getitem__(self, index: slice) -> str:
+        return self.data[index].decode()
+
+def _decode_codes(reader: _Reader) -> List[CodeRecord]:
+    (count,) = reader.unpack(_COUNT)
+    codes = reader.array("i", count)
+    created = reader.array("d", count)
+    expires = reader.array("d", count)
+    id_lengths = reader.array("H", count)
+    key_lengths = reader.array("H", count)
+    id_blob = _decode_blob(reader.take(sum(id_lengths)))
+    key_blob = _decode_blob(reader.take(sum(key_lengths)))
+
+    records = []
+    append = records.append
+    id_offset = key_offset = 0
+    for code, created_at, expires_at, id_length, key_length in zip(
+            codes, created, expires, id_lengths, key_lengths):
+        append((code, created_at, expires_at, id_blob[id_offset:id_offset + id_length],
+                key_blob[key_offset:key_offset + key_length]))
+        id_offset += id_length
+        key_offset += key_length
+    return records
+
+def _restore_replay(reader: _Reader, replay: Optional[ReplayBuffer], now: float) -> int:
+    (count,) = reader.unpack(_COUNT)
+    restored = 0
+    for _ in range(count):
+        id_length, deadline, last_seq, frame_count = reader.unpack(_RING)
+        session_id = bytes(reader.take(id_length)).decode()
+        frames = []
+        for _ in range(frame_count):
+            seq, binary, origin_length, frame_length = reader.unpack(_FRAME)
+            origin = bytes(reader.take(origin_length)).decode() or None
+            data = bytes(reader.take(frame_length))
+            frames.append((seq, data if binary else data.decode(), origin))
+        # Rings of sessions whose deadline passed while the process was down are dropped
+        if replay is None or (deadline and deadline <= now):
+            continue
+        replay.restore_ring(session_id, last_seq, frames)
+        restored += 1
+    return restored
+
+def restore_snapshot(path: str, generator: Optional[CodeGenerator], replay: Optional[ReplayBuffer],
+                     now: Optional[float] = None, identity: Optional[bytes] = None) -> Dict[str, int]:
+    """Load a snapshot through a read-only mmap, skipping entries expired by ``now``.
+
+    The file must be a regular file of this user's that nobody else can write,
+    and if ``identity`` is given it must have been written with the same one.
+    The file is removed afterwards, so a later crash cannot bring back codes
+    that have since been redeemed.
+    """
+    now = now if now is not None else time.time()
+    # Checked on the open file, so it cannot be swapped after the check
+    fd = os.open(path, os.O_RDONLY | getattr(os, "O_NOFOLLOW", 0))
+    with open(fd, "rb") as f:
+        st = os.fstat(f.fileno())
+        if not stat.S_ISREG(st.st_mode):
+            raise SnapshotError(f"{path} is not a regular file")
+        _check_private(st, path)
+        mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    # Restoring allocates millions of long-lived objects; collecting in the
+    # middle of that only rescans them
+    gc_was_enabled = gc.isenabled()
+    gc.disable()
+    with mapped:
+        view = memoryview(mapped)
+        try:
+            reader = _Reader(view)
+            magic, version, written_by, written_at = reader.unpack(_HEADER)
+            if magic != MAGIC or version != VERSION:
+                raise SnapshotError(f"Unsupported snapshot format {magic!r} v{version}")
+            if identity is not None and written_by != identity:
+                raise SnapshotError("Snapshot belongs to a different database or code store")
+            records = _decode_codes(reader)
+            codes = generator.restore(records, now) if generator else 0
+            rings = _restore_replay(reader, replay, now)
+        finally:
+            view.release()
+            if gc_was_enabled:
+                gc.enable()
+    os.remove(path)
+    return {"codes": codes, "codes_in_file": len(records), "replay_sessions": rings,
+            "age_seconds": int(now - written_at)}
+
+def save_runtime_state(app_state, directory: str = SNAPSHOT_DIR):
+    """Snapshot the worker's in-memory state on graceful shutdown, under a name of its own"""
+    if not directory:
+        return
+    identity = deployment_id()
+    path = os.path.join(directory, f"{SNAPSHOT_PREFIX}{identity.hex()}-{os.getpid()}{SNAPSHOT_SUFFIX}")
+    generator = getattr(app_state.code_store, "generator", None)
+    scheduler = app_state.expiry_service.scheduler
+    started = time.perf_counter()
+    try:
+        _private_directory(directory, create=True)
+        size = write_snapshot(path, generator, app_state.manager.replay, scheduler.deadline, identity)
+    except (OSError, SnapshotError) as e:
+        logger.error("Could not write runtime snapshot to %s: %s", path, e)
+        return
+    logger.info("Wrote runtime snapshot to %s (%s bytes) in %.1fms",
+                path, size, (time.perf_counter() - started) * 1000)
+
+def claim_snapshot(directory: str, identity: bytes) -> Optional[str]:
+    """Take one snapshot left by a previous worker of this deployment, newest first.
+
+    Claiming is a rename, so with several workers starting at once each
+    snapshot goes to exactly one of them.
+    """
+    prefix = f"{SNAPSHOT_PREFIX}{identity.hex()}-"
+    try:
+        names = [name for name in os.listdir(directory)
+                 if name.startswith(prefix) and name.endswith(SNAPSHOT_SUFFIX)]
+    except OSError:
+        return None
+    paths = [os.path.join(directory, name) for name in names]
+
+    def modified(path: str) -> float:
+        try:
+            return os.path.getmtime(path)
+        except OSError:
+            return 0.0
+
+    for path in sorted(paths, key=modified, reverse=True):
+        claimed = f"{path}.{os.getpid()}.restoring"
+        try:
+            os.rename(path, claimed)
+        except OSError:
+            # Another worker claimed it first
+            continue
+        return claimed
+    return None
+
+def load_runtime_state(app_state, directory: str = SNAPSHOT_DIR):
+    """Restore a snapshot left by a previous worker, if there is one"""
+    if not directory:
+        return
+    try:
+        _private_directory(directory)
+    except FileNotFoundError:
+        return
+    except (OSError, SnapshotError) as e:
+        logger.error("Not restoring runtime snapshots from %s: %s", directory, e)
+        return
+    identity = deployment_id()
+    path = claim_snapshot(directory, identity)
+    if path is None:
+        return
+    generator = getattr(app_state.code_store, "generator", None)
+    started = time.perf_counter()
+    try:
+        stats = restore_snapshot(path, generator, app_state.manager.replay, identity=identity)
+    except (OSError, ValueError, SnapshotError) as e:
+        logger.error("Discarding unreadable runtime snapshot %s: %s", path, e)
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+        return
+    # Restored rings keep recording until their sessions end
+    app_state.manager.resume_replay()
+    logger.info("Restored runtime snapshot in %.1fms: %s", (time.perf_counter() - started) * 1000, stats)
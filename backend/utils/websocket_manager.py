@@ -1,40 +1,149 @@
-from typing import Dict, Set
+from typing import Dict, Iterable, Set, Optional, Union
 from fastapi import WebSocket
 import logging
 from datetime import datetime
-import json
 import asyncio
+import os
+import time
+
+from utils.broker import Broker, InProcessBroker, MESSAGE, TERMINATE, EVENT, INVALIDATE
+from utils.heartbeat import HeartbeatService
+from utils.metrics import BROADCAST_FANOUT, SOCKET_SEND
+from utils.replay import ReplayBuffer, replayable, stamp
+from utils.serialization import control_frame
 
 logger = logging.getLogger(__name__)
 
+SEND_QUEUE_SIZE = int(os.getenv("SEND_QUEUE_SIZE", "256"))
+# What to do when a peer's send queue is full: drop, block or disconnect
+SEND_OVERFLOW_POLICY = os.getenv("SEND_OVERFLOW_POLICY", "drop")
+SEND_BLOCK_TIMEOUT = float(os.getenv("SEND_BLOCK_TIMEOUT", "2"))
+# A peer that keeps overflowing for this long under the drop policy is evicted
+SLOW_CONSUMER_TIMEOUT = float(os.getenv("SLOW_CONSUMER_TIMEOUT", "10"))
+# How long a terminated session's sockets get to flush the termination frame
+TERMINATE_DRAIN_TIMEOUT = float(os.getenv("TERMINATE_DRAIN_TIMEOUT", "2"))
+# Pending events per SSE listener before new ones are dropped
+LISTENER_QUEUE_SIZE = 64
+
+OVERFLOW_POLICIES = ("drop", "block", "disconnect")
+
+# Queued after the last frame to make the writer close the socket
+CLOSE = object()
+
+# Relay frames are forwarded in the type they arrived in: str as text, bytes as binary
+Frame = Union[str, bytes]
+
+class Connection:
+    """Outbound state of one socket: a bounded queue drained by its own writer task"""
+
+    __slots__ = ("websocket", "session_id", "queue", "writer", "overflow_since", "dropped", "last_seen", "bucket",
+                 "sequenced", "client_id")
+
+    def __init__(self, websocket: WebSocket, session_id: str, max_queue: int,
+                 sequenced: bool = False, client_id: Optional[str] = None):
+        self.websocket = websocket
+        self.session_id = session_id
+        # Sequenced sockets get relayed frames stamped with their replay sequence number
+        self.sequenced = sequenced
+        self.client_id = client_id
+        self.queue: asyncio.Queue = asyncio.Queue(max_queue)
+        self.writer: Optional[asyncio.Task] = None
+        self.overflow_since: Optional[float] = None
+        self.dropped = 0
+        self.last_seen = time.monotonic()
+        self.bucket = 0
+
 class ConnectionManager:
-    def __init__(self):
+    def __init__(self, max_queue: int = SEND_QUEUE_SIZE, overflow_policy: str = SEND_OVERFLOW_POLICY,
+                 block_timeout: float = SEND_BLOCK_TIMEOUT, slow_consumer_timeout: float = SLOW_CONSUMER_TIMEOUT,
+                 drain_timeout: float = TERMINATE_DRAIN_TIMEOUT):
+        if overflow_policy not in OVERFLOW_POLICIES:
+            raise ValueError(f"Unknown send overflow policy: {overflow_policy}")
         self.active_connections: Dict[str, Set[WebSocket]] = {}
+        self.connections: Dict[WebSocket, Connection] = {}
         self.connection_ids: Dict[WebSocket, str] = {}
         self.connection_times: Dict[WebSocket, datetime] = {}
+        # Event-stream listeners (SSE) per session, alongside the sockets
+        self.listeners: Dict[str, Set[asyncio.Queue]] = {}
         self.expiry_service = None
+        self.session_cache = None
+        self.broker: Broker = InProcessBroker()
+        self.max_queue = max_queue
+        self.overflow_policy = overflow_policy
+        self.block_timeout = block_timeout
+        self.slow_consumer_timeout = slow_consumer_timeout
+        self.drain_timeout = drain_timeout
+        self.dropped_count = 0
+        self.evicted_count = 0
+        self.send_failures = 0
+        self.heartbeat = HeartbeatService(self)
+        self.replay = ReplayBuffer()
 
     def set_expiry_service(self, expiry_service):
         self.expiry_service = expiry_service
 
-    async def connect(self, websocket: WebSocket, session_id: str):
+    def set_session_cache(self, session_cache):
+        self.session_cache = session_cache
+
+    async def start_broker(self, broker: Optional[Broker] = None):
+        """Attach the pub/sub broker that carries traffic to other workers"""
+        if broker is not None:
+            self.broker = broker
+        await self.broker.start(self._on_broker_message)
+
+    async def stop_broker(self):
+        await self.broker.close()
+
+    async def _on_broker_message(self, kind: str, session_id: str, payload):
+        if kind == MESSAGE:
+            await self._deliver_local(session_id, payload)
+        elif kind == TERMINATE:
+            self._invalidate_local((session_id,))
+            await self._terminate_local(session_id, payload)
+        elif kind == EVENT:
+            self._invalidate_local((session_id,))
+            self._deliver_event_local(session_id, payload)
+        elif kind == INVALIDATE:
+            self._invalidate_local(payload.split("\n"))
+
+    async def invalidate_sessions(self, session_ids: Iterable[str]):
+        """Drop the other workers' cached snapshots of sessions this worker just wrote"""
+        session_ids = list(session_ids)
+        if session_ids:
+            await self.broker.publish(INVALIDATE, "", "\n".join(session_ids))
+
+    def _invalidate_local(self, session_ids: Iterable[str]):
+        if self.session_cache is not None:
+            for session_id in session_ids:
+                self.session_cache.invalidate(session_id)
+
+    async def connect(self, websocket: WebSocket, session_id: str, sequenced: bool = False,
+                      client_id: Optional[str] = None) -> Optional[Connection]:
         if session_id not in self.active_connections:
             self.active_connections[session_id] = set()
+            self.broker.subscribe(session_id)
+            # Keep numbering frames while this worker's sockets are away, so they can replay
+            self.replay.track(session_id)
 
         # Check if this websocket is already connected
         if websocket in self.active_connections[session_id]:
-            logger.warning(f"Duplicate WebSocket connection detected for session {session_id}")
-            return
+            logger.warning("Duplicate WebSocket connection detected for session %s", session_id)
+            return self.connections.get(websocket)
 
         self.active_connections[session_id].add(websocket)
         self.connection_ids[websocket] = session_id
         self.connection_times[websocket] = datetime.utcnow()
-        
+        conn = Connection(websocket, session_id, self.max_queue, sequenced, client_id)
+        conn.writer = asyncio.create_task(self._writer(conn))
+        self.connections[websocket] = conn
+        self.heartbeat.add(conn)
+
         count = len(self.active_connections[session_id])
-        logger.info(f"Client connected to session {session_id}. Total: {count}")
+        logger.info("Client connected to session %s. Total: %s", session_id, count)
 
         if count == 2:
-            logger.info(f"Session {session_id} now has both participants")
+            logger.info("Session %s now has both participants", session_id)
+        return conn
 
     def disconnect(self, websocket: WebSocket, session_id: str):
         if session_id in self.active_connections:
@@ -44,34 +153,218 @@ class ConnectionManager:
                 # Calculate connection duration
                 if websocket in self.connection_times:
                     duration = (datetime.utcnow() - self.connection_times[websocket]).total_seconds()
-                    logger.info(f"Connection for session {session_id} lasted {duration:.1f} seconds")
+                    logger.info("Connection for session %s lasted %.1f seconds", session_id, duration)
                     del self.connection_times[websocket]
                 
                 if websocket in self.connection_ids:
                     del self.connection_ids[websocket]
-                    
+
+                self._release(websocket)
+
                 remaining = len(self.active_connections[session_id])
-                logger.info(f"Client disconnected from session {session_id}. Remaining: {remaining}")
+                logger.info("Client disconnected from session %s. Remaining: %s", session_id, remaining)
 
             if not self.active_connections[session_id]:
                 del self.active_connections[session_id]
-                logger.info(f"Session {session_id} has no more connections")
+                self._release_subscription(session_id)
+                logger.info("Session %s has no more connections", session_id)
 
-    async def broadcast_to_session(self, session_id: str, message: str, exclude: WebSocket = None):
-        if session_id in self.active_connections:
-            connections = list(self.active_connections[session_id])
-            dead_connections = []
+    def _release_subscription(self, session_id: str):
+        """Leave the session's broker channel once nothing here needs its traffic.
+
+        A replay ring counts: its frames have to keep arriving for the sockets
+        that will reconnect, until the session is terminated or expires.
+        """
+        if (session_id not in self.active_connections and session_id not in self.listeners
+                and session_id not in self.replay):
+            self.broker.unsubscribe(session_id)
+
+    def resume_replay(self):
+        """Subscribe to the sessions of replay rings restored from a snapshot"""
+        for session_id, _ in self.replay.export():
+            self.broker.subscribe(session_id)
+
+    def add_listener(self, session_id: str) -> asyncio.Queue:
+        """Register an event-stream listener; it receives control events and CLOSE on termination"""
+        if session_id not in self.listeners:
+            self.listeners[session_id] = set()
+            self.broker.subscribe(session_id)
+        queue: asyncio.Queue = asyncio.Queue(LISTENER_QUEUE_SIZE)
+        self.listeners[session_id].add(queue)
+        return queue
+
+    def remove_listener(self, session_id: str, queue: asyncio.Queue):
+        listeners = self.listeners.get(session_id)
+        if listeners is None:
+            return
+        listeners.discard(queue)
+        if not listeners:
+            del self.listeners[session_id]
+            self._release_subscription(session_id)
+
+    async def publish_event(self, session_id: str, event_type: str, **fields):
+        """Push a control event to every socket and listener of the session, on every worker"""
+        frame = control_frame(event_type, session_id=session_id, **fields)
+        self._deliver_event_local(session_id, frame)
+        await self.broker.publish(EVENT, session_id, frame)
+
+    def _deliver_event_local(self, session_id: str, frame: str):
+        # Events are small and never worth blocking for; a full queue just misses one
+        for websocket in self.active_connections.get(session_id, ()):
+            conn = self.connections.get(websocket)
+            if conn is not None:
+                self.offer(conn, frame)
+        for queue in self.listeners.get(session_id, ()):
+            try:
+                queue.put_nowait(frame)
+            except asyncio.QueueFull:
+                pass
+
+    async def broadcast_to_session(self, session_id: str, message: Frame, exclude: WebSocket = None):
+        sender = self.connections.get(exclude) if exclude is not None else None
+        await self._deliver_local(session_id, message, exclude, sender.client_id if sender else None)
+        await self.broker.publish(MESSAGE, session_id, message)
+
+    async def _deliver_local(self, session_id: str, message: Frame, exclude: WebSocket = None,
+                             origin: Optional[str] = None):
+        """Record a frame for replay and queue it for every local peer; only the block policy ever waits here.
+
+        Frames are recorded for every session this worker tracks, even while
+        none of its sockets are connected. Transient frames (heartbeats,
+        typing) are not recorded and reach sequenced peers unstamped, like
+        the server's own control frames.
+        """
+        if session_id in self.active_connections or session_id in self.replay:
+            started = time.perf_counter()
+            if replayable(message):
+                seq = self.replay.append(session_id, message, origin)
+                stamped = None
+            else:
+                # Sequenced peers take it as is
+                stamped = message
+            for connection in list(self.active_connections.get(session_id, ())):
+                if connection is not exclude:
+                    conn = self.connections.get(connection)
+                    if conn is not None:
+                        if conn.sequenced:
+                            # Stamped once and shared by every sequenced peer
+                            if stamped is None:
+                                stamped = stamp(seq, message)
+                            await self._enqueue(conn, stamped)
+                        else:
+                            await self._enqueue(conn, message)
+            BROADCAST_FANOUT.observe(time.perf_counter() - started)
+
+    def replay_since(self, conn: Connection, last_seq: int) -> int:
+        """Queue the frames a reconnecting socket missed after ``last_seq``.
+
+        Runs without awaiting, so nothing relayed live can overtake the replay.
+        Returns the number of frames queued.
+        """
+        frames, complete = self.replay.since(conn.session_id, last_seq, conn.client_id)
+        # Keep the newest frames that fit the send queue, leaving room for the notice
+        room = max(0, self.max_queue - conn.queue.qsize() - 1)
+        if len(frames) > room:
+            frames = frames[len(frames) - room:]
+            complete = False
+        if not complete:
+            # Older frames were evicted; the client has to resync what it lost
+            self.offer(conn, control_frame("replay_truncated", last_seq=last_seq,
+                                           first_seq=frames[0][0] if frames else None))
+        for seq, frame in frames:
+            self.offer(conn, stamp(seq, frame))
+        return len(frames)
+
+    async def send(self, websocket: WebSocket, message: Frame):
+        """Queue a frame for a single socket"""
+        conn = self.connections.get(websocket)
+        if conn is not None:
+            await self._enqueue(conn, message)
 
-            for connection in connections:
-                if connection != exclude:
-                    try:
-                        await connection.send_text(message)
-                    except Exception as e:
-                        logger.error(f"Error broadcasting to session {session_id}: {e}")
-                        dead_connections.append(connection)
+    def offer(self, conn: Connection, frame) -> bool:
+        """Queue a frame if there is room, never waiting"""
+        try:
+            conn.queue.put_nowait(frame)
+            return True
+        except asyncio.QueueFull:
+            return False
 
-            for dead in dead_connections:
-                self.disconnect(dead, session_id)
+    def reap(self, conn: Connection):
+        """Drop a connection that stopped answering heartbeats"""
+        self.disconnect(conn.websocket, conn.session_id)
+        asyncio.ensure_future(self._close_quietly(conn.websocket, code=1001))
+
+    async def _enqueue(self, conn: Connection, frame):
+        try:
+            conn.queue.put_nowait(frame)
+            conn.overflow_since = None
+            return
+        except asyncio.QueueFull:
+            pass
+
+        if self.overflow_policy == "block":
+            try:
+                await asyncio.wait_for(conn.queue.put(frame), self.block_timeout)
+            except asyncio.TimeoutError:
+                self._evict(conn, f"send queue blocked for {self.block_timeout}s")
+            return
+
+        if self.overflow_policy == "disconnect":
+            self._evict(conn, "send queue full")
+            return
+
+        conn.dropped += 1
+        self.dropped_count += 1
+        now = time.monotonic()
+        if conn.overflow_since is None:
+            conn.overflow_since = now
+        elif now - conn.overflow_since > self.slow_consumer_timeout:
+            self._evict(conn, f"send queue full for {self.slow_consumer_timeout}s")
+
+    def _evict(self, conn: Connection, reason: str):
+        """Drop a slow consumer so it cannot hold back the rest of the session"""
+        self.evicted_count += 1
+        logger.warning("Evicting slow consumer from session %s: %s", conn.session_id, reason)
+        self.disconnect(conn.websocket, conn.session_id)
+        asyncio.ensure_future(self._close_quietly(conn.websocket, code=1013))
+
+    async def _close_quietly(self, websocket: WebSocket, code: int = 1000):
+        try:
+            await websocket.close(code=code)
+        except Exception:
+            pass
+
+    async def _writer(self, conn: Connection):
+        websocket = conn.websocket
+        queue = conn.queue
+        try:
+            while True:
+                frame = await queue.get()
+                if frame is CLOSE:
+                    await self._close_quietly(websocket)
+                    return
+                started = time.perf_counter()
+                if isinstance(frame, str):
+                    await websocket.send_text(frame)
+                else:
+                    await websocket.send_bytes(frame)
+                SOCKET_SEND.observe(time.perf_counter() - started)
+        except asyncio.CancelledError:
+            pass
+        except Exception as e:
+            self.send_failures += 1
+            logger.error("Error sending to session %s: %s", conn.session_id, e)
+            conn.writer = None
+            self.disconnect(websocket, conn.session_id)
+
+    def _release(self, websocket: WebSocket):
+        """Stop the writer of a socket that left the session"""
+        conn = self.connections.pop(websocket, None)
+        if conn is None:
+            return
+        self.heartbeat.remove(conn)
+        if conn.writer is not None and conn.writer is not asyncio.current_task():
+            conn.writer.cancel()
 
     def get_connection_count(self, session_id: str) -> int:
         return len(self.active_connections.get(session_id, set()))
@@ -79,43 +372,78 @@ class ConnectionManager:
     def get_active_sessions(self) -> int:
         return len(self.active_connections)
 
-    async def terminate_session(self, session_id: str):
-        """Terminate a session and close all connections"""
+    async def terminate_session(self, session_id: str, reason: str = "session_terminated"):
+        """Terminate a session and close all connections on every worker"""
+        await self.broker.publish(TERMINATE, session_id, reason)
+        await self._terminate_local(session_id, reason)
+
+    async def _terminate_local(self, session_id: str, reason: str):
+        self.replay.drop(session_id)
+        message = control_frame(reason)
+        self._close_listeners(session_id, message)
         if session_id not in self.active_connections:
-            logger.info(f"Session {session_id} has no active connections")
+            self._release_subscription(session_id)
+            logger.info("Session %s has no active connections", session_id)
             return
 
         connections = list(self.active_connections[session_id])
-        logger.info(f"Terminating session {session_id} with {len(connections)} connections")
+        logger.info("Terminating session %s with %s connections", session_id, len(connections))
 
-        # Send termination message
+        # Queue the termination message followed by a close behind any pending frames
+        writers = []
         for connection in connections:
-            try:
-                await connection.send_text(json.dumps({
-                    "type": "session_terminated",
-                    "timestamp": datetime.utcnow().isoformat()
-                }))
-            except Exception as e:
-                logger.error(f"Failed to send termination message: {e}")
+            conn = self.connections.get(connection)
+            if conn is None:
+                continue
+            for frame in (message, CLOSE):
+                try:
+                    conn.queue.put_nowait(frame)
+                except asyncio.QueueFull:
+                    break
+            if conn.writer is not None:
+                writers.append(conn.writer)
 
-        # Wait for messages to be sent
-        await asyncio.sleep(0.5)
+        # All writers flush concurrently, bounded by the drain timeout
+        if writers:
+            await asyncio.wait(writers, timeout=self.drain_timeout)
 
-        # Close all connections
+        # Close whatever did not drain in time, all at once
+        stuck = []
         for connection in connections:
-            try:
-                await connection.close()
-            except:
-                pass
+            conn = self.connections.pop(connection, None)
+            if conn is None:
+                continue
+            self.heartbeat.remove(conn)
+            if conn.writer is not None and not conn.writer.done():
+                conn.writer.cancel()
+                stuck.append(self._close_quietly(connection))
+        if stuck:
+            await asyncio.gather(*stuck)
 
         # Clean up
         if session_id in self.active_connections:
             del self.active_connections[session_id]
-        
+            self._release_subscription(session_id)
+
         for conn in connections:
             if conn in self.connection_ids:
                 del self.connection_ids[conn]
             if conn in self.connection_times:
                 del self.connection_times[conn]
 
-        logger.info(f"Closed all connections for session {session_id}")
+        logger.info("Closed all connections for session %s", session_id)
+
+    def _close_listeners(self, session_id: str, message: str):
+        """Send the final event to every listener and end their streams"""
+        listeners = self.listeners.pop(session_id, None)
+        if listeners is None:
+            return
+        self._release_subscription(session_id)
+        for queue in listeners:
+            for frame in (message, CLOSE):
+                try:
+                    queue.put_nowait(frame)
+                except asyncio.QueueFull:
+                    # Make room so the stream still ends
+                    queue.get_nowait()
+                    queue.put_nowait(frame)
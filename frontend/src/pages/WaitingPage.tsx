@@ -33,43 +33,61 @@ const WaitingPage: React.FC = () => {
       setCode(sessionCode);
     }
 
-    // Poll for participant joining - faster polling
+    const goToChat = () => {
+      if (hasNavigated.current) return;
+      hasNavigated.current = true;
+
+      stopPolling();
+      unsubscribe();
+
+      // Connect WebSocket in background - don't wait for it
+      wsService.connect(sessionId).catch(console.error);
+
+      // Navigate immediately
+      navigate(`/chat/${sessionId}#${key}`, { replace: true });
+    };
+
+    // Fallback polling, only used if the event stream fails
     const poll = async () => {
       if (hasNavigated.current) return;
 
       try {
         const status = await api.getSessionStatus(sessionId);
-        
         if (status.status === 'active' && status.participant_count === 2) {
-          hasNavigated.current = true;
-
-          // Clear interval immediately
-          if (polling.current) {
-            clearInterval(polling.current);
-            polling.current = null;
-          }
-
-          // Connect WebSocket in background - don't wait for it
-          wsService.connect(sessionId).catch(console.error);
-
-          // Navigate immediately
-          navigate(`/chat/${sessionId}#${key}`, { replace: true });
+          goToChat();
         }
       } catch (err) {
         console.error('[WaitingPage] Poll failed:', err);
       }
     };
 
-    // Start polling - fast 1 second polling
-    poll();
-    polling.current = setInterval(poll, 1000);
-
-    return () => {
+    const stopPolling = () => {
       if (polling.current) {
         clearInterval(polling.current);
         polling.current = null;
       }
     };
+
+    // The server pushes participant_joined, so there is nothing to poll for
+    const unsubscribe = api.subscribeSessionEvents(
+      sessionId,
+      (event) => {
+        if (event.type === 'participant_joined' ||
+            (event.type === 'session_status' && event.participant_count === 2)) {
+          goToChat();
+        }
+      },
+      () => {
+        if (hasNavigated.current || polling.current) return;
+        poll();
+        polling.current = setInterval(poll, 5000);
+      }
+    );
+
+    return () => {
+      unsubscribe();
+      stopPolling();
+    };
   }, [sessionId, navigate]);
 
   const handleTerminate = async () => {
@@ -26,6 +26,18 @@ export interface ExtendSessionRequest {
   minutes: number;
 }
 
+export interface SessionEvent {
+  type: string;
+  session_id?: string;
+  participant_count?: number;
+  status?: string;
+  time_left?: number;
+  time_left_seconds?: number;
+  expires_at?: string;
+  extended_by?: number;
+  timestamp?: string;
+}
+
 export interface CodeJoinResponse {
   session_id: string;
   encryption_key: string;
@@ -127,6 +139,31 @@ class ChatllyAPI {
     return response.json();
   }
 
+  // Server-sent session events; returns a function that closes the stream
+  subscribeSessionEvents(
+    sessionId: string,
+    onEvent: (event: SessionEvent) => void,
+    onError?: () => void
+  ): () => void {
+    const source = new EventSource(`${this.baseUrl}/session/${sessionId}/events`);
+
+    source.onmessage = (message) => {
+      try {
+        onEvent(JSON.parse(message.data));
+      } catch (err) {
+        console.error('[API] Bad session event:', err);
+      }
+    };
+
+    source.onerror = () => {
+      // The server ends the stream after the final event; don't let the browser reconnect
+      source.close();
+      onError?.();
+    };
+
+    return () => source.close();
+  }
+
   async terminateSession(sessionId: string): Promise<{ status: string }> {
     const response = await fetch(`${this.baseUrl}/session/${sessionId}`, {
       method: 'DELETE',